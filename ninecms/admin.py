@@ -15,6 +15,8 @@ from mptt.admin import MPTTModelAdmin
 # noinspection PyPackageRequirements
 from guardian.shortcuts import get_objects_for_user
 from ninecms import models, forms, views
+from ninecms.signals import clear_content_caches
+from ninecms.utils.manytomany import AutocompleteSelectMultiple
 
 
 # noinspection PyMethodMayBeStatic
@@ -120,6 +122,7 @@ class NodeAdmin(admin.ModelAdmin):
         :return: None
         """
         r = queryset.update(status=True)
+        clear_content_caches()
         messages.success(request, _("%d nodes successfully updated as published.") % r)
     node_publish.short_description = _("Mark selected nodes status as published")
 
@@ -130,6 +133,7 @@ class NodeAdmin(admin.ModelAdmin):
         :return: None
         """
         r = queryset.update(status=False)
+        clear_content_caches()
         messages.success(request, _("%d nodes successfully updated as not published.") % r)
     node_unpublish.short_description = _("Mark selected nodes status as not published")
 
@@ -140,6 +144,7 @@ class NodeAdmin(admin.ModelAdmin):
         :return: None
         """
         r = queryset.update(promote=True)
+        clear_content_caches()
         messages.success(request, _("%d nodes successfully updated as promoted.") % r)
     node_promote.short_description = _("Mark selected nodes as promoted")
 
@@ -150,6 +155,7 @@ class NodeAdmin(admin.ModelAdmin):
         :return: None
         """
         r = queryset.update(promote=False)
+        clear_content_caches()
         messages.success(request, _("%d nodes successfully updated as not promoted.") % r)
     node_demote.short_description = _("Mark selected nodes as not promoted")
 
@@ -160,6 +166,7 @@ class NodeAdmin(admin.ModelAdmin):
         :return: None
         """
         r = queryset.update(sticky=True)
+        clear_content_caches()
         messages.success(request, _("%d nodes successfully updated as sticky.") % r)
     node_sticky.short_description = _("Mark selected nodes as sticky")
 
@@ -170,6 +177,7 @@ class NodeAdmin(admin.ModelAdmin):
         :return: None
         """
         r = queryset.update(sticky=False)
+        clear_content_caches()
         messages.success(request, _("%d nodes successfully updated as not sticky.") % r)
     node_unsticky.short_description = _("Mark selected nodes as not sticky")
 
@@ -325,7 +333,7 @@ class MenuItemAdmin(MPTTModelAdmin):
 @admin.register(models.ContentBlock)
 class ContentBlockAdmin(admin.ModelAdmin):
     """ Get a list of blocks """
-    list_display = ('name', 'type', 'node', 'menu_item', 'signal', 'page_types_list')
+    list_display = ('name', 'type', 'node', 'menu_item', 'signal', 'page_types_list', 'cache_seconds')
     list_filter = ['type']
     filter_vertical = ('page_types', )
 
@@ -347,7 +355,21 @@ class ContentBlockAdmin(admin.ModelAdmin):
 class TaxonomyTermAdmin(MPTTModelAdmin):
     """ Get a list of Taxonomy Terms """
     list_display = ('name', 'description_node', 'weight')
-    filter_vertical = ('nodes', )
+
+    def formfield_for_manytomany(self, db_field, request=None, **kwargs):
+        """ Use the autocomplete widget for nodes, which renders only the nodes of the term
+        The admin help text for multiple selects (hold down "Control") does not apply to the widget and is removed
+        :param db_field: the model field
+        :param request: the request object
+        :param kwargs: keyword arguments
+        :return: the form field
+        """
+        if db_field.name != 'nodes':
+            return super(TaxonomyTermAdmin, self).formfield_for_manytomany(db_field, request, **kwargs)
+        kwargs['widget'] = AutocompleteSelectMultiple('nodes')
+        field = super(TaxonomyTermAdmin, self).formfield_for_manytomany(db_field, request, **kwargs)
+        field.help_text = db_field.help_text
+        return field
 
 admin.site.site_header = _("9cms administration")
 admin.site.site_title = "9cms"
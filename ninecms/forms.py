@@ -9,8 +9,12 @@ from django.forms.models import inlineformset_factory
 from django.contrib.auth.models import Group
 from django.utils.translation import ugettext_lazy as _
 from ninecms.models import Node, Image, File, Video, ContentBlock, PageType, TaxonomyTerm
-from ninecms.utils.sanitize import sanitize, ModelSanitizeForm
-from ninecms.utils.manytomany import ManyToManyModelForm, ModelBiMultipleChoiceField
+from ninecms.utils.sanitize import sanitize, get_profile, ModelSanitizeForm
+from ninecms.utils.manytomany import ManyToManyModelForm, ModelBiMultipleChoiceField, register_autocomplete
+
+# The records searched by the autocomplete widgets of node terms and term nodes
+register_autocomplete('terms', TaxonomyTerm.objects.all(), 'name')
+register_autocomplete('nodes', Node.objects.all(), 'title', 'ninecms.change_taxonomyterm')
 
 
 class PageTypeForm(ManyToManyModelForm):
@@ -44,7 +48,7 @@ class ContentTypePermissionsForm(forms.Form):
 
 class ContentNodeEditForm(ManyToManyModelForm):
     """ Node edit or create form """
-    terms = ModelBiMultipleChoiceField(TaxonomyTerm.objects.all(), double_list="Terms")
+    terms = ModelBiMultipleChoiceField(TaxonomyTerm.objects.all(), autocomplete='terms')
 
     def __init__(self, *args, **kwargs):
         """ Get user object to check if has full_html permission
@@ -71,6 +75,9 @@ class ContentNodeEditForm(ManyToManyModelForm):
         for field in ('summary', 'body'):
             if field in cleaned_data:
                 cleaned_data[field] = sanitize(cleaned_data[field], full_html=full_html)
+        self.instance.set_sanitized(get_profile(full_html=full_html),
+                                    cleaned_data.get('summary', self.instance.summary),
+                                    cleaned_data.get('body', self.instance.body))
         return cleaned_data
 
     class Meta:
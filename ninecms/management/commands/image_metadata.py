@@ -0,0 +1,42 @@
+""" Management command for recording image metadata """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.core.management import BaseCommand
+from ninecms.models import Image
+from ninecms.utils.media import get_image_metadata
+
+
+class Command(BaseCommand):
+    help = "Records the width, height, format and size of images that have no metadata."
+
+    def add_arguments(self, parser):
+        """ Define command arguments
+        :param parser: the argument parser
+        :return: None
+        """
+        parser.add_argument('--all', action='store_true', dest='all', default=False,
+                            help="Record the metadata of all images.")
+
+    def handle(self, *args, **options):
+        """ Core function
+        Use update instead of save, in order to avoid the save signals
+        :param args: None
+        :param options: all
+        :return: None
+        """
+        images = Image.objects.exclude(image='').only('id', 'image')
+        if not options['all']:
+            images = images.filter(width=None)
+        recorded = 0
+        failed = 0
+        for image in images.iterator():
+            width, height, image_format, size = get_image_metadata(image.image)
+            if width is None:
+                failed += 1
+                continue
+            Image.objects.filter(id=image.id).update(width=width, height=height, format=image_format, size=size)
+            recorded += 1
+        self.stdout.write("Image metadata recorded: %d, failed: %d." % (recorded, failed))
@@ -0,0 +1,54 @@
+""" Management command for constructing image styles """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from concurrent.futures import as_completed
+from ninecms.models import Image
+from ninecms.utils.media import create_pool, create_styles, get_missing_styles, get_styles
+import os
+
+
+class Command(BaseCommand):
+    help = "Constructs all missing image styles of all images in parallel, one task per image, " \
+           "and records all image styles so that they are deleted along with the images."
+
+    def add_arguments(self, parser):
+        """ Define command arguments
+        :param parser: the argument parser
+        :return: None
+        """
+        parser.add_argument('--workers', type=int, default=settings.IMAGE_STYLE_WORKERS or os.cpu_count(),
+                            dest='workers', help="Number of workers.")
+
+    def handle(self, *args, **options):
+        """ Core function
+        :param args: None
+        :param options: workers
+        :return: None
+        """
+        storage = Image._meta.get_field('image').storage
+        created = 0
+        failed = 0
+        with create_pool(options['workers']) as pool:
+            futures = {}
+            for image in Image.objects.exclude(image='').only('id', 'image', 'width', 'height').iterator():
+                styles = get_missing_styles(storage, image.image.name)
+                image.record_styles(set(get_styles()) - set(styles))
+                if styles:
+                    source_size = (image.width, image.height) if image.width and image.height else None
+                    future = pool.submit(create_styles, storage, image.image.name, styles, source_size)
+                    futures[future] = (image, len(styles))
+            for future in as_completed(futures):
+                image, count = futures[future]
+                try:
+                    styles = future.result()
+                except OSError:
+                    styles = []
+                image.record_styles(styles)
+                created += len(styles)
+                failed += count - len(styles)
+        self.stdout.write("Image styles constructed: %d, failed: %d." % (created, failed))
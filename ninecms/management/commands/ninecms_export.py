@@ -0,0 +1,48 @@
+""" Management command for exporting content """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.core.management import BaseCommand
+import gzip
+from ninecms.utils.transfer import export_records, write_jsonl
+
+
+class Command(BaseCommand):
+    help = "Exports page types, nodes with their revisions and media, taxonomy terms, menu items and blocks " \
+           "as JSON Lines that `ninecms_import` can import."
+
+    def add_arguments(self, parser):
+        """ Define command arguments
+        :param parser: the argument parser
+        :return: None
+        """
+        parser.add_argument('path', nargs='?', default='-', help="Output file, default standard output.")
+        parser.add_argument('--compress', action='store_true', dest='compress', default=False,
+                            help="Compress the output with gzip, default if the file name ends with .gz.")
+        parser.add_argument('--chunk-size', type=int, default=500, dest='chunk_size',
+                            help="Number of records per query.")
+
+    def handle(self, *args, **options):
+        """ Core function
+        Records are streamed in chunks, so that memory does not depend on the amount of content
+        :param args: None
+        :param options: path, compress, chunk_size
+        :return: None
+        """
+        path = options['path']
+        records = export_records(options['chunk_size'])
+        if path == '-':
+            count = write_jsonl(records, self.stdout)
+            report = self.stderr
+        else:
+            if options['compress'] or path.endswith('.gz'):
+                f = gzip.open(path, 'wt', encoding='utf-8')
+            else:
+                f = open(path, 'w', encoding='utf-8')
+            with f:
+                count = write_jsonl(records, f)
+            report = self.stdout
+        report.write("Exported page types: %d, nodes: %d, terms: %d, menu items: %d, blocks: %d." % (
+            count['page_type'], count['node'], count['term'], count['menu_item'], count['block']))
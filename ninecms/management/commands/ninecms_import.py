@@ -0,0 +1,62 @@
+""" Management command for importing nodes in bulk """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+import gzip
+from ninecms.utils.transfer import NodeImporter, read_jsonl, read_csv
+
+
+class Command(BaseCommand):
+    help = "Imports nodes with their revisions, terms and media references from JSON Lines or csv files, " \
+           "or the content exported with `ninecms_export`."
+
+    def add_arguments(self, parser):
+        """ Define command arguments
+        :param parser: the argument parser
+        :return: None
+        """
+        parser.add_argument('path', nargs='+', help="Files to import, gzip compressed if ending with .gz.")
+        parser.add_argument('--format', choices=('jsonl', 'csv'), dest='format',
+                            help="File format, default by file extension.")
+        parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+                            help="Number of records per transaction.")
+        parser.add_argument('--user', dest='user',
+                            help="Username of the user of records that have no user.")
+        parser.add_argument('--no-revisions', action='store_false', dest='revisions', default=True,
+                            help="Do not create revisions.")
+        parser.add_argument('--no-reindex', action='store_false', dest='reindex', default=True,
+                            help="Do not update the search index.")
+
+    def handle(self, *args, **options):
+        """ Core function
+        Records are imported in batches with no model signals; caches are cleared and nodes indexed once at the end
+        :param args: None
+        :param options: path, format, batch_size, user, revisions, reindex
+        :return: None
+        """
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError("User '%s' does not exist." % options['user'])
+        for path in options['path']:
+            compressed = path.lower().endswith('.gz')
+            file_format = options['format'] or ('csv' if path.lower().endswith(('.csv', '.csv.gz')) else 'jsonl')
+            reader = read_csv if file_format == 'csv' else read_jsonl
+            importer = NodeImporter(user, options['batch_size'], options['revisions'], options['reindex'])
+            try:
+                if compressed:
+                    f = gzip.open(path, 'rt', encoding='utf-8', newline='')
+                else:
+                    f = open(path, encoding='utf-8', newline='')
+                with f:
+                    count = importer.run(reader(f))
+            except (IOError, ValueError) as e:
+                raise CommandError("%s: %s" % (path, e))
+            for number, message in importer.errors:
+                self.stderr.write("%s, record %d: %s" % (path, number, message))
+            self.stdout.write("Nodes imported from %s: %d, failed: %d." % (path, count, len(importer.errors)))
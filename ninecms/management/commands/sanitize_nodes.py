@@ -0,0 +1,65 @@
+""" Management command for sanitizing the html fields of nodes """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from ninecms.models import Node
+from ninecms.signals import clear_content_caches
+from ninecms.utils.perms import get_users_with_perm
+from ninecms.utils.sanitize import get_signature, parse_signature
+
+
+class Command(BaseCommand):
+    help = "Sanitizes the summary and body of nodes that have not been sanitized with the current profile version."
+
+    def add_arguments(self, parser):
+        """ Define command arguments
+        :param parser: the argument parser
+        :return: None
+        """
+        parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+                            help="Number of nodes per query.")
+        parser.add_argument('--all', action='store_true', dest='all', default=False,
+                            help="Sanitize all nodes.")
+
+    def handle(self, *args, **options):
+        """ Core function
+        Nodes are read in batches of ascending id, each batch is updated in a transaction
+        Nodes not sanitized before get the full html profile if their user has permission to use it
+        Use update instead of save, in order to avoid the save signals; caches are cleared once at the end
+        :param args: None
+        :param options: batch_size, all
+        :return: None
+        """
+        nodes = Node.objects.only('id', 'user', 'summary', 'body', 'sanitized').order_by('id')
+        if not options['all']:
+            nodes = nodes.exclude(sanitized__in=[get_signature('html'), get_signature('full_html')])
+        full_html_users = get_users_with_perm('use_full_html')
+        count = 0
+        changed = 0
+        last_id = 0
+        while True:
+            batch = list(nodes.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            with transaction.atomic():
+                for node in batch:
+                    profile = parse_signature(node.sanitized) or \
+                        ('full_html' if node.user_id in full_html_users else 'html')
+                    loaded = (node.summary, node.body, node.sanitized)
+                    if options['all']:
+                        node.sanitized = ''
+                    node.sanitize_html(profile)
+                    if (node.summary, node.body) != loaded[:2]:
+                        changed += 1
+                    if (node.summary, node.body, node.sanitized) != loaded:
+                        Node.objects.filter(id=node.id).update(summary=node.summary, body=node.body,
+                                                               sanitized=node.sanitized)
+            count += len(batch)
+            last_id = batch[-1].id
+        if changed:
+            clear_content_caches()
+        self.stdout.write("Nodes sanitized: %d, html changed: %d." % (count, changed))
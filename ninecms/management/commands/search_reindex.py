@@ -0,0 +1,29 @@
+""" Management command for rebuilding the search index """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.core.management import BaseCommand
+from ninecms.utils.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the search index of all nodes."
+
+    def add_arguments(self, parser):
+        """ Define command arguments
+        :param parser: the argument parser
+        :return: None
+        """
+        parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+                            help="Number of nodes or index rows per query.")
+
+    def handle(self, *args, **options):
+        """ Core function
+        :param args: None
+        :param options: batch_size
+        :return: None
+        """
+        count = get_search_backend().reindex(options['batch_size'])
+        self.stdout.write("Search index rebuilt for %d nodes." % count)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 19:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ninecms', '0013_auto_20160117_1209'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contentblock',
+            name='cache_seconds',
+            field=models.PositiveIntegerField(default=0, help_text='Cache the block for this number of seconds, 0 to disable (not applicable to forms).', verbose_name='cache seconds'),
+        ),
+        migrations.AddField(
+            model_name='contentblock',
+            name='cache_vary',
+            field=models.CharField(blank=True, choices=[('', 'None: same on every page'), ('language', 'Language'), ('auth', 'Language and user authentication'), ('path', 'Language, user authentication and page path')], default='language', help_text='What the cached block depends on.', max_length=20, verbose_name='cache vary'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 19:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ninecms', '0014_auto_20261018_1925'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=50, verbose_name='term')),
+                ('weight', models.IntegerField(default=0, verbose_name='weight')),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ninecms.Node', verbose_name='node')),
+            ],
+            options={
+                'verbose_name': 'search index',
+                'verbose_name_plural': 'search index',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchindex',
+            unique_together=set([('term', 'node')]),
+        ),
+    ]
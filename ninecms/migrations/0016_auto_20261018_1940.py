@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 19:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ninecms', '0015_auto_20261018_1931'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='format',
+            field=models.CharField(blank=True, editable=False, max_length=10, verbose_name='format'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='height'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='size',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='size in bytes'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='width'),
+        ),
+    ]
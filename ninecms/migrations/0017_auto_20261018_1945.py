@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 19:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ninecms', '0016_auto_20261018_1940'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageDerivative',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('style', models.CharField(max_length=50, verbose_name='style')),
+                ('name', models.CharField(max_length=255, verbose_name='name')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='derivatives', to='ninecms.Image', verbose_name='image')),
+            ],
+            options={
+                'verbose_name': 'image derivative',
+                'verbose_name_plural': 'image derivatives',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='imagederivative',
+            unique_together=set([('image', 'name')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 20:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ninecms', '0017_auto_20261018_1945'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='sanitized',
+            field=models.CharField(blank=True, editable=False, max_length=50, verbose_name='sanitized'),
+        ),
+    ]
@@ -6,21 +6,23 @@ __email__ = 'gkarak@9-dev.com'
 
 from django.db import models
 from django.contrib.auth.models import User
+from django import dispatch
 from django.utils import timezone
-from django.utils.dateformat import DateFormat
 from django.conf import global_settings
 from django.utils.translation import ugettext_lazy as _
 from mptt.models import MPTTModel, TreeForeignKey
-from ninecms.utils.nodes import get_full_path
+from ninecms.utils.nodes import get_full_path, get_menu_full_path, compile_alias_pattern
 from ninecms.utils.media import image_path_file_name, file_path_file_name, validate_file_ext, video_path_file_name, \
-    validate_video_ext
-from ninecms.utils.transliterate import transliterate
-import re
+    validate_video_ext, get_image_metadata, get_style_name, get_styles
+from ninecms.utils.sanitize import cleaners, get_signature, parse_signature
 
 """
 Node System
 """
 
+# sent when a node is saved with a changed route (alias, language or access fields), after its alias is final
+route_changed = dispatch.Signal(providing_args=['instance', 'alias'])
+
 
 class PageType(models.Model):
     """ Page Type Model: acts as a single page layout """
@@ -87,6 +89,21 @@ class Node(models.Model):
     weight = models.IntegerField(default=0, verbose_name=_("order weight"))
     alias = models.CharField(max_length=255, blank=True, db_index=True, verbose_name=_("alias"))
     redirect = models.BooleanField(default=0, verbose_name=_("redirect"))
+    sanitized = models.CharField(max_length=50, blank=True, editable=False, verbose_name=_("sanitized"))
+
+    def __init__(self, *args, **kwargs):
+        """ Keep the loaded html fields, so that they are sanitized on save only if changed
+        Keep the loaded alias, so that its uniqueness is checked on save only if changed
+        Keep the loaded route, so that the alias routing table is invalidated on save only if changed
+        Deferred fields are not loaded
+        :param args
+        :param kwargs
+        :return: None
+        """
+        super(Node, self).__init__(*args, **kwargs)
+        self._sanitized_text = (self.__dict__.get('summary'), self.__dict__.get('body'))
+        self._loaded_alias = (self.__dict__.get('alias'), self.__dict__.get('language'))
+        self._loaded_route = self.get_route_values()
 
     def __str__(self):
         """ Get model name
@@ -94,6 +111,45 @@ class Node(models.Model):
         """
         return self.title
 
+    def get_sanitize_profile(self):
+        """ Get the sanitize profile of the html fields
+        This is the profile last recorded, or else full html if the user of the node has permission to use it
+        :return: the profile name
+        """
+        profile = parse_signature(self.sanitized)
+        if profile:
+            return profile
+        return 'full_html' if self.user_id and self.user.has_perm('ninecms.use_full_html') else 'html'
+
+    def set_sanitized(self, profile, summary, body):
+        """ Record that the html fields have been sanitized with a profile, eg by a form
+        :param profile: the profile name
+        :param summary: the sanitized summary
+        :param body: the sanitized body
+        :return: None
+        """
+        self.sanitized = get_signature(profile)
+        self._sanitized_text = (summary, body)
+
+    def sanitize_html(self, profile=None):
+        """ Sanitize the html fields (summary and body) with a profile and record the profile signature
+        Fields are not sanitized again if unchanged since sanitized with the same profile version
+        Deferred fields are not sanitized (and not saved)
+        :param profile: the profile name, default `get_sanitize_profile`
+        :return: True if any field has been sanitized
+        """
+        profile = profile or self.get_sanitize_profile()
+        signature = get_signature(profile)
+        unchanged = self.__dict__.get('sanitized') == signature
+        sanitized = False
+        for field, text in zip(('summary', 'body'), self._sanitized_text):
+            if field in self.__dict__ and not (unchanged and self.__dict__[field] == text):
+                setattr(self, field, cleaners[profile].clean(self.__dict__[field]))
+                sanitized = True
+        if 'summary' in self.__dict__ and 'body' in self.__dict__:
+            self.set_sanitized(profile, self.summary, self.body)
+        return sanitized
+
     def get_absolute_url(self):
         """ Get the full path for the node
         Consider to prefetch urlalias_set
@@ -110,30 +166,58 @@ class Node(models.Model):
         """
         return get_full_path(self.link, self.language)
 
+    def get_route_values(self):
+        """ Get the values of the fields that route a request to the node, see `ninecms.utils.aliases.Route`
+        Deferred fields are None
+        :return: tuple of alias, language, status, redirect, link, page type id
+        """
+        fields = ('alias', 'language', 'status', 'redirect', 'link', 'page_type_id')
+        return tuple(self.__dict__.get(field) for field in fields)
+
+    def alias_exists(self, alias):
+        """ Check if another node has an alias in the language of the node
+        :param alias: the alias to check
+        :return: boolean
+        """
+        nodes = Node.objects.filter(alias=alias, language=self.language)
+        if self.id:
+            nodes = nodes.exclude(id=self.id)
+        return nodes.exists()
+
     def save(self, *args, **kwargs):
-        """ Override save method to format alias
-        After calling parent save, use update in order to avoid issues with new records that get assigned an id
+        """ Override save method to sanitize html fields and format alias
+        Html fields are sanitized on write, so that they can be rendered as safe, see `sanitize_html`
+        The alias is rendered from the compiled url pattern of the page type
+        If the alias exists for another node of the same language, the node id is appended
+        Uniqueness is checked only if the alias or the language have changed, before insert if possible
+        If the alias requires the id of a new node, it is updated after insert in a single query
         Not used signals to avoid recursion issues
+        Once the alias is final, `route_changed` is sent if the node is new or any of its route fields has changed
         :param args
         :param kwargs
         :return: None
         """
+        adding = self._state.adding
+        self.sanitize_html()
         if not self.alias and self.page_type.url_pattern:
-            self.alias = self.page_type.url_pattern\
-                .replace('[node:title]', transliterate(self.title, False, True))
-            regex = re.compile('\[node:(created|changed):(\w\W\w\W\w)\]')
-            dates = regex.search(self.alias)
-            if dates:
-                date_field = self.created if dates.group(1) == 'created' else self.changed
-                date_field = DateFormat(date_field).format(dates.group(2))
-                self.alias = self.alias.replace(dates.group(0), date_field)
-        super(Node, self).save(*args, **kwargs)
-        if self.alias.find('[node:id]') >= 0:
+            self.alias = compile_alias_pattern(self.page_type.url_pattern).render(self)
+        if self.id:
             self.alias = self.alias.replace('[node:id]', str(self.id))
+        check = bool(self.alias) and (self._state.adding or self._loaded_alias != (self.alias, self.language))
+        has_id = '[node:id]' in self.alias
+        duplicate = check and not has_id and self.alias_exists(self.alias)
+        super(Node, self).save(*args, **kwargs)
+        if has_id or duplicate:
+            alias = self.alias.replace('[node:id]', str(self.id))
+            if duplicate or check and self.alias_exists(alias):
+                alias = '%s/%d' % (alias, self.id)
+            self.alias = alias
             Node.objects.filter(id=self.id).update(alias=self.alias)
-        if self.alias and Node.objects.filter(alias=self.alias).filter(language=self.language).count() > 1:
-            self.alias = '%s/%d' % (self.alias, self.id)
-            Node.objects.filter(id=self.id).update(alias=self.alias)
+        self._loaded_alias = (self.alias, self.language)
+        route, loaded_alias = self.get_route_values(), self._loaded_route[0]
+        if (adding or route != self._loaded_route) and (self.alias or loaded_alias):
+            route_changed.send(sender=Node, instance=self, alias=loaded_alias or '')
+        self._loaded_route = route
 
     class Meta:
         """ Model meta """
@@ -171,6 +255,25 @@ class NodeRevision(models.Model):
         verbose_name = _("node revision")
         verbose_name_plural = _("node revisions")
 
+
+class SearchIndex(models.Model):
+    """ Search Index Model: inverted index of normalized terms to nodes, maintained by the index search backend """
+    term = models.CharField(max_length=50, verbose_name=_("term"))
+    node = models.ForeignKey(Node, verbose_name=_("node"))
+    weight = models.IntegerField(default=0, verbose_name=_("weight"))
+
+    def __str__(self):
+        """ Get model name
+        :return: model name
+        """
+        return self.term
+
+    class Meta:
+        """ Model meta """
+        unique_together = ('term', 'node')
+        verbose_name = _("search index")
+        verbose_name_plural = _("search index")
+
 """
 Menu System
 """
@@ -196,17 +299,7 @@ class MenuItem(MPTTModel):
         @see 9cms_menu_full_path.ods
         :return: full path string
         """
-        path = self.path
-        if path.startswith('http:') or path.startswith('https:'):
-            return path
-        if path.startswith('#'):
-            return path
-        bookmark = ''
-        bookmark_pos = path.find('#')
-        if bookmark_pos > 0:
-            bookmark = path[bookmark_pos:]
-            path = path[:bookmark_pos]
-        return get_full_path(path, self.language, bookmark)
+        return get_menu_full_path(self.path, self.language)
 
     class MPTTMeta:
         """ Set order when inserting items for mptt """
@@ -283,6 +376,25 @@ class ContentBlock(models.Model):
         related_name='blocks',
         verbose_name=_("page types"),
     )
+    cache_seconds = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("cache seconds"),
+        help_text=_("Cache the block for this number of seconds, 0 to disable (not applicable to forms)."),
+    )
+    CACHE_VARY = (
+        ('', _("None: same on every page")),
+        ('language', _("Language")),
+        ('auth', _("Language and user authentication")),
+        ('path', _("Language, user authentication and page path")),
+    )
+    cache_vary = models.CharField(
+        max_length=20,
+        choices=CACHE_VARY,
+        default='language',
+        blank=True,
+        verbose_name=_("cache vary"),
+        help_text=_("What the cached block depends on."),
+    )
 
     def __str__(self):
         """ Get block name
@@ -353,6 +465,51 @@ class Media(models.Model):
 class Image(Media):
     """ Image Model: the basic image record """
     image = models.ImageField(upload_to=image_path_file_name, max_length=255, verbose_name=_("image"))
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name=_("width"))
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name=_("height"))
+    format = models.CharField(max_length=10, blank=True, editable=False, verbose_name=_("format"))
+    size = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name=_("size in bytes"))
+
+    def __init__(self, *args, **kwargs):
+        """ Keep the initial image name to detect changes on save
+        A deferred image is not loaded
+        :param args
+        :param kwargs
+        :return: None
+        """
+        super(Image, self).__init__(*args, **kwargs)
+        self._image_name = self.get_image_name()
+
+    def get_image_name(self):
+        """ Get the name of the image if loaded, without loading a deferred image
+        :return: the image name or None if deferred
+        """
+        image = self.__dict__.get('image')
+        return getattr(image, 'name', image)
+
+    def save(self, *args, **kwargs):
+        """ Override save method to record the image metadata when the image is uploaded or changed
+        A deferred image is not loaded (and not saved)
+        :param args
+        :param kwargs
+        :return: None
+        """
+        image = self.image if 'image' in self.__dict__ else None
+        if image and (self.width is None or not image._committed or image.name != self._image_name):
+            self.width, self.height, self.format, self.size = get_image_metadata(image)
+        super(Image, self).save(*args, **kwargs)
+        self._image_name = self.get_image_name()
+
+    def record_styles(self, styles):
+        """ Record the image style files of the image, so that they are deleted along with the image
+        :param styles: a list of style names
+        :return: None
+        """
+        style_defs = get_styles()
+        names = {get_style_name(self.image.name, style, style_defs): style for style in styles}
+        recorded = set(self.derivatives.filter(name__in=list(names)).values_list('name', flat=True))
+        ImageDerivative.objects.bulk_create(ImageDerivative(image=self, style=style, name=name)
+                                            for name, style in names.items() if name not in recorded)
 
     class Meta:
         """ Model meta """
@@ -360,6 +517,25 @@ class Image(Media):
         verbose_name_plural = _("images")
 
 
+class ImageDerivative(models.Model):
+    """ Image Derivative Model: an image style file of an image, recorded in order to be deleted along """
+    image = models.ForeignKey(Image, related_name='derivatives', verbose_name=_("image"))
+    style = models.CharField(max_length=50, verbose_name=_("style"))
+    name = models.CharField(max_length=255, verbose_name=_("name"))
+
+    def __str__(self):
+        """ Get model name
+        :return: model name
+        """
+        return self.name
+
+    class Meta:
+        """ Model meta """
+        unique_together = ('image', 'name')
+        verbose_name = _("image derivative")
+        verbose_name_plural = _("image derivatives")
+
+
 class File(Media):
     """ File Model: a file field """
     file = models.FileField(upload_to=file_path_file_name, max_length=255, validators=[validate_file_ext],
@@ -315,6 +315,30 @@ IMAGE_STYLES = {
 
 # Update image styles in project settings such as:
 # IMAGE_STYLES.update({})
+# Responsive styles construct a thumbnail for each width, for use with the `image_srcset` filter, such as:
+# IMAGE_STYLES.update({'responsive': {'type': 'responsive', 'widths': (320, 640, 1280)}})
+# Styles can define an output `format` and `quality`, and alternative output `formats` for the `picture` tag, such as:
+# IMAGE_STYLES.update({'photo': {'type': 'thumbnail', 'size': (800, 800), 'quality': 80, 'formats': ('webp',)}})
+
+# Engine to construct image styles: imagemagick or pillow
+# Pillow processes images in memory without spawning processes, falling back to ImageMagick for unreadable images
+IMAGE_STYLE_ENGINE = 'imagemagick'
+
+# Number of workers to construct image styles in the background (0 to construct them when first requested)
+# If set, all image styles are constructed when an image is saved,
+# and templates get the placeholder or the original image url until a style is ready
+IMAGE_STYLE_WORKERS = 0
+
+# Type of the image style worker pool: thread or process
+IMAGE_STYLE_POOL = 'thread'
+
+# Url of an image to use until an image style is ready (empty to use the original image)
+IMAGE_STYLE_PLACEHOLDER = ''
+
+# Restrict transliteration to these languages, in order of precedence (None for all registered languages)
+# Built-in languages: el, rs, rs_latin, ru, bg; more can be added with `ninecms.utils.transliterate.register_language`
+# Set to () for sites with latin content only
+TRANSLITERATE_LANGUAGES = None
 
 # Define characters to remove at transliteration
 TRANSLITERATE_REMOVE = '"\'`,:;|{[}]+=*&%^$#@!~()?<>'
@@ -328,3 +352,41 @@ LANGUAGE_MENU_LABELS = 'name'
 
 # Enable i18n urls for 9cms
 I18N_URLS = True
+
+# Resolve url aliases from a per-process routing table instead of querying the database on every request
+# With multiple workers a shared cache backend (eg memcached) is required to keep the tables coherent
+ALIAS_CACHE = False
+
+# Mirror the alias routing table in the default cache so that workers can share loaded routes
+ALIAS_CACHE_MIRROR = True
+
+# Cache the rendered pages of nodes for this number of seconds (0 to disable)
+# Pages with a query string, a form in session, pending messages or a CSRF token are never cached
+# Use instead of the site-wide cache middleware, which does not respect sessions and messages
+PAGE_CACHE_SECONDS = 0
+
+# Provide menu blocks as compiled menu trees instead of menu item querysets
+# Compiled trees are cached, have resolved paths and exclude disabled and other language items
+# Use with the `block_menu_tree.html` template instead of `recursetree` templates
+MENU_TREES = False
+
+# The search backend as a dotted path to its class
+# Use 'ninecms.utils.search.IndexSearchBackend' for ranked search on an inverted index stored in the database,
+# then run the `search_reindex` command once to index existing content
+SEARCH_BACKEND = 'ninecms.utils.search.SimpleSearchBackend'
+
+# Number of search results per page
+SEARCH_RESULTS_PER_PAGE = 10
+
+# Maximum number of search results per page that can be requested with the `size` query parameter
+SEARCH_RESULTS_MAX_PER_PAGE = 50
+
+# Maximum number of search results that can be paged through
+SEARCH_RESULTS_MAX = 1000
+
+# Number of summary characters to load and maximum number of words to show as search result excerpt
+SEARCH_EXCERPT_LENGTH = 1000
+SEARCH_EXCERPT_WORDS = 50
+
+# Number of records per page of the autocomplete widget search results
+AUTOCOMPLETE_RESULTS_PER_PAGE = 20
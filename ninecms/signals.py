@@ -5,20 +5,34 @@ __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
 from django import dispatch
-from django.db.models.signals import pre_delete
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import pre_delete, post_save, post_delete, m2m_changed
 from django.contrib.contenttypes.models import ContentType
 # noinspection PyPackageRequirements
 from guardian.models import GroupObjectPermission
-from ninecms.models import TaxonomyTerm, Node, PageType, Video, Image, File
-from ninecms.utils.media import delete_all
+from ninecms.models import TaxonomyTerm, Node, PageType, Video, Image, File, MenuItem, ContentBlock, \
+    ImageDerivative, route_changed
+from ninecms.utils.media import delete_all, schedule_styles, forget_styles, get_styles
+from ninecms.utils.aliases import alias_table
+from ninecms.utils.cache import bump_version
+from ninecms.utils.layouts import is_layout_reference
+from ninecms.utils.search import get_search_backend
 
 
 # noinspection PyUnusedLocal
-@dispatch.receiver(pre_delete)
+@dispatch.receiver(pre_delete, sender=PageType)
+@dispatch.receiver(pre_delete, sender=Image)
+@dispatch.receiver(pre_delete, sender=ImageDerivative)
+@dispatch.receiver(pre_delete, sender=Video)
+@dispatch.receiver(pre_delete, sender=File)
 def pre_delete_tasks(sender, instance, **kwargs):
     """ Delete all relevant permissions from guardian as there is no foreign key to the object
     http://django-guardian.readthedocs.org/en/stable/userguide/caveats.html
     Delete the respective file when an image, a video or a file record is to be deleted
+    Remove the styles of an image from the image style registry
+    Delete the image style files recorded for an image: these are collected in batches on image or node delete
+    Receivers are bound to their senders, so that other models (eg the search index) can be deleted in bulk
     :param sender: the model to be deleted
     :param instance: the page type object to be deleted
     :param kwargs: other arguments
@@ -28,11 +42,122 @@ def pre_delete_tasks(sender, instance, **kwargs):
         content_type = ContentType.objects.get_for_model(instance)
         GroupObjectPermission.objects.filter(content_type=content_type, object_pk=instance.pk).delete()
     elif sender == Image:
-        delete_all(instance.image.path)
+        forget_styles(instance.image.name, instance.size)
+        instance.image.storage.delete(instance.image.name)
+    elif sender == ImageDerivative:
+        Image._meta.get_field('image').storage.delete(instance.name)
     elif sender == Video:
-        delete_all(instance.video.path)
+        delete_all(instance.video)
     elif sender == File:
-        delete_all(instance.file.path)
+        delete_all(instance.file)
+
+
+def clear_content_caches():
+    """ Invalidate the url alias routing table, the menu trees, the block layouts and the page cache
+    To be called after bulk changes that do not send model signals, eg queryset `update()` or menu `rebuild()`
+    :return: None
+    """
+    alias_table.clear()
+    bump_version('menu')
+    bump_version('layout')
+    bump_version('content')
+
+
+# noinspection PyUnusedLocal
+@dispatch.receiver([post_save, post_delete], sender=Node)
+@dispatch.receiver([post_save, post_delete], sender=PageType)
+@dispatch.receiver([post_save, post_delete], sender=MenuItem)
+@dispatch.receiver([post_save, post_delete], sender=ContentBlock)
+@dispatch.receiver([post_save, post_delete], sender=TaxonomyTerm)
+@dispatch.receiver([post_save, post_delete], sender=Image)
+@dispatch.receiver([post_save, post_delete], sender=File)
+@dispatch.receiver([post_save, post_delete], sender=Video)
+def content_changed_tasks(sender, instance, **kwargs):
+    """ Update the url alias routing table when a node is deleted
+    Update the search index when a node is saved; index entries of deleted nodes are deleted along
+    Invalidate the compiled menu trees when a menu item is saved or deleted
+    Invalidate the block layouts when any block or any content referenced by blocks is saved or deleted
+    Invalidate the page cache when any rendered content is saved or deleted, as blocks may render any content:
+    nodes that are or were published, their media, and menus, blocks, page types and terms
+    :param sender: the model that has been saved or deleted
+    :param instance: the object that has been saved or deleted
+    :param kwargs: other arguments
+    :return: None
+    """
+    if sender == Node:
+        if kwargs.get('created') is None:
+            alias_table.discard(instance.id, instance.alias)
+        else:
+            get_search_backend().update(instance)
+    elif sender == MenuItem:
+        bump_version('menu')
+    if sender in (PageType, ContentBlock) or sender in (Node, MenuItem) and is_layout_reference(instance):
+        bump_version('layout')
+    if sender in (PageType, MenuItem, ContentBlock, TaxonomyTerm) or sender == Node and is_rendered(instance):
+        bump_version('content')
+    elif sender in (Image, File, Video) and is_rendered(instance.__dict__.get('_node_cache')):
+        bump_version('content')
+
+
+def is_rendered(node):
+    """ Check if a node that has been saved or deleted may have been rendered in cached pages or blocks
+    Only anonymous pages are cached, therefore the node is rendered if published either before or after the change
+    A node with a deferred status or a media object with no loaded node is considered rendered
+    :param node: the node object, or None if unknown
+    :return: boolean
+    """
+    if node is None:
+        return True
+    return any(status is None or status for status in (node.__dict__.get('status'), node._loaded_route[2]))
+
+
+# noinspection PyUnusedLocal
+@dispatch.receiver(route_changed, sender=Node)
+def route_changed_tasks(sender, instance, alias, **kwargs):
+    """ Update the url alias routing table when a node is saved with a new alias or changed route fields
+    Sent by `Node.save` after the alias is final, so that the final alias is discarded, not a temporary one
+    :param sender: the node model
+    :param instance: the node object that has been saved
+    :param alias: the previous alias of the node
+    :param kwargs: other arguments
+    :return: None
+    """
+    alias_table.discard(instance.id, alias, instance.alias)
+
+
+# noinspection PyUnusedLocal
+@dispatch.receiver(post_save, sender=Image)
+def image_saved_tasks(sender, instance, **kwargs):
+    """ Record the style files of all image styles when an image is uploaded or changed, so that they are deleted
+    along with the image, whether constructed in the background or when first requested
+    Construct all image styles in the background, if IMAGE_STYLE_WORKERS is set
+    :param sender: the image model
+    :param instance: the image object that has been saved
+    :param kwargs: other arguments
+    :return: None
+    """
+    name = instance.get_image_name()
+    if name and (kwargs['created'] or name != instance._image_name):
+        instance.record_styles(get_styles())
+        if settings.IMAGE_STYLE_WORKERS:
+            storage, name = instance.image.storage, instance.image.name
+            source_size = (instance.width, instance.height) if instance.width and instance.height else None
+            transaction.on_commit(lambda: schedule_styles(storage, name, source_size))
+
+
+# noinspection PyUnusedLocal
+@dispatch.receiver(m2m_changed, sender=ContentBlock.page_types.through)
+@dispatch.receiver(m2m_changed, sender=TaxonomyTerm.nodes.through)
+def content_relations_changed_tasks(sender, **kwargs):
+    """ Invalidate the block layouts when blocks are assigned to page types
+    Invalidate the page cache when blocks are assigned to page types or nodes to terms
+    :param sender: the intermediate m2m model
+    :param kwargs: other arguments
+    :return: None
+    """
+    if sender == ContentBlock.page_types.through:
+        bump_version('layout')
+    bump_version('content')
 
 
 block_signal = dispatch.Signal(providing_args=['view', 'request'])
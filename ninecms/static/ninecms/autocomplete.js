@@ -0,0 +1,88 @@
+/**
+ * @file autocomplete.js
+ * Provide the autocomplete multiple select widget for 9cms forms
+ * The select lists the selected records; other records are searched by prefix and added from the results list
+ *
+ * @author
+ * George Karakostas
+ *
+ * @copyright
+ * (c) 2015 George Karakostas
+ *
+ * @license
+ * BSD-3
+ *
+ * @email
+ * gkarak@9-dev.com
+ */
+
+(function($) {
+    /**
+     * Set up an autocomplete widget on a multiple select
+     * Typing in the search input requests the first page of matching records after a short delay,
+     * the last result item requests the next page if there are more
+     * Clicking a result adds it to the select, double clicking an option in the select removes it
+     * All options of the select are submitted
+     */
+    $.fn.autocompleteSelect = function() {
+        return this.each(function() {
+            var select = $(this);
+            var input = $('<input type="text" class="vTextField autocomplete-input" placeholder="Search">');
+            var results = $('<ul class="autocomplete-results"></ul>');
+            var timer = null;
+            var request = null;
+
+            /**
+             * Request a page of results for the current input
+             *
+             * @param page: the page number
+             */
+            function search(page) {
+                if (request) {
+                    request.abort();
+                }
+                request = $.getJSON(select.data('url'), {term: input.val(), page: page}, function(json) {
+                    if (page === 1) {
+                        results.empty();
+                    }
+                    results.find('.autocomplete-more').remove();
+                    $.each(json.results, function(i, record) {
+                        if (!select.find('option[value="' + record.id + '"]').length) {
+                            $('<li class="autocomplete-result"></li>')
+                                .text(record.text)
+                                .data('id', record.id)
+                                .appendTo(results);
+                        }
+                    });
+                    if (json.more) {
+                        $('<li class="autocomplete-more">...</li>').data('page', page + 1).appendTo(results);
+                    }
+                });
+            }
+
+            input.on('input', function() {
+                clearTimeout(timer);
+                timer = setTimeout(function() { search(1); }, 300);
+            });
+            results.on('click', '.autocomplete-result', function() {
+                var t = $(this);
+                $('<option selected="selected"></option>').val(t.data('id')).text(t.text()).appendTo(select);
+                t.remove();
+            });
+            results.on('click', '.autocomplete-more', function() {
+                search($(this).data('page'));
+            });
+            select.on('dblclick', 'option', function() {
+                $(this).remove();
+            });
+            select.closest('form').on('submit', function() {
+                select.find('option').prop('selected', true);
+            });
+            select.before(input).after(results);
+        });
+    };
+
+    $(document).ready(function() {
+        $('select.autocomplete-select').autocompleteSelect();
+    });
+})(window.django && django.jQuery || jQuery);
@@ -7,9 +7,11 @@ __email__ = 'gkarak@9-dev.com'
 from django import template
 from django.template.defaultfilters import stringfilter
 from django.template import Context
-from ninecms.utils.media import image_style as util_image
+from ninecms.utils.media import image_style as util_image, image_style_size as util_image_size, \
+    image_srcset as util_image_srcset, image_picture as util_image_picture
 from ninecms.utils.transliterate import upper_no_intonation as util_upper
 from ninecms.utils.nodes import get_clean_url
+from ninecms.utils.menus import EMPTY_TRAIL
 from ninecms.utils import status
 
 
@@ -26,6 +28,40 @@ def image_style(image, style):
     return util_image(image, style)
 
 
+@register.filter
+def image_style_size(image, style):
+    """ Return the size of different image style, from the stored image size
+    Use to set the width and height attributes of images
+    :param image: An image field file
+    :param style: Specify style to return size
+    :return: a tuple of width and height, or None if the image size is not stored
+    """
+    return util_image_size(image, style)
+
+
+@register.filter
+def image_srcset(image, style):
+    """ Return the srcset of a responsive image style, with the url and width of each variant
+    :param image: An image field file
+    :param style: Specify responsive style
+    :return: srcset attribute value
+    """
+    return util_image_srcset(image, style)
+
+
+@register.inclusion_tag('ninecms/picture.html')
+def picture(image, style, alt='', sizes='', css_class=''):
+    """ Render a picture element for an image style, with a source for each alternative output format of the style
+    :param image: An image field file
+    :param style: Specify style, may be responsive
+    :param alt: the alt text of the image
+    :param sizes: the sizes attribute for responsive styles
+    :param css_class: the class of the image
+    :return: the template context
+    """
+    return dict(util_image_picture(image, style), alt=alt, sizes=sizes, css_class=css_class)
+
+
 class FieldsetNode(template.Node):  # pragma: nocover
     """ Fieldset renderer for 'fieldset' tag (see below) """
     def __init__(self, nodelist, fieldset_name):
@@ -114,6 +150,17 @@ def active_trail(menu, url):
     return menu.filter(path=get_clean_url(url)).get_ancestors(include_self=True) if menu else []
 
 
+@register.filter
+def menu_trail(menu, url):
+    """ Get the active trail of a compiled menu tree (settings.MENU_TREES) based on url provided
+    Unlike `active_trail`, this is a single lookup in the index of the tree and the root is not included
+    :param menu: the compiled menu tree
+    :param url: the current url to check against for the active path (should be request.path)
+    :return: a trail with `items` (from top level to active), `ids` (a set) and `active_id`
+    """
+    return menu.get_trail(url) if menu else EMPTY_TRAIL
+
+
 @register.filter
 def flatten(records, fld):
     """ Flatten a recordset to list of a particular field
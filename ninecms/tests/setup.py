@@ -20,12 +20,79 @@ from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.utils import timezone, translation
 from django.conf import settings
+from django.core.files.storage import Storage, FileSystemStorage
 from subprocess import call, check_output
 import os
 from ninecms.models import PageType, Node, NodeRevision, MenuItem, ContentBlock, Image, \
     TaxonomyTerm, File, Video, validate_file_ext, validate_video_ext
 
 """ Global setup functions """
+
+
+class RemoteStorage(Storage):
+    """ A storage in a local directory that provides no local paths, like remote storages
+    Use to test that media work through the storage API
+    """
+    def __init__(self, location=None, base_url=None):
+        """ Initialize the local directory storage
+        :param location: the directory, default MEDIA_ROOT
+        :param base_url: the base url, default MEDIA_URL
+        :return: None
+        """
+        self.local = FileSystemStorage(location, base_url)
+
+    def _open(self, name, mode='rb'):
+        """ Open a file of the local directory
+        :param name: the file name in storage
+        :param mode: the file mode
+        :return: a File object
+        """
+        return self.local._open(name, mode)
+
+    def _save(self, name, content):
+        """ Save a file in the local directory
+        :param name: the file name in storage
+        :param content: a File object
+        :return: the name of the saved file
+        """
+        return self.local._save(name, content)
+
+    def delete(self, name):
+        """ Delete a file from the local directory
+        :param name: the file name in storage
+        :return: None
+        """
+        return self.local.delete(name)
+
+    def exists(self, name):
+        """ Check if a file exists in the local directory
+        :param name: the file name in storage
+        :return: boolean
+        """
+        return self.local.exists(name)
+
+    def listdir(self, path):
+        """ List the contents of a path in the local directory
+        :param path: the path in storage
+        :return: a tuple of the directory names list and the file names list
+        """
+        return self.local.listdir(path)
+
+    def size(self, name):
+        """ Get the size of a file in the local directory
+        :param name: the file name in storage
+        :return: the size in bytes
+        """
+        return self.local.size(name)
+
+    def url(self, name):
+        """ Get the url of a file
+        :param name: the file name in storage
+        :return: the url string
+        """
+        return self.local.url(name)
+
+
 """ Node System """
 
 
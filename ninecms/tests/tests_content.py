@@ -8,21 +8,47 @@ __copyright__ = 'Copyright 2015, George Karakostas'
 __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
-from django.test import TestCase
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.utils import timezone
 from django.core.urlresolvers import reverse
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, AnonymousUser
 from django.utils import translation
 from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.template import Template, Context
 from django.core.exceptions import ValidationError
-from ninecms.models import Node, image_path_file_name, file_path_file_name, video_path_file_name, PageType
-from ninecms.utils.transliterate import transliterate
+from django.core.management import call_command
+from django.core.files.base import File, ContentFile
+from ninecms.models import Node, image_path_file_name, file_path_file_name, video_path_file_name, PageType, \
+    MenuItem, SearchIndex, Image, NodeRevision, TaxonomyTerm, ContentBlock
+from ninecms.utils.sanitize import sanitize, get_signature
+from ninecms.utils.transliterate import transliterate, register_language, unregister_language, compile_table
 from django.utils.dateformat import DateFormat
 from ninecms.forms import ContactForm, SearchForm
 from ninecms.templatetags import ninecms_extras
+from ninecms.utils.aliases import alias_table, prepare_aliases, complete_aliases
+from ninecms.utils.cache import get_version
+from ninecms.utils.render import NodeView
+from ninecms.utils.menus import compile_menu
+from ninecms.utils.search import get_search_backend, get_cursor
+from ninecms.utils.transfer import NodeImporter, read_jsonl, read_csv
+from ninecms.utils.media import create_styles_pillow, get_style_name, schedule_styles, forget_styles, find_all, \
+    delete_all, get_pool, get_styles, save_style, image_picture
+from concurrent.futures import wait
+from subprocess import call
+from io import StringIO
+from tempfile import NamedTemporaryFile
+from unittest.mock import patch
+from PIL import Image as PillowImage
+import os
+import posixpath
 from ninecms.tests.setup import create_front, create_basic, create_menu, create_block_static, create_block_menu, \
     create_block_signal_terms, create_block_simple, create_page, create_image, create_file, \
     create_video, create_terms, assert_front, assert_basic, create_user, assert_image, data_contact, get_front_title, \
-    data_login, url_with_lang
+    data_login, url_with_lang, RemoteStorage, create_simple_user
 
 
 class ContentTests(TestCase):
@@ -94,8 +120,43 @@ class ContentTests(TestCase):
                          'Tachisti-alopix-bafis-psimeni-gi-draskelizei-yper-nothroy-kynos')
         self.assertEqual(transliterate('Ξεσκεπάζω την ψυχοφθόρα βδελυγμία%.doc', True, True),
                          'xeskepazo_tin_psychofthora_bdelygmia.doc')
+        self.assertEqual(transliterate("Объект щей, Đurđevak"), 'Ob-ekt-schej-Djurdjevak')
+        self.assertEqual(transliterate("Объект щей, Đurđevak", True, True), 'ob_ekt_schej_djurdjevak')
+        with self.settings(TRANSLITERATE_REPLACE=(' ', '.')):
+            self.assertEqual(transliterate("Объект щей"), 'Ob_ekt.schej')
+        with self.settings(TRANSLITERATE_LANGUAGES=('bg',)):
+            self.assertEqual(transliterate("Щит βδ"), 'Shtit-βδ')
+        with self.settings(TRANSLITERATE_LANGUAGES=()):
+            self.assertEqual(transliterate("Щит βδ, Straße"), 'Щит-βδ-Straße')
+        register_language('de', multiple=(('ß', 'ä', 'ö', 'ü'), ('ss', 'ae', 'oe', 'ue')))
+        try:
+            self.assertEqual(transliterate("Größe Щит", True, True), 'groesse_schit')
+        finally:
+            unregister_language('de')
+        # the rules are compiled once after any change and the compiled table is reused
+        with patch('ninecms.utils.transliterate.compile_table', wraps=compile_table) as compile_mock:
+            for i in range(3):
+                self.assertEqual(transliterate("Straße"), 'Straße')
+            self.assertEqual(compile_mock.call_count, 1)
         self.assertEqual(ninecms_extras.upper_no_intonation("Σχετικά"), "ΣΧΕΤΙΚΑ")
 
+    def test_sanitize(self):
+        """ Test sanitize profiles and the fast path for text without markup
+        :return: None
+        """
+        html = '<p style="float: left; color: red">A &amp; <b>b</b></p><div>c</div><script>d</script>'
+        self.assertEqual(sanitize(html, allow_html=False), 'A &amp; bcd')
+        self.assertEqual(sanitize(html), '<p style="float: left;">A &amp; <b>b</b></p>&lt;div&gt;c&lt;/div&gt;'
+                                         '&lt;script&gt;d&lt;/script&gt;')
+        self.assertEqual(sanitize(html, full_html=True), '<p style="float: left;">A &amp; <b>b</b></p><div>c</div>'
+                                                         '&lt;script&gt;d&lt;/script&gt;')
+        self.assertEqual(sanitize('a > b\r\n'), 'a &gt; b\n')
+        with patch('ninecms.utils.sanitize.Cleaner.get_clean') as get_clean:
+            self.assertEqual(sanitize('Plain "text", ok'), 'Plain "text", ok')
+            self.assertEqual(sanitize('Plain text', full_html=True), 'Plain text')
+            self.assertEqual(sanitize(''), '')
+            self.assertFalse(get_clean.called)
+
     def test_node_view_with_front(self):
         """ Test node view for front page
         Test simple
@@ -179,6 +240,270 @@ class ContentTests(TestCase):
         node = Node.objects.create(page_type=page_type, title="Test aliases node", user=self.node_rev_basic.node.user)
         self.assertEqual(node.alias, 'test/test-aliases-node/%d' % node.id)
 
+    def test_node_aliases_queries(self):
+        """ Test that alias uniqueness is checked in a single query, only when the alias changes
+        :return: None
+        """
+        page_type = PageType.objects.create(name='test_aliases_queries', description="Test aliases queries",
+                                            url_pattern='test/[node:changed:Y]/[node:title]')
+        user = self.node_rev_basic.node.user
+
+        def alias_queries(save):
+            """ Get the alias existence checks and updates of a save """
+            with CaptureQueriesContext(connection) as context:
+                save()
+            return [query['sql'].split(' ')[0] for query in context.captured_queries
+                    if 'COUNT(' in query['sql'] or 'SET "alias"' in query['sql'] or
+                    '"ninecms_node"."alias" =' in query['sql']]
+
+        node = Node(page_type=page_type, title="Test queries node", user=user)
+        self.assertEqual(alias_queries(node.save), ['SELECT'])
+        self.assertEqual(node.alias, 'test/%d/test-queries-node' % timezone.now().year)
+        node = Node.objects.get(id=node.id)
+        node.title = "Changed"
+        self.assertEqual(alias_queries(node.save), [])
+        node.alias = 'test/[node:id]'
+        self.assertEqual(alias_queries(node.save), ['SELECT'])
+        self.assertEqual(node.alias, 'test/%d' % node.id)
+        page_type.url_pattern = 'test/[node:id]'
+        node = Node(page_type=page_type, title="Test queries node", user=user)
+        self.assertEqual(alias_queries(node.save), ['SELECT', 'UPDATE'])
+        self.assertEqual(Node.objects.get(id=node.id).alias, 'test/%d' % node.id)
+
+    def test_node_aliases_bulk(self):
+        """ Test alias generation for bulk created nodes
+        :return: None
+        """
+        page_type = PageType.objects.create(name='test_aliases_bulk', description="Test aliases bulk",
+                                            url_pattern='bulk/[node:title]')
+        page_type_id = PageType.objects.create(name='test_aliases_bulk_id', description="Test aliases bulk id",
+                                               url_pattern='bulk/[node:id]')
+        user = self.node_rev_basic.node.user
+        existing = Node.objects.create(page_type=page_type, title="Existing", user=user)
+        nodes = [Node(page_type=page_type, title=title, user=user) for title in ("Existing", "New", "New")]
+        nodes.append(Node(page_type=page_type_id, title="Bulk id", user=user))
+        with self.assertNumQueries(1):
+            pending = prepare_aliases(nodes)
+        Node.objects.bulk_create(nodes)
+        ids = Node.objects.filter(id__gt=existing.id).order_by('id').values_list('id', flat=True)
+        for node, node_id in zip(nodes, ids):
+            node.id = node_id
+        with self.assertNumQueries(2):
+            complete_aliases(pending)
+        self.assertEqual(list(Node.objects.filter(id__in=ids).order_by('id').values_list('alias', flat=True)),
+                         ['bulk/existing/%d' % ids[0], 'bulk/new', 'bulk/new/%d' % ids[2], 'bulk/%d' % ids[3]])
+
+    @override_settings(SEARCH_BACKEND='ninecms.utils.search.IndexSearchBackend')
+    def test_node_import(self):
+        """ Test bulk import of nodes from json lines and csv
+        Test aliases, sanitized html, revisions, terms, media, the search index and skipped records
+        :return: None
+        """
+        PageType.objects.create(name='test_import', description="Test import", url_pattern='import/[node:title]')
+        admin = create_user()
+        create_simple_user()
+        lines = StringIO(
+            '{"page_type": "test_import", "title": "First", "body": "<p>First</p><script>x</script>", '
+            '"terms": ["Imported"], "images": ["ninecms/basic/image/test.png"], '
+            '"revisions": [{"title": "Draft", "log_entry": "Draft"}, {}]}\n'
+            '\n'
+            '{"page_type": "test_import", "title": "First", "user": "editor", "status": false, '
+            '"created": "2015-01-02T10:00:00", "files": [{"file": "ninecms/basic/file/readme.txt", "title": "Doc"}]}\n'
+            '{"page_type": "missing", "title": "Missing"}\n'
+            '{"page_type": "test_import"}\n')
+        importer = NodeImporter(admin, batch_size=2)
+        self.assertEqual(importer.run(read_jsonl(lines)), 2)
+        self.assertEqual([number for number, message in importer.errors], [3, 4])
+        first, second = Node.objects.filter(page_type__name='test_import').order_by('id')
+        self.assertEqual(importer.imported_ids, [first.id, second.id])
+        self.assertEqual((first.alias, second.alias), ('import/first', 'import/first/%d' % second.id))
+        self.assertEqual(first.body, '<p>First</p>&lt;script&gt;x&lt;/script&gt;')
+        self.assertEqual(first.sanitized, get_signature('full_html'))
+        self.assertEqual((second.user.username, second.status, second.created.day), ('editor', False, 2))
+        self.assertEqual(second.sanitized, get_signature('html'))
+        self.assertEqual(list(first.noderevision_set.order_by('id').values_list('title', 'log_entry')),
+                         [("Draft", "Draft"), ("First", "Imported")])
+        self.assertEqual(list(first.terms.values_list('name', flat=True)), ["Imported"])
+        self.assertEqual(first.image_set.get().image.name, 'ninecms/basic/image/test.png')
+        self.assertEqual(second.file_set.get().title, "Doc")
+        self.assertEqual(SearchIndex.objects.filter(node=first, term='first').count(), 1)
+        lines = StringIO('page_type,title,terms,weight,promote\n'
+                         'test_import,Second,Imported|Other,3,1\n'
+                         'test_import,Third,,,\n')
+        importer = NodeImporter(admin, revisions=False, reindex=False)
+        with self.assertNumQueries(14):
+            self.assertEqual(importer.run(read_csv(lines)), 2)
+        second, third = Node.objects.filter(page_type__name='test_import').order_by('-id')[:2][::-1]
+        self.assertEqual((second.weight, second.promote, third.weight, third.promote), (3, True, 0, False))
+        self.assertEqual(TaxonomyTerm.objects.filter(name="Imported").count(), 1)
+        self.assertEqual(sorted(second.terms.values_list('name', flat=True)), ["Imported", "Other"])
+        self.assertFalse(NodeRevision.objects.filter(node=third).exists())
+        self.assertFalse(SearchIndex.objects.filter(node=third).exists())
+        with NamedTemporaryFile('w', suffix='.csv', encoding='utf-8') as f:
+            f.write('page_type,title\ntest_import,Fourth\n')
+            f.flush()
+            out = StringIO()
+            call_command('ninecms_import', f.name, user='editor', stdout=out)
+        self.assertIn(": 1, failed: 0.", out.getvalue())
+        self.assertEqual(Node.objects.get(title="Fourth").user.username, 'editor')
+
+    def test_content_export(self):
+        """ Test that exported content is imported back the same
+        Test nodes with revisions, media and translations, taxonomy and menu trees and blocks with page types
+        :return: None
+        """
+        create_terms([self.node_rev_basic.node])
+        Node.objects.filter(id=self.node_rev_basic_search.node.id)\
+            .update(original_translation=self.node_rev_basic.node)
+
+        def snapshot():
+            """ Get the exported fields of all content, with references by title instead of id """
+            return (
+                list(Node.objects.order_by('id').values_list(
+                    'title', 'alias', 'page_type__name', 'user__username', 'status', 'created', 'body',
+                    'original_translation__title', 'image__image', 'file__file', 'video__video')),
+                list(NodeRevision.objects.order_by('id').values_list('node__alias', 'title', 'user__username')),
+                list(TaxonomyTerm.objects.order_by('tree_id', 'lft')
+                     .values_list('name', 'parent__name', 'nodes__alias')),
+                list(MenuItem.objects.order_by('tree_id', 'lft').values_list('title', 'parent__title', 'path')),
+                list(ContentBlock.objects.order_by('id').values_list('type', 'node__alias', 'menu_item__title',
+                                                                      'page_types__name')),
+            )
+
+        content = snapshot()
+        with NamedTemporaryFile(suffix='.jsonl.gz') as f:
+            out = StringIO()
+            call_command('ninecms_export', f.name, chunk_size=2, stdout=out)
+            self.assertIn("nodes: %d, terms: 2, menu items: 6" % Node.objects.count(), out.getvalue())
+            # keep the media files, only the records are deleted
+            with patch('django.core.files.storage.FileSystemStorage.delete'), patch('ninecms.signals.delete_all'):
+                Node.objects.all().delete()
+            TaxonomyTerm.objects.all().delete()
+            MenuItem.objects.all().delete()
+            ContentBlock.objects.all().delete()
+            call_command('ninecms_import', f.name, batch_size=3, stdout=out)
+        self.assertEqual(snapshot(), content)
+
+    @override_settings(ALIAS_CACHE=True)
+    def test_node_view_alias_table(self):
+        """ Test url alias resolution from the routing table
+        Test that a loaded route requires no queries
+        Test that the route is kept after a node change that does not affect routing
+        Test that the route is updated after the node route changes
+        :return: None
+        """
+        alias_table.clear()
+        assert_basic(self, 'about/')
+        node = self.node_rev_basic.node
+        with self.assertNumQueries(0):
+            route = alias_table.get('about', settings.LANGUAGE_CODE)
+        self.assertEqual(route.id, node.id)
+        self.assertEqual(route.status, True)
+        node.title = "About us"
+        node.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(alias_table.get('about', settings.LANGUAGE_CODE), route)
+        node.title = "About"
+        node.status = False
+        node.save()
+        self.assertEqual(alias_table.get('about', settings.LANGUAGE_CODE).status, False)
+        response = self.client.get(url_with_lang('/about/'))
+        self.assertEqual(response.status_code, 403)
+        node.status = True
+        node.save()
+        self.assertEqual(alias_table.get('about/missing', settings.LANGUAGE_CODE), None)
+        response = self.client.get(url_with_lang('/about/missing/'))
+        self.assertEqual(response.status_code, 404)
+        alias_table.clear()
+
+    @override_settings(ALIAS_CACHE=True, PAGE_CACHE_SECONDS=60, CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test_page_cache'}},
+        MIDDLEWARE_CLASSES=[m for m in settings.MIDDLEWARE_CLASSES if not m.startswith('django.middleware.cache')])
+    def test_node_view_page_cache(self):
+        """ Test the rendered page cache
+        Test that a cached page requires no queries
+        Test that the page is rendered again after the node changes
+        Test that a page with a query string is not cached
+        Test that changes of an unpublished node do not invalidate the cached pages
+        :return: None
+        """
+        caches['default'].clear()
+        alias_table.clear()
+        assert_basic(self, 'about/')
+        with self.assertNumQueries(0):
+            assert_basic(self, 'about/')
+        node = self.node_rev_basic.node
+        node.title = "About us"
+        node.save()
+        assert_basic(self, 'about/', title="About us")
+        response = self.client.get(url_with_lang('/about/'), {'q': 'about'})
+        self.assertContains(response, "About us</h1>")
+        node.title = "About"
+        node.status = False
+        node.save()
+        version = get_version('content')
+        node.title = "About draft"
+        node.save()
+        self.assertEqual(get_version('content'), version)
+        node.title = "About"
+        node.status = True
+        node.save()
+        self.assertNotEqual(get_version('content'), version)
+        alias_table.clear()
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test_layout'}})
+    def test_node_view_layout(self):
+        """ Test the block layout plan of a page type
+        Test that a cached layout and the block nodes and menus require no queries
+        Test that the layout is kept after a node that is not referenced by blocks changes, with no queries
+        Test that the layout is updated after a referenced node changes
+        :return: None
+        """
+        caches['default'].clear()
+        page_type = self.node_rev_front.node.page_type
+        ninecms_view = NodeView()
+        ninecms_view.get_layout(page_type)
+        with self.assertNumQueries(0):
+            layout = dict(ninecms_view.get_layout(page_type))
+            self.assertEqual(layout['static_about'].node.title, "About")
+            self.assertEqual(layout['menu_main_menu'].menu_item.title, "Main Menu")
+        version = get_version('layout')
+        node = self.node_rev_front.node
+        with CaptureQueriesContext(connection) as context:
+            node.save()
+        self.assertFalse(any('"ninecms_contentblock"' in query['sql'] for query in context.captured_queries))
+        self.assertEqual(get_version('layout'), version)
+        node = self.node_rev_basic.node
+        node.body = "About us."
+        node.save()
+        self.assertEqual(dict(ninecms_view.get_layout(page_type))['static_about'].node.body, "About us.")
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test_block_cache'}})
+    def test_node_view_block_cache(self):
+        """ Test the cache of block values
+        Test that cached blocks require no queries, including the evaluated menu
+        Test that forms are not cached
+        :return: None
+        """
+        caches['default'].clear()
+        self.block_menu.cache_seconds = 60
+        self.block_menu.save()
+        self.block_contact.cache_seconds = 60
+        self.block_contact.save()
+        node = Node.objects.select_related('page_type').get(id=self.node_rev_front.node_id)
+        request = RequestFactory().get('/')
+        request.LANGUAGE_CODE = settings.LANGUAGE_CODE
+        request.user = AnonymousUser()
+        request.session = {}
+        ninecms_view = NodeView()
+        ninecms_view.construct_context(node, request)
+        with self.assertNumQueries(0):
+            page = ninecms_view.construct_context(node, request)
+            self.assertEqual(len(list(page['menu_main_menu'])), 5)
+        self.assertEqual(ninecms_view.get_block_cache_key(self.block_contact, request), None)
+
     """ Menu System """
     def test_menu_model_methods(self):
         """ Test menu model methods
@@ -186,6 +511,52 @@ class ContentTests(TestCase):
         """
         self.assertEqual(str(self.menu), "Main Menu")
 
+    def test_menu_tree(self):
+        """ Test compiled menu trees
+        Test that a tree is compiled in a single query with resolved paths
+        Test that disabled items are excluded along with their children
+        Test rendering of the tree template
+        :return: None
+        """
+        about = MenuItem.objects.get(parent=self.menu, path='about')
+        MenuItem.objects.create(parent=about, weight=0, path='about/history', title="History")
+        disabled = MenuItem.objects.create(parent=self.menu, weight=5, path='disabled', title="Off", disabled=True)
+        MenuItem.objects.create(parent=disabled, weight=0, path='disabled/child', title="Off child")
+        menu = MenuItem.objects.get(id=self.menu.id)
+        with self.assertNumQueries(1):
+            tree = compile_menu(menu, settings.LANGUAGE_CODE)
+        self.assertEqual(len(tree), 5)
+        self.assertEqual([item.url for item in tree], [
+            item.full_path() for item in menu.get_children().filter(disabled=False)])
+        self.assertEqual(tree.items[1].children[0].title, "History")
+        self.assertEqual(tree.items[1].children[0].is_leaf_node, True)
+        html = render_to_string('ninecms/block_menu_tree.html', {'menu': tree, 'request': RequestFactory().get('/')})
+        self.assertInHTML('<a href="/about/history/"><span>History</span></a>', html)
+        self.assertNotIn("Off", html)
+
+    def test_menu_tree_trail(self):
+        """ Test the active trail index of compiled menu trees
+        Test trails for a nested path, the front page and a path not in menu
+        Test rendering of the breadcrumbs template
+        :return: None
+        """
+        about = MenuItem.objects.get(parent=self.menu, path='about')
+        MenuItem.objects.create(parent=about, weight=0, path='/about/history/', title="History")
+        tree = compile_menu(MenuItem.objects.get(id=self.menu.id), settings.LANGUAGE_CODE)
+        with self.assertNumQueries(0):
+            trail = ninecms_extras.menu_trail(tree, url_with_lang('/about/history/'))
+        self.assertEqual([item.title for item in trail.items], ["About", "History"])
+        self.assertEqual(trail.ids, {about.id, trail.active_id})
+        self.assertEqual(ninecms_extras.menu_trail(tree, url_with_lang('/')).items[0].title, "Front")
+        self.assertEqual(ninecms_extras.menu_trail(tree, url_with_lang('/missing/')).items, ())
+        request = RequestFactory().get(url_with_lang('/about/history/'))
+        html = render_to_string('ninecms/block_menu_tree_breadcrumbs.html', {'menu': tree, 'request': request})
+        self.assertInHTML('<ul class="breadcrumb"><li><a href="/about/">About</a></li>'
+                          '<li class="active">History</li></ul>', html)
+        html = render_to_string('ninecms/block_menu_tree.html', {'menu': tree, 'request': request})
+        self.assertInHTML('<li class="active-trail active"><a href="/about/history/"><span>History</span></a></li>',
+                          html)
+
     """ Block System """
     def test_model_methods_blocks(self):
         """ Test model methods for blocks
@@ -303,6 +674,168 @@ class ContentTests(TestCase):
         ninecms_extras.image_style(self.img_big_portrait.image, 'blog_style')
         assert_image(self, None, self.img_big_portrait, '350x226', 'blog_style')
 
+    def test_image_metadata(self):
+        """ Test that image metadata is recorded on save and by the backfill command, and style sizes computed
+        :return: None
+        """
+        self.assertEqual((self.img_big.width, self.img_big.height, self.img_big.format), (1024, 498, 'JPEG'))
+        self.assertEqual(self.img_big.size, os.path.getsize(self.img_big.image.path))
+        self.assertEqual((self.img.width, self.img.height, self.img.format), (60, 60, 'PNG'))
+        self.assertEqual(ninecms_extras.image_style_size(self.img_big.image, 'thumbnail'), (150, 73))
+        self.assertEqual(ninecms_extras.image_style_size(self.img_big.image, 'blog_style'), (350, 226))
+        self.assertEqual(ninecms_extras.image_style_size(self.img.image, 'thumbnail_upscale'), (150, 150))
+        Image.objects.filter(id=self.img_big.id).update(width=None, height=None, format='', size=None)
+        self.assertIsNone(ninecms_extras.image_style_size(Image.objects.get(id=self.img_big.id).image, 'thumbnail'))
+        call_command('image_metadata', stdout=StringIO())
+        image = Image.objects.get(id=self.img_big.id)
+        self.assertEqual((image.width, image.height, image.format, image.size),
+                         (1024, 498, 'JPEG', self.img_big.size))
+        # a deferred image is not loaded on init or on save
+        image = Image.objects.only('id', 'title').get(id=self.img_big.id)
+        with self.assertNumQueries(1):
+            image.title = "Big"
+            image.save()
+
+    @override_settings(IMAGE_STYLE_ENGINE='pillow')
+    def test_image_style_pillow(self):
+        """ Test all style types with the Pillow engine
+        :return: None
+        """
+        for img, style, size in ((self.img, 'thumbnail_upscale', (150, 150)),
+                                 (self.img, 'thumbnail', (60, 60)),
+                                 (self.img_big, 'thumbnail', (150, 73)),
+                                 (self.img_big, 'blog_style', (350, 226)),
+                                 (self.img_big_portrait, 'blog_style', (350, 226)),
+                                 (self.img_big_portrait, 'thumbnail_crop', (150, 150))):
+            style_path_file_name = img.image.storage.path(get_style_name(img.image.name, style))
+            call(['rm', '-rf', os.path.dirname(style_path_file_name)])
+            self.assertTrue(ninecms_extras.image_style(img.image, style).endswith('/%s/%s' % (
+                style, os.path.basename(style_path_file_name))))
+            with PillowImage.open(style_path_file_name) as derivative:
+                self.assertEqual(derivative.size, size)
+                self.assertEqual(derivative.format, 'PNG' if img == self.img else 'JPEG')
+            call(['rm', '-rf', os.path.dirname(style_path_file_name)])
+
+    def test_image_srcset(self):
+        """ Test that all variants of a responsive style are constructed from one decode of the original image
+        :return: None
+        """
+        styles = dict(settings.IMAGE_STYLES, responsive={'type': 'responsive', 'widths': (640, 320, 1280)})
+        with self.settings(IMAGE_STYLES=styles, IMAGE_STYLE_ENGINE='pillow'):
+            image = self.img_big.image
+            names = [get_style_name(image.name, style) for style in ('responsive_320w', 'responsive_640w')]
+            with patch('ninecms.utils.media.create_styles_pillow', wraps=create_styles_pillow) as create:
+                srcset = ninecms_extras.image_srcset(image, 'responsive')
+            self.assertEqual(create.call_count, 1)
+            self.assertEqual(srcset, '%s 320w, %s 640w' % tuple(image.storage.url(name) for name in names))
+            for name, width in zip(names, (320, 640)):
+                with PillowImage.open(image.storage.path(name)) as derivative:
+                    self.assertEqual(derivative.size[0], width)
+            self.assertEqual(ninecms_extras.image_style(image, 'responsive'), image.storage.url(names[1]))
+            self.assertEqual(ninecms_extras.image_style_size(image, 'responsive'), (640, 311))
+            for name in names:
+                call(['rm', '-rf', os.path.dirname(image.storage.path(name))])
+
+    def test_image_style_formats(self):
+        """ Test image style output formats and the picture tag with alternative formats
+        :return: None
+        """
+        styles = dict(settings.IMAGE_STYLES, photo={'type': 'thumbnail', 'size': (400, 400), 'format': 'png'},
+                      picture={'type': 'responsive', 'widths': (320, 640), 'quality': 70, 'formats': ('png', 'xyz')})
+        with self.settings(IMAGE_STYLES=styles, IMAGE_STYLE_ENGINE='pillow'):
+            # the expanded styles are kept until the settings change
+            self.assertIs(get_styles(), get_styles())
+            self.assertIn('picture_640w_png', get_styles())
+            image = self.img_big.image
+            name = get_style_name(image.name, 'photo')
+            self.assertTrue(name.endswith('/photo/test_big.jpg.png'))
+            self.assertEqual(ninecms_extras.image_style(image, 'photo'), image.storage.url(name))
+            with PillowImage.open(image.storage.path(name)) as derivative:
+                self.assertEqual((derivative.format, derivative.size), ('PNG', (400, 195)))
+            with patch('ninecms.utils.media.create_styles_pillow', wraps=create_styles_pillow) as create:
+                html = Template('{% load ninecms_extras %}{% picture image "picture" alt="Big" sizes="50vw" %}')\
+                    .render(Context({'image': image}))
+            self.assertEqual(create.call_count, 1)
+            names = {style: get_style_name(image.name, style)
+                     for style in ('picture_320w', 'picture_640w', 'picture_320w_png', 'picture_640w_png')}
+            self.assertTrue(names['picture_640w_png'].endswith('.jpg.png'))
+            self.assertInHTML('<picture><source type="image/png" srcset="%s 320w, %s 640w" sizes="50vw">'
+                              '<img src="%s" srcset="%s 320w, %s 640w" sizes="50vw" width="640" height="311" alt="Big">'
+                              '</picture>' % tuple(image.storage.url(names[style]) for style in (
+                                  'picture_320w_png', 'picture_640w_png', 'picture_640w', 'picture_320w',
+                                  'picture_640w')), html)
+            self.assertNotIn('xyz', html)
+            with PillowImage.open(image.storage.path(names['picture_640w_png'])) as derivative:
+                self.assertEqual((derivative.format, derivative.size), ('PNG', (640, 311)))
+            # a format with a variant not constructed yet is left out of the sources
+            call(['rm', '-rf', os.path.dirname(image.storage.path(names['picture_320w_png']))])
+            with self.settings(IMAGE_STYLE_WORKERS=1), patch('ninecms.utils.media.schedule_styles'):
+                self.assertEqual(image_picture(image, 'picture')['sources'], [])
+            for name in [name] + list(names.values()):
+                call(['rm', '-rf', os.path.dirname(image.storage.path(name))])
+        self.assertNotIn('picture_640w_png', get_styles())
+
+    @override_settings(IMAGE_STYLE_ENGINE='pillow')
+    def test_image_style_storage(self):
+        """ Test image styles, find all and delete all with a storage that has no local paths
+        :return: None
+        """
+        storage = RemoteStorage()
+        with open(self.img_big.image.path, 'rb') as file:
+            copy = storage.save('ninecms/storage_test/test_big.jpg', File(file))
+        image = Image.objects.create(node=self.img_big.node, image=copy, title="Storage").image
+        image.storage = storage
+        self.assertEqual(ninecms_extras.image_style(image, 'thumbnail'),
+                         settings.MEDIA_URL + get_style_name(copy, 'thumbnail'))
+        self.assertEqual(set(find_all(image)), {copy} | set(get_style_name(copy, style) for style in get_styles()))
+        with storage.open(get_style_name(copy, 'thumbnail')) as file, PillowImage.open(file) as derivative:
+            self.assertEqual(derivative.size, (150, 73))
+        # a style saved by another worker in the meantime is kept, with no file under an alternative name
+        style_name = get_style_name(copy, 'thumbnail')
+        with patch.object(storage, 'exists', return_value=False):
+            save_style(storage, style_name, ContentFile(b'style'))
+        self.assertEqual(storage.listdir(posixpath.dirname(style_name))[1], [posixpath.basename(style_name)])
+        delete_all(image)
+        self.assertFalse(storage.exists(copy))
+        self.assertFalse(storage.exists(style_name))
+        call(['rm', '-rf', os.path.join(settings.MEDIA_ROOT, 'ninecms', 'storage_test')])
+
+    @override_settings(IMAGE_STYLE_ENGINE='pillow', CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test_image_styles'}})
+    def test_image_style_registry(self):
+        """ Test that registered image styles require no file access and are removed from the registry
+        :return: None
+        """
+        caches['default'].clear()
+        style_path = os.path.dirname(self.img_big.image.storage.path(get_style_name(self.img_big.image.name,
+                                                                                    'thumbnail')))
+        url = ninecms_extras.image_style(self.img_big.image, 'thumbnail')
+        with patch('ninecms.utils.media.os.path.exists') as exists:
+            self.assertEqual(ninecms_extras.image_style(self.img_big.image, 'thumbnail'), url)
+            self.assertFalse(exists.called)
+            forget_styles(self.img_big.image.name, self.img_big.size)
+            self.assertEqual(ninecms_extras.image_style(self.img_big.image, 'thumbnail'), url)
+            self.assertTrue(exists.called)
+        call(['rm', '-rf', style_path])
+
+    @override_settings(IMAGE_STYLE_WORKERS=1, IMAGE_STYLE_PLACEHOLDER='/static/placeholder.png')
+    def test_image_style_workers(self):
+        """ Test that with workers the placeholder is returned and the style is constructed in the background
+        :return: None
+        """
+        image = self.img.image
+        style_path = os.path.dirname(image.storage.path(get_style_name(image.name, 'thumbnail')))
+        call(['rm', '-rf', style_path])
+        self.assertEqual(ninecms_extras.image_style(image, 'thumbnail'), '/static/placeholder.png')
+        futures = schedule_styles(image.storage, image.name)
+        self.assertTrue(futures)
+        wait(futures)
+        call(['rm', '-rf', style_path])
+        pool = get_pool()
+        self.assertIs(get_pool(), pool)
+        with self.settings(IMAGE_STYLE_WORKERS=2):
+            self.assertIsNot(get_pool(), pool)
+
     """ Taxonomy System """
     def test_model_methods_terms(self):
         """ Test model methods
@@ -446,3 +979,92 @@ class ContentTests(TestCase):
         self.assertContains(response, '/block/1/">About 1</a>')
         response = self.client.get(reverse('ninecms:alias', args=('search/',)), {'q': 'test'})
         self.assertContains(response, '<p>No results found.</p>')
+
+    @override_settings(SEARCH_RESULTS_MAX_PER_PAGE=2, SEARCH_RESULTS_MAX=3)
+    def test_search_results_pagination(self):
+        """ Test search results page size limits, result limit and keyset pagination
+        :return: None
+        """
+        translation.activate(settings.LANGUAGE_CODE)
+        request = RequestFactory().get('/search/', {'q': 'About', 'size': '100'})
+        request.LANGUAGE_CODE = settings.LANGUAGE_CODE
+        results = NodeView().construct_search_results('About', request)
+        self.assertEqual(len(results['nodes']), 2)
+        self.assertEqual(results['page_obj'].paginator.num_pages, 2)
+        self.assertIn('size=2', results['query'])
+        self.assertNotIn('body', results['nodes'][0].__dict__)
+        self.assertNotIn('summary', results['nodes'][0].__dict__)
+        request = RequestFactory().get('/search/', {'q': 'About', 'size': '2', 'page': '2',
+                                                    'after': results['cursor']})
+        request.LANGUAGE_CODE = settings.LANGUAGE_CODE
+        keyset = NodeView().construct_search_results('About', request)
+        request = RequestFactory().get('/search/', {'q': 'About', 'size': '2', 'page': '2', 'after': 'invalid'})
+        request.LANGUAGE_CODE = settings.LANGUAGE_CODE
+        offset = NodeView().construct_search_results('About', request)
+        self.assertEqual(keyset['page_obj'].number, 2)
+        self.assertEqual(keyset['nodes'], offset['nodes'])
+        self.assertFalse(set(keyset['nodes']) & set(results['nodes']))
+
+    def test_node_sanitize_on_write(self):
+        """ Test that node html fields are sanitized on save and by the sanitize_nodes command
+        :return: None
+        """
+        html = '<div>a</div><script>b</script>'
+        page_type = self.node_rev_basic.node.page_type
+        node = Node.objects.create(page_type=page_type, user=create_simple_user(), title="Sanitize", body=html)
+        self.assertEqual(node.body, '&lt;div&gt;a&lt;/div&gt;&lt;script&gt;b&lt;/script&gt;')
+        self.assertEqual(node.sanitized, get_signature('html'))
+        node = Node.objects.get(id=node.id)
+        with patch('ninecms.utils.sanitize.Cleaner.get_clean') as get_clean:
+            node.save()
+            self.assertFalse(get_clean.called)
+        full = Node.objects.create(page_type=page_type, user=create_user(), title="Full", summary=html)
+        self.assertEqual(full.summary, '<div>a</div>&lt;script&gt;b&lt;/script&gt;')
+        self.assertEqual(full.sanitized, get_signature('full_html'))
+        Node.objects.filter(id__in=(node.id, full.id)).update(body=html, sanitized='')
+        out = StringIO()
+        call_command('sanitize_nodes', batch_size=1, stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Nodes sanitized: 2, html changed: 2.")
+        self.assertEqual(Node.objects.get(id=node.id).body, '&lt;div&gt;a&lt;/div&gt;&lt;script&gt;b&lt;/script&gt;')
+        self.assertEqual(Node.objects.get(id=full.id).body, '<div>a</div>&lt;script&gt;b&lt;/script&gt;')
+        self.assertEqual(Node.objects.get(id=full.id).sanitized, get_signature('full_html'))
+        call_command('sanitize_nodes', stdout=out)
+        self.assertIn("Nodes sanitized: 0, html changed: 0.", out.getvalue())
+
+    @override_settings(SEARCH_BACKEND='ninecms.utils.search.IndexSearchBackend', SEARCH_RESULTS_PER_PAGE=1)
+    def test_search_index(self):
+        """ Test the index search backend: indexing on save, reindex, transliteration, ranking and pagination
+        :return: None
+        """
+        translation.activate(settings.LANGUAGE_CODE)
+        backend = get_search_backend()
+        self.assertEqual(backend.reindex(), Node.objects.count())
+        node = self.node_rev_basic.node
+        node.summary = "<p>Ελληνικό &amp; about</p>"
+        node.save()
+        self.assertEqual(SearchIndex.objects.get(node=node, term='about').weight, 5 + 2 + 1)
+        # index entries are deleted in a single query, with no model signals
+        with CaptureQueriesContext(connection) as context:
+            backend.update(node)
+        self.assertEqual(sum(query['sql'].startswith('SELECT') for query in context.captured_queries), 0)
+        results = backend.search('ellinikó ABOUT', 'en')
+        self.assertEqual(results[:10], [node])
+        self.assertEqual(results[0].excerpt, "Ελληνικό & about")
+        self.assertEqual(backend.search('ελληνικό', 'en')[:10], [node])
+        self.assertEqual(backend.search('ελληνικό missing', 'en')[:10], [])
+        self.assertEqual(backend.search('about', 'en')[0], node)
+        self.assertEqual(len(backend.search('', 'en')), 0)
+        node.status = False
+        node.save()
+        self.assertEqual(len(backend.search('ελληνικό', 'en')), 0)
+        response = self.client.get(reverse('ninecms:alias', args=('search/',)), {'q': 'About', 'page': '2'})
+        self.assertContains(response, '/block/2/">About 2</a>')
+        self.assertNotContains(response, '/block/1/">About 1</a>')
+        self.assertContains(response, '?q=About&amp;page=1" aria-label="Previous">')
+        self.assertContains(response, '<li><a href="?q=About&amp;page=3">3</a></li>')
+        cursor = get_cursor(backend.search('about', 'en')[1])
+        self.assertContains(response, '?q=About&amp;page=3&amp;after=%s" aria-label="Next">' % cursor)
+        response = self.client.get(reverse('ninecms:alias', args=('search/',)),
+                                   {'q': 'About', 'page': '3', 'after': cursor})
+        self.assertContains(response, '/block/3/">About 3</a>')
+        self.assertNotContains(response, '/block/2/">About 2</a>')
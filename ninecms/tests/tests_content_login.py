@@ -18,7 +18,9 @@ __copyright__ = 'Copyright 2015, George Karakostas'
 __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import Group
 from django.contrib.contenttypes.models import ContentType
@@ -28,9 +30,14 @@ from guardian.models import GroupObjectPermission
 from ninecms.forms import ContentNodeEditForm, ImageForm, FileForm, VideoForm, PageTypeForm
 from ninecms.tests.setup import create_front, create_basic, create_user, create_image, create_block_simple, \
     get_front_title, assert_front, data_login, data_node, get_basic_title, create_video, create_file, data_page_type, \
-    create_terms
+    create_terms, assert_basic
 from ninecms.models import PageType, Node, PageLayoutElement, ContentBlock, TaxonomyTerm
 import os
+import re
+from shutil import copyfile
+from ninecms.templatetags import ninecms_extras
+from ninecms.utils.media import find_all, get_styles
+from ninecms.utils.render import NodeView
 
 
 class ContentLoginTests(TestCase):
@@ -191,6 +198,72 @@ class ContentLoginTests(TestCase):
         self.assertEqual(len(form.errors), 0)
         self.assertEqual(len(form.instance.terms.all()), 1)
 
+    def test_content_node_edit_form_m2m_queries(self):
+        """ Test that saving a node form's reverse m2m takes the same number of queries for any number of terms
+        :return: None
+        """
+        root = create_terms(())
+        terms = [TaxonomyTerm.objects.create(parent=root, name="Term %d" % i).pk for i in range(40)]
+        data = data_node(self.node_rev_front.node.page_type_id, self.admin)
+        queries = []
+        instance = None
+        # each change after the first removes and adds a different number of terms
+        for selected in (terms[:2], terms[1:], terms[:3], terms[2:12]):
+            data['terms'] = selected
+            form = ContentNodeEditForm(data=data, user=self.admin, instance=instance)
+            self.assertEqual(form.is_valid(), True)
+            with CaptureQueriesContext(connection) as context:
+                instance = form.save()
+            queries.append(len(context))
+            self.assertEqual(sorted(form.instance.terms.values_list('pk', flat=True)), selected)
+        self.assertEqual(queries[1], queries[2])
+        self.assertEqual(queries[2], queries[3])
+
+    @override_settings(PAGE_CACHE_SECONDS=60, CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test_page_cache_login'}},
+        MIDDLEWARE_CLASSES=[m for m in settings.MIDDLEWARE_CLASSES if not m.startswith('django.middleware.cache')])
+    def test_node_view_page_cache_login(self):
+        """ Test that pages are not cached for authenticated users
+        :return: None
+        """
+        request = assert_basic(self, 'about/').wsgi_request
+        self.assertEqual(NodeView().get_page_cache_key(self.node_rev_basic.node, request), None)
+
+    @override_settings(AUTOCOMPLETE_RESULTS_PER_PAGE=2)
+    def test_autocomplete(self):
+        """ Test that the autocomplete widget renders only the selected terms
+        Test that the autocomplete view pages the terms found by prefix
+        Test that the taxonomy term admin form uses the autocomplete widget for nodes
+        :return: None
+        """
+        root = create_terms(())
+        terms = [TaxonomyTerm.objects.create(parent=root, name="Term %d" % i) for i in range(5)]
+        node = self.node_rev_basic.node
+        node.terms.add(terms[1], terms[3])
+        form = ContentNodeEditForm(instance=node, user=self.admin)
+        # the initial pks of the node terms and the labels of the selected terms
+        with self.assertNumQueries(2):
+            html = str(form['terms'])
+        self.assertInHTML('<option value="%d" selected="selected">Term 1</option>' % terms[1].pk, html)
+        self.assertInHTML('<option value="%d" selected="selected">Term 3</option>' % terms[3].pk, html)
+        self.assertNotIn("Term 2", html)
+        self.assertIn('data-url="%s"' % reverse('ninecms:autocomplete', args=('terms',)), html)
+        url = reverse('ninecms:autocomplete', args=('terms',))
+        response = self.client.get(url, {'term': 'term'})
+        self.assertEqual(response.json(), {'results': [{'id': terms[0].pk, 'text': "Term 0"},
+                                                       {'id': terms[1].pk, 'text': "Term 1"}], 'more': True})
+        response = self.client.get(url, {'term': 'term', 'page': 3})
+        self.assertEqual(response.json(), {'results': [{'id': terms[4].pk, 'text': "Term 4"}], 'more': False})
+        response = self.client.get(url, {'term': 'gen'})
+        self.assertEqual([result['text'] for result in response.json()['results']], ["General"])
+        self.assertEqual(self.client.get(reverse('ninecms:autocomplete', args=('missing',))).status_code, 404)
+        response = self.client.get(reverse('admin:ninecms_taxonomyterm_change', args=(terms[1].pk,)))
+        self.assertEqual(response.status_code, 200)
+        nodes = re.search(r'<select[^>]*name="nodes".*?</select>', response.content.decode(), re.S).group()
+        self.assertIn('class="autocomplete-select"', nodes)
+        self.assertEqual(re.findall(r'<option[^>]*>([^<]*)</option>', nodes), [node.title])
+        self.assertNotContains(response, "Hold down")
+
     def test_image_form_valid_sanitize(self):
         """ Test forms sanitize; Test image form
         Form is invalid as it requires image filename etc.
@@ -213,6 +286,28 @@ class ContentLoginTests(TestCase):
         obj.delete()
         self.assertFalse(os.path.isfile(path))
 
+    @override_settings(IMAGE_STYLE_ENGINE='pillow')
+    def test_image_delete_styles(self):
+        """ Test that all image styles are recorded when an image is saved, with no records on render
+        Test that the recorded image styles are deleted when an image is deleted
+        :return: None
+        """
+        obj = create_image('media_delete_styles.jpg')
+        copyfile(os.path.join(os.path.dirname(obj.image.path), 'test_big.jpg'), obj.image.path)
+        self.assertEqual(set(obj.derivatives.values_list('style', flat=True)), set(get_styles()))
+        with CaptureQueriesContext(connection) as context:
+            ninecms_extras.image_style(obj.image, 'thumbnail')
+            ninecms_extras.image_style(obj.image, 'blog_style')
+        self.assertFalse(any(query['sql'].startswith('INSERT') for query in context.captured_queries))
+        storage = obj.image.storage
+        paths = [storage.path(name) for name in find_all(obj.image) if storage.exists(name)]
+        self.assertEqual(len(paths), 3)
+        for path in paths:
+            self.assertTrue(os.path.isfile(path))
+        obj.delete()
+        for path in paths:
+            self.assertFalse(os.path.isfile(path))
+
     def test_video_delete(self):
         """ Test that files are deleted when a media is deleted
         :return: None
@@ -28,6 +28,10 @@ urlpatterns = [
     url(r'^cms/status/$', staff_member_required(views.StatusView.as_view()),
         name='status'),
 
+    # autocomplete: cms/autocomplete/<source>/?term=<prefix>
+    url(r'^cms/autocomplete/(?P<source>\w+)/$', staff_member_required(views.AutocompleteView.as_view()),
+        name='autocomplete'),
+
     # Other forms
 
     # Contact: contact/form/
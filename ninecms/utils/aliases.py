@@ -0,0 +1,156 @@
+""" Url alias routing table and bulk alias generation """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Case, When, Value, CharField
+from collections import namedtuple
+from ninecms.models import Node
+from ninecms.utils.cache import get_version, bump_version
+from ninecms.utils.nodes import get_full_path, compile_alias_pattern
+
+
+class Route(namedtuple('Route', ('id', 'language', 'status', 'redirect', 'link', 'page_type_id'))):
+    """ The node fields required to route a request before the node itself is loaded
+    Routes are invalidated only when these fields or the alias change, see `Node.get_route_values`
+    """
+    __slots__ = ()
+
+    def get_redirect_path(self):
+        """ Get the redirect path including language (if any), same as `Node.get_redirect_path`
+        :return: full redirect path string
+        """
+        return get_full_path(self.link, self.language)
+
+
+class AliasTable(object):
+    """ Per-process table of url alias (and request language) to node routes
+    Routes are loaded lazily, either from the mirror in the default cache or from the database
+    A version token in the default cache keeps the tables of multiple workers coherent:
+    a worker that changes a node updates its own table and bumps the version, the others drop theirs
+    """
+    def __init__(self):
+        """ Initialize an empty table
+        :return: None
+        """
+        self.routes = {}
+        self.version = None
+
+    def sync(self):
+        """ Drop the local routes if another worker has changed the version
+        If the cache backend cannot hold the version (eg DummyCache), the local table is kept as is
+        :return: the current version token
+        """
+        version = get_version('alias')
+        if version is not None and version != self.version:
+            self.routes = {}
+            self.version = version
+        return self.version
+
+    def get(self, alias, language):
+        """ Get the route of an alias for the language of a request
+        The lookup rules are those of `NodeView.get_node_by_alias`
+        :param alias: a url path alias without slashes
+        :param language: the request language code
+        :return: a Route or None if no node exists
+        """
+        version = self.sync()
+        key = (alias, language)
+        route = self.routes.get(key)
+        if route is not None:
+            return route
+        cache = caches['default']
+        cache_key = 'ninecms_alias_%s_%s_%s' % (version, language, alias)
+        if settings.ALIAS_CACHE_MIRROR:
+            route = cache.get(cache_key)
+        if route is None:
+            values = Node.objects\
+                .filter(alias=alias)\
+                .filter(language__in=(language, ''))\
+                .order_by('-language', 'id')\
+                .values_list(*Route._fields)[:1]
+            if not values:
+                return None
+            route = Route(*values[0])
+            if settings.ALIAS_CACHE_MIRROR:
+                cache.set(cache_key, route)
+        self.routes[key] = route
+        return route
+
+    def discard(self, node_id, *aliases):
+        """ Remove all routes of a node and of its aliases from the local table and invalidate other workers
+        :param node_id: the node id
+        :param aliases: the previous and current node aliases, as other nodes may now take precedence for them
+        :return: None
+        """
+        self.routes = {key: route for key, route in self.routes.items()
+                       if route.id != node_id and key[0] not in aliases}
+        self.version = bump_version('alias')
+
+    def clear(self):
+        """ Remove all routes and invalidate other workers
+        :return: None
+        """
+        self.routes = {}
+        self.version = bump_version('alias')
+
+alias_table = AliasTable()
+
+
+# The number of aliases to update in a single query, within the query parameter limits of all databases
+UPDATE_BATCH_SIZE = 200
+
+
+def prepare_aliases(nodes):
+    """ Render the aliases of new nodes before `bulk_create`, same as `Node.save`
+    Duplicates, among the nodes or with existing nodes of the same language, are found in a single query
+    :param nodes: a list of unsaved nodes with their page types
+    :return: a list of tuples of node and duplicate flag, for the nodes whose alias requires their id,
+    to pass to `complete_aliases` after insert
+    """
+    pending = []
+    keys = {}
+    for node in nodes:
+        if not node.alias and node.page_type.url_pattern:
+            node.alias = compile_alias_pattern(node.page_type.url_pattern).render(node)
+        if '[node:id]' in node.alias:
+            pending.append((node, False))
+        elif node.alias:
+            keys.setdefault((node.alias, node.language), []).append(node)
+    existing = set()
+    if keys:
+        existing = set(Node.objects
+                       .filter(alias__in=set(alias for alias, language in keys))
+                       .values_list('alias', 'language'))
+    for key, group in keys.items():
+        pending.extend((node, True) for node in (group if key in existing else group[1:]))
+    return pending
+
+
+def complete_aliases(pending):
+    """ Complete the aliases of nodes after `bulk_create`, once their ids are set
+    The id token is replaced and the id is appended to duplicates, as in `Node.save`
+    All aliases are checked in a single query and updated in batches of UPDATE_BATCH_SIZE in a single query each
+    :param pending: the list returned by `prepare_aliases`
+    :return: None
+    """
+    if not pending:
+        return
+    aliases = {node.id: node.alias.replace('[node:id]', str(node.id)) for node, duplicate in pending}
+    existing = set(Node.objects
+                   .filter(alias__in=set(aliases.values()))
+                   .exclude(id__in=list(aliases))
+                   .values_list('alias', 'language'))
+    for node, duplicate in pending:
+        node.alias = aliases[node.id]
+        if duplicate or (node.alias, node.language) in existing:
+            node.alias = '%s/%d' % (node.alias, node.id)
+    for i in range(0, len(pending), UPDATE_BATCH_SIZE):
+        batch = pending[i:i + UPDATE_BATCH_SIZE]
+        Node.objects\
+            .filter(id__in=[node.id for node, duplicate in batch])\
+            .update(alias=Case(*[When(id=node.id, then=Value(node.alias)) for node, duplicate in batch],
+                               output_field=CharField()))
@@ -0,0 +1,42 @@
+""" Cache utility functions """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.core.cache import caches
+from uuid import uuid4
+
+
+def version_key(name):
+    """ Get the cache key that holds the version token of a cached namespace
+    :param name: the namespace name, eg 'alias'
+    :return: a cache key string
+    """
+    return 'ninecms_version_%s' % name
+
+
+def get_version(name):
+    """ Get the current version token of a cached namespace
+    If no token exists (first use or after the cache has been cleared) a new one is stored
+    If the cache backend does not hold values (eg DummyCache) then None is returned
+    :param name: the namespace name
+    :return: a version token string or None
+    """
+    cache = caches['default']
+    key = version_key(name)
+    token = cache.get(key)
+    if token is None:
+        cache.add(key, uuid4().hex, None)
+        token = cache.get(key)
+    return token
+
+
+def bump_version(name):
+    """ Store a new version token for a cached namespace, invalidating all keys built on the previous one
+    :param name: the namespace name
+    :return: the new version token
+    """
+    token = uuid4().hex
+    caches['default'].set(version_key(name), token, None)
+    return token
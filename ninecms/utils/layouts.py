@@ -0,0 +1,44 @@
+""" Block layout cache utility functions """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.core.cache import caches
+from ninecms.models import ContentBlock, MenuItem
+from ninecms.utils.cache import get_version
+
+
+def references_key(version):
+    """ Get the cache key of the layout references for a layout version
+    :param version: the layout version token
+    :return: a cache key string
+    """
+    return 'ninecms_layout_references_%s' % version
+
+
+def get_layout_references(version):
+    """ Get the ids of the nodes and of the menu items referenced by blocks, as cached layouts include these objects
+    The references are loaded in a single query and cached for the layout version, before any layout is cached
+    :param version: the layout version token
+    :return: a tuple of the node id set and the menu item id set
+    """
+    cache = caches['default']
+    references = cache.get(references_key(version))
+    if references is None:
+        references = (set(), set())
+        for node_id, menu_item_id in ContentBlock.objects.values_list('node_id', 'menu_item_id'):
+            references[0].add(node_id)
+            references[1].add(menu_item_id)
+        cache.set(references_key(version), references)
+    return references
+
+
+def is_layout_reference(instance):
+    """ Check if a node or a menu item may be included in cached layouts, without querying the database
+    If the references are not cached, eg evicted, the object is considered referenced
+    :param instance: a node or a menu item object
+    :return: boolean
+    """
+    references = caches['default'].get(references_key(get_version('layout')))
+    return references is None or instance.id in references[isinstance(instance, MenuItem)]
@@ -6,19 +6,89 @@ __email__ = 'gkarak@9-dev.com'
 
 from django import forms
 from django.contrib.admin.widgets import FilteredSelectMultiple
+from django.core.urlresolvers import reverse
+from collections import namedtuple
+
+
+class AutocompleteSource(namedtuple('AutocompleteSource', ('queryset', 'search_field', 'permission'))):
+    """ The records that an autocomplete widget can select, the field searched by prefix, which is also the label
+    of the records, and the permission required to search them (staff is always required)
+    """
+    __slots__ = ()
+
+autocomplete_sources = {}
+
+
+def register_autocomplete(name, queryset, search_field, permission=None):
+    """ Register the records that an autocomplete widget can search
+    :param name: the source name, used in the autocomplete url
+    :param queryset: the queryset of the records
+    :param search_field: the field to search by prefix and to show as label
+    :param permission: the permission required to search, eg 'ninecms.change_taxonomyterm', or None
+    :return: None
+    """
+    autocomplete_sources[name] = AutocompleteSource(queryset, search_field, permission)
+
+
+class AutocompleteSelectMultiple(forms.SelectMultiple):
+    """ Multiple select widget that renders only the selected records
+    Other records are searched by prefix and paged from the `autocomplete` view as the user types,
+    so that the form size does not depend on the number of records
+    """
+    def __init__(self, source, attrs=None):
+        """ Initialize the widget
+        :param source: the name of a registered autocomplete source
+        :param attrs: html attributes
+        :return: None
+        """
+        super(AutocompleteSelectMultiple, self).__init__(attrs)
+        self.source = source
+
+    @property
+    def media(self):
+        """ The widget script
+        :return: Media
+        """
+        return forms.Media(js=('ninecms/autocomplete.js',))
+
+    def render(self, name, value, attrs=None):
+        """ Render a select with only the selected records, in a single query
+        :param name: the field name
+        :param value: a list of the selected pks
+        :param attrs: html attributes
+        :return: html string
+        """
+        source = autocomplete_sources[self.source]
+        pks = [pk for pk in (value or []) if pk not in ('', None)]
+        try:
+            selected = list(source.queryset.filter(pk__in=pks).order_by(source.search_field, 'pk')
+                            .values_list('pk', source.search_field)) if pks else []
+        except (ValueError, TypeError):
+            # invalid pks in submitted data, the field reports the error
+            selected = []
+        attrs = dict(attrs or {}, **{
+            'class': 'autocomplete-select',
+            'data-url': reverse('ninecms:autocomplete', args=(self.source,)),
+        })
+        widget = forms.SelectMultiple(self.attrs, selected)
+        return widget.render(name, pks, attrs)
 
 
 class ModelBiMultipleChoiceField(forms.ModelMultipleChoiceField):
     """ This shows both ends of m2m in admin """
     def __init__(self, queryset, required=False, widget=None, label=None, initial=None, help_text='',
-                 double_list=None, *args, **kwargs):
+                 double_list=None, autocomplete=None, *args, **kwargs):
         """ First add a custom ModelMultipleChoiceField
         Specify a `double_list` label in order to use the double list widget
+        Specify a registered `autocomplete` source name in order to use the autocomplete widget,
+        which renders only the selected records; use for large tables instead of the double list
         Field name should be the same with model's m2m field
         https://www.lasolution.be/blog/related-manytomanyfield-django-admin-site.html
         https://github.com/django/django/blob/master/django/contrib/admin/widgets.py#L24
         """
-        if double_list:
+        if autocomplete:
+            widget = AutocompleteSelectMultiple(autocomplete)
+        elif double_list:
             widget = FilteredSelectMultiple(double_list, True)
         super(ModelBiMultipleChoiceField, self).__init__(
             queryset, required, widget, label, initial, help_text, *args, **kwargs)
@@ -51,6 +121,7 @@ class ManyToManyModelForm(forms.ModelForm):
 
     def save(self, *args, **kwargs):
         """ Handle saving of related
+        The records removed and added in form are found by pk and changed with a single remove and add per field
         :param args
         :param kwargs
         :return: instance
@@ -61,15 +132,14 @@ class ManyToManyModelForm(forms.ModelForm):
             for field_name in self.base_fields:
                 field = self.base_fields[field_name]
                 if type(field).__name__ == 'ModelBiMultipleChoiceField':
-                    # the m2m records, eg if model field is `blocks`, this would be `instance.blocks.all()`
+                    # the m2m records, eg if model field is `blocks`, this would be `instance.blocks`
                     recordset = getattr(self.instance, field_name)
-                    records = recordset.all()
-                    # remove records that have been removed in form
-                    for record in records:
-                        if record not in self.cleaned_data[field_name]:
-                            recordset.remove(record)
-                    # add records that have been added in form
-                    for record in self.cleaned_data[field_name]:
-                        if record not in records:
-                            recordset.add(record)
+                    # compare the pks of the current and the selected records, a single query each
+                    current = set(recordset.values_list('pk', flat=True))
+                    selected = set(record.pk for record in self.cleaned_data[field_name])
+                    # remove records that have been removed in form, add records that have been added in form
+                    if current - selected:
+                        recordset.remove(*(current - selected))
+                    if selected - current:
+                        recordset.add(*(selected - current))
         return instance
@@ -6,9 +6,21 @@ __email__ = 'gkarak@9-dev.com'
 
 from django.core.exceptions import ValidationError
 from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile, File
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from ninecms.utils.transliterate import transliterate
 from subprocess import check_output, call, CalledProcessError
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from PIL import Image as PillowImage
+from hashlib import md5
+from io import BytesIO
+from shutil import copyfileobj
+from tempfile import TemporaryDirectory
 import os
+import posixpath
+import threading
 
 
 def path_file_name(instance, context, filename):
@@ -81,41 +93,538 @@ def validate_video_ext(value):
     validate_ext(value, ['.mp4', '.mpeg', '.m4v', '.webm', '.ogg', '.ogv', '.flv', '.jpg'])
 
 
-def find_all(filename):
-    """ Get all path file names under the path of a given path file name
-    Useful in order to get all files and files from image styles
-    Used in media delete signal
-    http://stackoverflow.com/questions/1724693/find-a-file-in-python
-    :param filename: the absolute path file name to use
-    :return: a list of all absolute path file names
+def find_all(field_file):
+    """ Get the names in storage of a media file and of all recorded image styles of it
+    :param field_file: the FieldFile of an image, a file or a video
+    :return: a list of names
     """
-    path = os.path.dirname(filename)
-    name = os.path.basename(filename)
-    result = []
-    for root, dirs, files in os.walk(path):
-        if name in files:
-            result.append(os.path.join(root, name))
-    return result
+    names = [field_file.name]
+    derivatives = getattr(field_file.instance, 'derivatives', None)
+    if derivatives is not None and field_file.instance.pk:
+        names += list(derivatives.values_list('name', flat=True))
+    return names
 
 
-def delete_all(filename):
+def delete_all(field_file):
     """ Delete all files that `find_all` returns
-    :param filename: the absolute path file name to use
+    :param field_file: the FieldFile of an image, a file or a video
     :return: None
     """
-    for file in find_all(filename):
-        os.remove(file)
+    for name in find_all(field_file):
+        field_file.storage.delete(name)
 
 
-def image_style(image, style):
-    """ Return the url of different image style
-    Construct appropriately if not exist
+def get_image_metadata(image):
+    """ Read the metadata of an image file
+    Only the image header is read, the image is not decoded
+    :param image: ImageFieldFile, committed or uploaded
+    :return: a tuple of width, height, format and size in bytes, all None if the file cannot be read as an image
+    """
+    closed = image.closed
+    try:
+        image.open('rb')
+        image.seek(0)
+        with PillowImage.open(image) as img:
+            width, height = img.size
+            image_format = img.format
+        return width, height, image_format, image.size
+    except (OSError, ValueError):
+        return None, None, '', None
+    finally:
+        if closed:
+            image.close()
+        else:
+            image.seek(0)
+
+
+# The Pillow format name, file extension and mime type of image style output formats
+IMAGE_FORMATS = {
+    'jpeg': ('JPEG', '.jpg', 'image/jpeg'),
+    'jpg': ('JPEG', '.jpg', 'image/jpeg'),
+    'png': ('PNG', '.png', 'image/png'),
+    'gif': ('GIF', '.gif', 'image/gif'),
+    'webp': ('WEBP', '.webp', 'image/webp'),
+    'avif': ('AVIF', '.avif', 'image/avif'),
+}
+
+
+def get_format(image_format):
+    """ Get the Pillow format name, file extension and mime type of an output format
+    :param image_format: the format name, eg webp
+    :return: a tuple of Pillow format name, extension and mime type
+    """
+    image_format = image_format.lower()
+    return IMAGE_FORMATS.get(image_format, (image_format.upper(), '.' + image_format, 'image/' + image_format))
+
+
+def is_format_supported(image_format):
+    """ Check if the image style engine can write an output format
+    With the Pillow engine, the format should have an encoder in the installed Pillow (eg AVIF requires a plugin)
+    ImageMagick is assumed to support all formats
+    :param image_format: the format name
+    :return: boolean
+    """
+    if settings.IMAGE_STYLE_ENGINE != 'pillow':
+        return True
+    PillowImage.init()
+    return get_format(image_format)[0] in PillowImage.SAVE
+
+
+def get_style_name(name, style, style_defs=None):
+    """ Get the name in storage of an image style from the name of the original image
+    The style file has the same name as the original, in a sub-directory with the name of the style
+    If the style has an output format, the extension of the format is appended
+    :param name: the original name, eg ninecms/basic/image/test.png
+    :param style: the style name, eg large
+    :param style_defs: the style definitions, as returned by `get_styles`, if already resolved
+    :return: the style name, eg ninecms/basic/image/large/test.png or ninecms/basic/image/large_webp/test.png.webp
+    """
+    style_name = posixpath.join(posixpath.dirname(name), style, posixpath.basename(name))
+    image_format = (style_defs or get_styles()).get(style, {}).get('format')
+    if image_format:
+        extension = get_format(image_format)[1]
+        if not style_name.lower().endswith(extension):
+            style_name += extension
+    return style_name
+
+
+# The height bound of responsive style variants: the largest JPEG dimension, so that only the width restricts
+RESPONSIVE_HEIGHT = 65535
+
+
+def get_variant_name(style, width):
+    """ Get the name of a width variant of a responsive style
+    :param style: the responsive style name, eg hero
+    :param width: the variant width, eg 640
+    :return: the variant style name, eg hero_640w
+    """
+    return '%s_%dw' % (style, width)
+
+
+def get_format_name(style, image_format):
+    """ Get the name of an alternative output format of a style
+    :param style: the style name, eg large
+    :param image_format: the format name, eg webp
+    :return: the alternative style name, eg large_webp
+    """
+    return '%s_%s' % (style, image_format.lower())
+
+
+_styles = None
+
+
+def get_styles():
+    """ Get the definitions of all image styles that are constructed as files
+    Responsive styles (type `responsive`) are expanded to a `thumbnail` style per width in `widths`,
+    named by `get_variant_name`, which scales the image to that width without upscaling
+    Styles with alternative output `formats` are expanded to a style per format that the engine supports,
+    named by `get_format_name`
+    The definitions are expanded once and kept until IMAGE_STYLES or IMAGE_STYLE_ENGINE change; do not modify them
+    :return: a dict of style name to style dict
+    """
+    global _styles
+    if _styles is not None:
+        return _styles
+    styles = {}
+
+    def add(name, style_def):
+        """ Add a style and its alternative formats """
+        styles[name] = style_def
+        for image_format in style_def.get('formats', ()):
+            if is_format_supported(image_format):
+                styles[get_format_name(name, image_format)] = dict(style_def, format=image_format, formats=())
+
+    for style, style_def in settings.IMAGE_STYLES.items():
+        if style_def['type'] == 'responsive':
+            output = {key: value for key, value in style_def.items() if key in ('format', 'quality', 'formats')}
+            for width in style_def['widths']:
+                add(get_variant_name(style, width), dict(output, type='thumbnail', size=(width, RESPONSIVE_HEIGHT)))
+        else:
+            add(style, style_def)
+    _styles = styles
+    return styles
+
+
+# noinspection PyUnusedLocal
+@receiver(setting_changed)
+def clear_styles(setting, **kwargs):
+    """ Drop the expanded style definitions when a setting they depend on changes, eg with `override_settings`
+    :param setting: the setting name
+    :param kwargs: other arguments
+    :return: None
+    """
+    global _styles
+    if setting in ('IMAGE_STYLES', 'IMAGE_STYLE_ENGINE'):
+        _styles = None
+
+
+def get_style_variants(style, source_size=None):
+    """ Get the widths and style names of the variants of a responsive style, in ascending width
+    If the original image size is known, variants wider than the original are left out, except the narrowest,
+    as they would be identical to the variant of the original width
+    :param style: the responsive style name
+    :param source_size: a tuple of the stored width and height of the original image, if known
+    :return: a list of tuples of width and variant style name
+    """
+    widths = sorted(settings.IMAGE_STYLES[style]['widths'])
+    if source_size:
+        widths = widths[:1] + [width for width in widths[1:] if width <= source_size[0]]
+    return [(width, get_variant_name(style, width)) for width in widths]
+
+
+def resolve_style(style, source_size=None):
+    """ Get the style that is constructed as a file for a style name
+    A responsive style resolves to its widest variant that is not wider than the original image
+    :param style: the style name
+    :param source_size: a tuple of the stored width and height of the original image, if known
+    :return: the style name to construct
+    """
+    if settings.IMAGE_STYLES.get(style, {}).get('type') == 'responsive':
+        return get_style_variants(style, source_size)[-1][1]
+    return style
+
+
+def get_missing_styles(storage, name):
+    """ Get the image styles that do not exist for an image
+    :param storage: the storage of the image
+    :param name: the image name in storage
+    :return: a list of style names
+    """
+    style_defs = get_styles()
+    return [style for style in style_defs if not storage.exists(get_style_name(name, style, style_defs))]
+
+
+def get_style_geometry(source_size, style_def):
+    """ Get the crop box and the target size of an image style
+    See 9cms-crop.odt
+    :param source_size: a tuple of the original image width and height
+    :param style_def: the style dict
+    :return: a tuple of the crop box (left, upper, right, lower) or None, and the target size tuple
+    """
+    source_size_x, source_size_y = source_size
+    target_size_x, target_size_y = style_def['size']
+    if style_def['type'] == 'thumbnail-crop':
+        source_ratio = float(source_size_x) / float(source_size_y)
+        target_ratio = float(target_size_x) / float(target_size_y)
+        if source_ratio > target_ratio:  # crop vertically
+            crop_target_size_x = source_size_y * target_ratio
+            offset = (source_size_x - crop_target_size_x) / 2
+            box = (int(round(offset)), 0, int(round(offset + crop_target_size_x)), source_size_y)
+        else:  # crop horizontally
+            crop_target_size_y = source_size_x / target_ratio
+            offset = (source_size_y - crop_target_size_y) / 2
+            box = (0, int(round(offset)), source_size_x, int(round(offset + crop_target_size_y)))
+        return box, (target_size_x, target_size_y)
+    scale = min(float(target_size_x) / source_size_x, float(target_size_y) / source_size_y)
+    # thumbnail does not upscale, thumbnail-upscale does
+    if style_def['type'] == 'thumbnail' and scale > 1:
+        scale = 1
+    return None, (max(int(round(source_size_x * scale)), 1), max(int(round(source_size_y * scale)), 1))
+
+
+def save_style(storage, style_name, content):
+    """ Save the content of an image style to storage, replacing any existing file
+    If another worker saves the same style in the meantime, the storage saves this one under an alternative name,
+    which is never recorded; it is deleted and the file of the other worker is kept, as it has the same content
+    :param storage: the storage of the image
+    :param style_name: the style name in storage
+    :param content: a django File
+    :return: None
+    """
+    if storage.exists(style_name):
+        storage.delete(style_name)
+    saved_name = storage.save(style_name, content)
+    if saved_name != style_name:
+        storage.delete(saved_name)
+
+
+def create_styles_pillow(storage, name, styles):
+    """ Construct the files of image styles in memory with Pillow
+    The original image is read and decoded once for all styles
+    Each style is saved in its output `format` and `quality`, if defined, or else in the format of the original
+    JPEG images are decoded at the smallest scale that the target sizes of all styles allow
+    :param storage: the storage of the image
+    :param name: the image name in storage
+    :param styles: a list of style names
+    :return: a list of the style names created
+    """
+    with storage.open(name, 'rb') as file, PillowImage.open(file) as source:
+        image_format = source.format
+        original_size = source.size
+        style_defs = get_styles()
+        geometry = [(style, style_defs[style]) for style in styles]
+        if image_format == 'JPEG':
+            required = [0, 0]
+            for style, style_def in geometry:
+                box, size = get_style_geometry(original_size, style_def)
+                if box:
+                    size = (size[0] * original_size[0] // (box[2] - box[0]),
+                            size[1] * original_size[1] // (box[3] - box[1]))
+                required = [max(required[0], size[0]), max(required[1], size[1])]
+            source.draft(source.mode, tuple(required))
+        source.load()
+        if source.mode in ('1', 'P', 'LA'):
+            source = source.convert('RGBA' if source.mode == 'LA' or 'transparency' in source.info else 'RGB')
+        created = []
+        for style, style_def in geometry:
+            size = get_style_geometry(original_size, style_def)[1]
+            box = get_style_geometry(source.size, style_def)[0]
+            img = source.crop(box) if box else source
+            if img.size != size:
+                img = img.resize(size, PillowImage.LANCZOS)
+            style_format = get_format(style_def['format'])[0] if style_def.get('format') else image_format
+            if style_format == 'JPEG' and img.mode not in ('RGB', 'L', 'CMYK'):
+                img = img.convert('RGB')
+            quality = style_def.get('quality', 90 if style_format == 'JPEG' else None)
+            options = {'quality': quality} if quality else {}
+            buffer = BytesIO()
+            try:
+                img.save(buffer, format=style_format, **options)
+            except (KeyError, OSError):  # no encoder for the output format
+                continue
+            save_style(storage, get_style_name(name, style, style_defs), ContentFile(buffer.getvalue()))
+            created.append(style)
+    return created
+
+
+def create_style_imagemagick(img_path_file_name, style_path_file_name, style_def, source_size=None):
+    """ Construct the file of an image style with ImageMagick
+    The original image size is read only if it is not provided
+    :param img_path_file_name: the absolute path file name of the original image
+    :param style_path_file_name: the absolute path file name of the style
+    :param style_def: the style dict
+    :param source_size: a tuple of the stored width and height of the original image, if known
+    :return: True if the style has been created, False if the original image cannot be read
+    """
+    by = chr(120)   # x
+    plus = chr(43)  # +
+    # the output format is defined by the extension of the style file
+    quality = ['-quality', str(style_def['quality'])] if style_def.get('quality') else []
+
+    if source_size:
+        source_size_str = str(source_size[0]) + by + str(source_size[1])
+    else:
+        # remove original path file name as it may contain spaces, before splitting
+        # exception: usually file not exists (db or memcached inconsistency)
+        try:
+            # noinspection PyUnresolvedReferences
+            source_size_str = check_output(['identify', img_path_file_name]).decode()
+        except CalledProcessError:  # pragma: nocover
+            return False
+        source_size_str = source_size_str[len(img_path_file_name):].split(' ')[2]
+
+    source_size_array = source_size_str.split(by)
+    source_size_x = int(source_size_array[0])
+    source_size_y = int(source_size_array[1])
+    target_size_x = style_def['size'][0]
+    target_size_y = style_def['size'][1]
+    target_size_str = str(target_size_x) + by + str(target_size_y)
+
+    # thumbnail
+    if style_def['type'] == 'thumbnail':
+        if target_size_x > source_size_x and target_size_y > source_size_y:
+            target_size_str = source_size_str
+        call(['convert', img_path_file_name, '-thumbnail', target_size_str, '-antialias'] + quality +
+             [style_path_file_name])
+
+    # thumbnail-upscale
+    elif style_def['type'] == 'thumbnail-upscale':
+        call(['convert', img_path_file_name, '-thumbnail', target_size_str, '-antialias'] + quality +
+             [style_path_file_name])
+
+    # thumbnail-crop
+    elif style_def['type'] == 'thumbnail-crop':
+        source_ratio = float(source_size_x) / float(source_size_y)
+        target_ratio = float(target_size_x) / float(target_size_y)
+        if source_ratio > target_ratio:  # crop vertically
+            crop_target_size_x = source_size_y * target_ratio
+            crop_target_size_y = source_size_y
+            offset = (source_size_x - crop_target_size_x) / 2
+            crop_size_str = str(crop_target_size_x) + by + str(crop_target_size_y) + plus + str(offset) + plus + '0'
+        else:  # crop horizontally
+            crop_target_size_x = source_size_x
+            crop_target_size_y = source_size_x / target_ratio
+            offset = (source_size_y - crop_target_size_y) / 2
+            crop_size_str = str(crop_target_size_x) + by + str(crop_target_size_y) + plus + '0' + plus + str(offset)
+        call(['convert', img_path_file_name, '-crop', crop_size_str, style_path_file_name])
+        call(['convert', style_path_file_name, '-thumbnail', target_size_str, '-antialias'] + quality +
+             [style_path_file_name])
+        # moderators ^ and \> for -thumbnail and -resize do not work consistently:
+        # "invalid argument for option `-resize'"
+        # call(['convert', path_file_name, '-thumbnail', target_size_str + '^', '-gravity', 'center', '-extent',
+        #      target_size_str, '-antialias', style_path_file_name])
+
+    # # crop
+    # elif style_def['type'] == 'crop':
+    #    call(['convert', img_path_file_name, '-gravity', 'center', '-crop', target_size_str, style_path_file_name])
+    #     call(['convert', img_path_file_name, '-gravity', 'center', '-background', 'None', '-extent',
+    #           target_size_str, style_path_file_name])
+    return True
+
+
+def create_styles_imagemagick(storage, name, styles, source_size=None):
+    """ Construct the files of image styles with ImageMagick
+    If the storage has no local paths, the original image is copied to a temporary directory once
+    and the style files are saved to storage from there
+    :param storage: the storage of the image
+    :param name: the image name in storage
+    :param styles: a list of style names
+    :param source_size: a tuple of the stored width and height of the original image, if known
+    :return: a list of the style names created
+    """
+    created = []
+    style_defs = get_styles()
+    try:
+        img_path_file_name = storage.path(name)
+    except NotImplementedError:
+        img_path_file_name = None
+    if img_path_file_name:
+        for style in styles:
+            style_path_file_name = storage.path(get_style_name(name, style, style_defs))
+            os.makedirs(os.path.dirname(style_path_file_name), exist_ok=True)
+            if create_style_imagemagick(img_path_file_name, style_path_file_name, style_defs[style], source_size):
+                created.append(style)
+        return created
+    with TemporaryDirectory() as temp_path:
+        img_path_file_name = os.path.join(temp_path, posixpath.basename(name))
+        with storage.open(name, 'rb') as source, open(img_path_file_name, 'wb') as target:
+            copyfileobj(source, target)
+        for style in styles:
+            style_name = get_style_name(name, style, style_defs)
+            style_path_file_name = os.path.join(temp_path, style + '_' + posixpath.basename(style_name))
+            if create_style_imagemagick(img_path_file_name, style_path_file_name, style_defs[style],
+                                        source_size) and os.path.exists(style_path_file_name):
+                with open(style_path_file_name, 'rb') as content:
+                    save_style(storage, style_name, File(content))
+                created.append(style)
+    return created
+
+
+def create_styles(storage, name, styles=None, source_size=None):
+    """ Construct the files of image styles
+    Use Pillow if IMAGE_STYLE_ENGINE is set to pillow, falling back to ImageMagick if Pillow cannot read the image
     See 9cms-crop.odt
 
     Available styles
      - thumbnail: create a thumbnail restricted to the smaller dimension
      - thumbnail-upscale: create a thumbnail that is upscaled if smaller
      - thumbnail-crop: create a thumbnail that is cropped to the exact dimension
+     - responsive: create a thumbnail for each of multiple widths, see `get_styles`
+
+    :param storage: the storage of the image
+    :param name: the image name in storage
+    :param styles: a list of style names, default all styles
+    :param source_size: a tuple of the stored width and height of the original image, if known
+    :return: a list of the style names created
+    """
+    if styles is None:
+        styles = list(get_styles())
+    if settings.IMAGE_STYLE_ENGINE == 'pillow':
+        try:
+            return create_styles_pillow(storage, name, styles)
+        except (OSError, ValueError):
+            pass
+    return create_styles_imagemagick(storage, name, styles, source_size)
+
+
+def create_pool(workers=None):
+    """ Create a worker pool for image styles, of the type defined in IMAGE_STYLE_POOL
+    :param workers: the number of workers, default IMAGE_STYLE_WORKERS
+    :return: a concurrent.futures executor
+    """
+    pool = ProcessPoolExecutor if settings.IMAGE_STYLE_POOL == 'process' else ThreadPoolExecutor
+    return pool(max_workers=workers or settings.IMAGE_STYLE_WORKERS)
+
+
+_pool = None
+_pool_settings = None
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def get_pool():
+    """ Get the worker pool for image styles
+    The pool is created on first use, and again if IMAGE_STYLE_WORKERS or IMAGE_STYLE_POOL have changed since
+    A replaced pool completes its pending tasks in the background
+    :return: a concurrent.futures executor
+    """
+    global _pool, _pool_settings
+    pool_settings = (settings.IMAGE_STYLE_WORKERS, settings.IMAGE_STYLE_POOL)
+    if _pool is None or _pool_settings != pool_settings:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool, _pool_settings = create_pool(), pool_settings
+    return _pool
+
+
+def schedule_styles(storage, name, source_size=None, styles=None):
+    """ Schedule the construction of image styles in the worker pool
+    All styles of an image are constructed in a single task
+    A style already scheduled is not scheduled again until it is done: the pending styles are checked and updated
+    under a lock, as requests may schedule the same styles in parallel threads
+    Used in image save signal
+    :param storage: the storage of the image
+    :param name: the image name in storage
+    :param source_size: a tuple of the stored width and height of the original image, if known
+    :param styles: a list of style names, default all styles that do not exist
+    :return: a list of futures of the `create_styles` results
+    """
+    if styles is None:
+        styles = get_missing_styles(storage, name)
+    with _pending_lock:
+        futures = set(_pending[(name, style)] for style in styles if (name, style) in _pending)
+        styles = [style for style in styles if (name, style) not in _pending]
+        if styles:
+            future = get_pool().submit(create_styles, storage, name, styles, source_size)
+            _pending.update(((name, style), future) for style in styles)
+            futures.add(future)
+    if styles:
+        # outside the lock, as the callback runs at once in this thread if the task is already done
+        future.add_done_callback(lambda done: forget_pending(name, styles, done))
+    return list(futures)
+
+
+def forget_pending(name, styles, future):
+    """ Remove the styles of a task from the pending styles when the task is done
+    :param name: the image name in storage
+    :param styles: the style names of the task
+    :param future: the future of the task
+    :return: None
+    """
+    with _pending_lock:
+        for style in styles:
+            if _pending.get((name, style)) is future:
+                del _pending[(name, style)]
+
+
+def get_style_cache_key(name, style, size=None):
+    """ Get the key of an image style in the image style registry
+    Uploaded images never overwrite existing files, so the name with the recorded file size identify the original
+    :param name: the image name in storage
+    :param style: the style name
+    :param size: the recorded size in bytes of the original image, if any
+    :return: a cache key string
+    """
+    return 'ninecms_style_%s' % md5(('%s:%s:%s' % (name, style, size or '')).encode()).hexdigest()
+
+
+def forget_styles(name, size=None):
+    """ Remove all styles of an image from the image style registry
+    Used in image delete signal
+    :param name: the image name in storage
+    :param size: the recorded size in bytes of the original image, if any
+    :return: None
+    """
+    caches['default'].delete_many([get_style_cache_key(name, style, size) for style in get_styles()])
+
+
+def image_style(image, style):
+    """ Return the url of different image style
+    Construct appropriately if not exist
+    If IMAGE_STYLE_WORKERS is set, the style is constructed in the worker pool instead
+    and the url of the placeholder or the original image is returned until it is ready
+    Urls of existing styles are kept in the default cache, so that no file is accessed while they are cached
+    A responsive style returns the url of its widest variant
 
     :param image: ImageFieldFile
     :param style: Specify style to return image
@@ -123,83 +632,134 @@ def image_style(image, style):
     """
     if not image:  # pragma: nocover
         return image
-    # original url full: /media/ninecms/basic/image/test.png
-    url = image.url
-    # original url without file: /media/ninecms/basic/image
-    url_path = '/'.join(url.split('/')[:-1])
-    # original path full: ~/ninecms/media/ninecms/basic/image/test.png
-    img_path_file_name = str(image.file)
-    # original file: test.png
-    img_file_name = os.path.basename(img_path_file_name)
-
-    # style url without file: /media/ninecms/basic/image/large
-    style_url_path = '/'.join((url_path, style))
-    # style url full: /media/ninecms/basic/image/large/test.png
-    style_url = '/'.join((style_url_path, img_file_name))
-    # style path without file: ~/ninecms/media/ninecms/basic/image/large
-    style_path = os.path.join(os.path.dirname(img_path_file_name), style)
-    # style path full: ~/ninecms/media/ninecms/basic/image/large/test.png
-    style_path_file_name = os.path.join(style_path, img_file_name)
-
-    # the style dict
+    style = resolve_style(style, get_source_size(image))
+    return image_style_urls(image, [style])[style]
+
+
+def image_srcset(image, style):
+    """ Return the srcset attribute value of a responsive image style
+    All missing variants are constructed together, so that the Pillow engine decodes the original image once
+    :param image: ImageFieldFile
+    :param style: the responsive style name
+    :return: a string of comma separated urls with width descriptors
+    """
+    if not image:  # pragma: nocover
+        return ''
+    variants = get_style_variants(style, get_source_size(image))
+    urls = image_style_urls(image, [variant for width, variant in variants])
+    return ', '.join('%s %dw' % (urls[variant], width) for width, variant in variants)
+
+
+def image_picture(image, style):
+    """ Return the sources of a picture element for an image style, one per alternative output format
+    All styles are resolved with a single registry read and all missing styles are constructed together
+    Formats not supported by the engine and styles not yet constructed are left out of the sources
+    :param image: ImageFieldFile
+    :param style: the style name, may be responsive
+    :return: a dict of `sources`, a list of tuples of mime type and srcset, and `src`, `srcset` and `size` of the img
+    """
+    source_size = get_source_size(image)
     style_def = settings.IMAGE_STYLES[style]
+    if style_def['type'] == 'responsive':
+        variants = get_style_variants(style, source_size)
+    else:
+        variants = [(None, style)]
+    style_defs = get_styles()
+    formats = [image_format for image_format in style_def.get('formats', ())
+               if get_format_name(variants[0][1], image_format) in style_defs]
+    alternatives = [[(width, get_format_name(variant, image_format)) for width, variant in variants]
+                    for image_format in formats]
+    urls, unavailable = get_style_urls(image, [variant for width, variant in variants] +
+                                       [variant for alternative in alternatives for width, variant in alternative])
+
+    def srcset(widths):
+        """ Get the srcset of the variants of a style, or the url if the style is not responsive """
+        return ', '.join(urls[variant] if width is None else '%s %dw' % (urls[variant], width)
+                         for width, variant in widths)
+
+    sources = [(get_format(image_format)[2], srcset(alternative))
+               for image_format, alternative in zip(formats, alternatives)
+               if not unavailable.intersection(variant for width, variant in alternative)]
+    return {
+        'sources': sources,
+        'src': urls[variants[-1][1]],
+        'srcset': srcset(variants) if variants[0][0] is not None else '',
+        'size': image_style_size(image, style),
+    }
+
+
+def image_style_urls(image, styles):
+    """ Return the urls of image styles of an image, see `image_style` and `get_style_urls`
+    :param image: ImageFieldFile
+    :param styles: a list of style names, as returned by `get_styles`
+    :return: a dict of style name to url
+    """
+    return get_style_urls(image, styles)[0]
 
-    if not os.path.exists(style_path_file_name):
-        if not os.path.exists(style_path):
-            os.makedirs(style_path)
-        by = chr(120)   # x
-        plus = chr(43)  # +
 
-        # remove original path file name as it may contain spaces, before splitting
-        # exception: usually file not exists (db or memcached inconsistency)
-        try:
-            # noinspection PyUnresolvedReferences
-            source_size_str = check_output(['identify', img_path_file_name]).decode()
-        except CalledProcessError:  # pragma: nocover
-            return url
-        source_size_str = source_size_str[len(img_path_file_name):].split(' ')[2]
+def get_style_urls(image, styles):
+    """ Get the urls of image styles of an image, and the styles that are not available yet
+    The registry is read for all styles at once, and all missing styles are constructed or scheduled in one task
+    Styles not available yet get the url of the placeholder or the original image, which is not registered
+    No records are written: the style files of an image are recorded when the image is saved
+    :param image: ImageFieldFile
+    :param styles: a list of style names, as returned by `get_styles`
+    :return: a tuple of a dict of style name to url and a set of the unavailable style names
+    """
+    cache = caches['default']
+    keys = {style: get_style_cache_key(image.name, style, getattr(image.instance, 'size', None)) for style in styles}
+    cached = cache.get_many(list(keys.values()))
+    storage = image.storage
+    style_defs = get_styles()
+    urls = {}
+    missing = []
+    for style in styles:
+        if keys[style] in cached:
+            urls[style] = cached[keys[style]]
+            continue
+        style_name = get_style_name(image.name, style, style_defs)
+        urls[style] = storage.url(style_name)
+        if not storage.exists(style_name):
+            missing.append(style)
+    unavailable = []
+    if missing:
+        source_size = get_source_size(image)
+        if settings.IMAGE_STYLE_WORKERS:
+            schedule_styles(storage, image.name, source_size, missing)
+            unavailable = missing
+            fallback_url = settings.IMAGE_STYLE_PLACEHOLDER or image.url
+        else:
+            created = create_styles(storage, image.name, missing, source_size)
+            unavailable = [style for style in missing if style not in created]
+            fallback_url = image.url
+        for style in unavailable:
+            urls[style] = fallback_url
+    cache.set_many({keys[style]: urls[style] for style in styles
+                    if keys[style] not in cached and style not in unavailable})
+    return urls, set(unavailable)
+
+
+def get_source_size(image):
+    """ Get the stored size of an image
+    :param image: ImageFieldFile
+    :return: a tuple of width and height or None if not stored
+    """
+    instance = getattr(image, 'instance', None)
+    width = getattr(instance, 'width', None)
+    height = getattr(instance, 'height', None)
+    if width and height:
+        return width, height
+    return None
+
 
-        source_size_array = source_size_str.split(by)
-        source_size_x = int(source_size_array[0])
-        source_size_y = int(source_size_array[1])
-        target_size_x = style_def['size'][0]
-        target_size_y = style_def['size'][1]
-        target_size_str = str(target_size_x) + by + str(target_size_y)
-
-        # thumbnail
-        if style_def['type'] == 'thumbnail':
-            if target_size_x > source_size_x and target_size_y > source_size_y:
-                target_size_str = source_size_str
-            call(['convert', img_path_file_name, '-thumbnail', target_size_str, '-antialias', style_path_file_name])
-
-        # thumbnail-upscale
-        elif style_def['type'] == 'thumbnail-upscale':
-            call(['convert', img_path_file_name, '-thumbnail', target_size_str, '-antialias', style_path_file_name])
-
-        # thumbnail-crop
-        elif style_def['type'] == 'thumbnail-crop':
-            source_ratio = float(source_size_x) / float(source_size_y)
-            target_ratio = float(target_size_x) / float(target_size_y)
-            if source_ratio > target_ratio:  # crop vertically
-                crop_target_size_x = source_size_y * target_ratio
-                crop_target_size_y = source_size_y
-                offset = (source_size_x - crop_target_size_x) / 2
-                crop_size_str = str(crop_target_size_x) + by + str(crop_target_size_y) + plus + str(offset) + plus + '0'
-            else:  # crop horizontally
-                crop_target_size_x = source_size_x
-                crop_target_size_y = source_size_x / target_ratio
-                offset = (source_size_y - crop_target_size_y) / 2
-                crop_size_str = str(crop_target_size_x) + by + str(crop_target_size_y) + plus + '0' + plus + str(offset)
-            call(['convert', img_path_file_name, '-crop', crop_size_str, style_path_file_name])
-            call(['convert', style_path_file_name, '-thumbnail', target_size_str, '-antialias', style_path_file_name])
-            # moderators ^ and \> for -thumbnail and -resize do not work consistently:
-            # "invalid argument for option `-resize'"
-            # call(['convert', path_file_name, '-thumbnail', target_size_str + '^', '-gravity', 'center', '-extent',
-            #      target_size_str, '-antialias', style_path_file_name])
-
-        # # crop
-        # elif style_def['type'] == 'crop':
-        #    call(['convert', img_path_file_name, '-gravity', 'center', '-crop', target_size_str, style_path_file_name])
-        #     call(['convert', img_path_file_name, '-gravity', 'center', '-background', 'None', '-extent',
-        #           target_size_str, style_path_file_name])
-    return style_url
+def image_style_size(image, style):
+    """ Get the size of an image style from the stored size of the image, without reading any file
+    :param image: ImageFieldFile
+    :param style: the style name
+    :return: a tuple of width and height or None if the image size is not stored
+    """
+    source_size = get_source_size(image)
+    if not source_size:
+        return None
+    style = resolve_style(style, source_size)
+    return get_style_geometry(source_size, get_styles()[style])[1]
@@ -0,0 +1,137 @@
+""" Menu compilation utility functions """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.core.cache import caches
+from collections import namedtuple
+from ninecms.models import MenuItem
+from ninecms.utils.cache import get_version
+from ninecms.utils.nodes import get_menu_full_path, get_clean_url
+
+
+class MenuNode(namedtuple('MenuNode', ('id', 'title', 'path', 'url', 'children'))):
+    """ An immutable compiled menu item: `url` is the resolved full path and `children` a tuple of menu nodes """
+    __slots__ = ()
+
+    @property
+    def is_leaf_node(self):
+        """ Same as the MPTT model method, for use in templates
+        :return: boolean
+        """
+        return not self.children
+
+
+class Trail(namedtuple('Trail', ('items', 'ids', 'active_id'))):
+    """ The active trail of a path: the menu nodes from the top level down to the active one, their ids as a set
+    and the id of the active menu node
+    """
+    __slots__ = ()
+
+EMPTY_TRAIL = Trail((), frozenset(), None)
+
+
+def get_path_variants(path):
+    """ Get the variants of a menu item path with or without leading and trailing slashes
+    :param path: the menu item path
+    :return: a set of path strings
+    """
+    path = path.strip('/')
+    if not path:
+        return {'/', ''}
+    return {path, '/' + path, path + '/', '/' + path + '/'}
+
+
+class MenuTree(object):
+    """ The compiled tree of the descendants of a menu item for a language
+    Disabled items and items of other languages are pruned along with their descendants
+    Iterate to get the top level menu nodes
+    An index of path variants to active trails is built along, so that finding the active trail of a request path
+    is a single dictionary lookup
+    """
+    def __init__(self, root_id, language, items):
+        """ Initialize the tree and build the active trail index
+        If more than one menu nodes have the same path, the first in tree order is used
+        :param root_id: the id of the root menu item, which is not included in the tree
+        :param language: the language the tree has been compiled for
+        :param items: a tuple of the top level menu nodes
+        :return: None
+        """
+        self.root_id = root_id
+        self.language = language
+        self.items = items
+        self.trails = {}
+        stack = list((item, ()) for item in reversed(items))
+        while stack:
+            item, ancestors = stack.pop()
+            chain = ancestors + (item,)
+            if item.path:
+                trail = Trail(chain, frozenset(node.id for node in chain), item.id)
+                for path in get_path_variants(item.path):
+                    self.trails.setdefault(path, trail)
+            stack.extend((child, chain) for child in reversed(item.children))
+
+    def get_trail(self, path):
+        """ Get the active trail of a request path
+        The language part of the path is removed if i18n urls are enabled
+        :param path: the request path
+        :return: a Trail
+        """
+        return self.trails.get(get_clean_url(path), EMPTY_TRAIL)
+
+    def __iter__(self):
+        """ Iterate the top level menu nodes
+        :return: an iterator
+        """
+        return iter(self.items)
+
+    def __len__(self):
+        """ Get the number of top level menu nodes
+        :return: integer
+        """
+        return len(self.items)
+
+
+def compile_menu(root, language):
+    """ Compile the tree of the descendants of a menu item in a single query
+    The MPTT fields provide the items in tree order, so that every parent is met before its children
+    :param root: the root menu item
+    :param language: the language to compile for
+    :return: a MenuTree
+    """
+    items = MenuItem.objects\
+        .filter(tree_id=root.tree_id, lft__gt=root.lft, rght__lt=root.rght)\
+        .order_by('lft')\
+        .values_list('id', 'parent_id', 'title', 'path', 'language', 'disabled')
+    children = {root.id: []}
+    fields = {}
+    for item_id, parent_id, title, path, item_language, disabled in items:
+        if parent_id not in children or disabled or item_language not in (language, ''):
+            continue
+        children[parent_id].append(item_id)
+        children[item_id] = []
+        fields[item_id] = (title, path, get_menu_full_path(path, item_language))
+
+    def freeze(item_id):
+        """ Construct an immutable menu node recursively """
+        title, path, url = fields[item_id]
+        return MenuNode(item_id, title, path, url, tuple(freeze(child) for child in children[item_id]))
+
+    return MenuTree(root.id, language, tuple(freeze(item_id) for item_id in children[root.id]))
+
+
+def get_menu_tree(root, language):
+    """ Get the compiled tree of a menu item from the cache, compile if necessary
+    Menu trees are invalidated when any menu item changes or the menu is rebuilt
+    :param root: the root menu item
+    :param language: the language of the request
+    :return: a MenuTree
+    """
+    cache = caches['default']
+    key = 'ninecms_menu_%s_%d_%s' % (get_version('menu'), root.id, language)
+    tree = cache.get(key)
+    if tree is None:
+        tree = compile_menu(root, language)
+        cache.set(key, tree)
+    return tree
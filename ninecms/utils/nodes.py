@@ -5,6 +5,14 @@ __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
 from django.conf import settings
+from django.utils import timezone
+from django.utils.dateformat import DateFormat
+from functools import lru_cache
+from ninecms.utils.transliterate import transliterate
+import re
+
+# The tokens of url alias patterns: [node:id], [node:title], [node:created:format], [node:changed:format]
+ALIAS_TOKEN_RE = re.compile(r'\[node:(?:(id|title)|(created|changed):([^\]]+))\]')
 
 
 def get_full_path(path, language, bookmark=''):
@@ -24,6 +32,26 @@ def get_full_path(path, language, bookmark=''):
     return path
 
 
+def get_menu_full_path(path, language):
+    """ Get the full path of a menu item path including language (if any)
+    External urls and bookmarks are returned as they are
+    @see 9cms_menu_full_path.ods
+    :param path: the menu item path
+    :param language: the menu item language
+    :return: full path string
+    """
+    if path.startswith('http:') or path.startswith('https:'):
+        return path
+    if path.startswith('#'):
+        return path
+    bookmark = ''
+    bookmark_pos = path.find('#')
+    if bookmark_pos > 0:
+        bookmark = path[bookmark_pos:]
+        path = path[:bookmark_pos]
+    return get_full_path(path, language, bookmark)
+
+
 def get_clean_url(url):
     """ Get a url without the language part, if i18n urls are defined
     :param url: a string with the url to clean
@@ -32,3 +60,49 @@ def get_clean_url(url):
     url = url.strip('/')
     url = '/' if not url else url
     return '/'.join(url.split('/')[1:]) if settings.I18N_URLS else url
+
+
+class AliasPattern(object):
+    """ A compiled url alias pattern of a page type
+    The pattern is split once into literal parts and tokens, so that rendering is a single join
+    """
+    def __init__(self, pattern):
+        """ Compile the pattern
+        :param pattern: the page type url pattern, eg news/[node:created:Y-m]/[node:title]
+        :return: None
+        """
+        self.parts = []
+        position = 0
+        for match in ALIAS_TOKEN_RE.finditer(pattern):
+            self.parts.append(pattern[position:match.start()])
+            self.parts.append((match.group(1) or match.group(2), match.group(3)))
+            position = match.end()
+        self.parts.append(pattern[position:])
+        self.has_id = ('id', None) in self.parts
+
+    def render(self, node):
+        """ Render the alias of a node
+        If the node has no id yet, the [node:id] token is kept to be replaced after insert
+        :param node: the node object
+        :return: the alias string
+        """
+        alias = []
+        for part in self.parts:
+            if isinstance(part, str):
+                alias.append(part)
+            elif part[0] == 'id':
+                alias.append(str(node.id) if node.id else '[node:id]')
+            elif part[0] == 'title':
+                alias.append(transliterate(node.title, False, True))
+            else:
+                alias.append(DateFormat(getattr(node, part[0]) or timezone.now()).format(part[1]))
+        return ''.join(alias)
+
+
+@lru_cache(maxsize=128)
+def compile_alias_pattern(pattern):
+    """ Get the compiled url alias pattern of a page type, compile if necessary
+    :param pattern: the page type url pattern
+    :return: an AliasPattern
+    """
+    return AliasPattern(pattern)
@@ -4,6 +4,8 @@ __copyright__ = 'Copyright 2015, George Karakostas'
 __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
+from django.contrib.auth.models import User, Permission
+from django.db.models import Q
 # noinspection PyPackageRequirements
 from guardian.shortcuts import get_groups_with_perms, assign_perm, remove_perm
 
@@ -45,3 +47,18 @@ def set_perms(obj, fields, suffix, perms):
         for group in old_perms[field]:
             if group not in perms[field]:
                 remove_perm(field + suffix, group, obj)
+
+
+def get_users_with_perm(codename, app_label='ninecms'):
+    """ Get the ids of all users that have a global permission, in a single query
+    Superusers and users with the permission assigned directly or through a group are included
+    To be used in bulk operations instead of `user.has_perm` for each record
+
+    :param codename: the permission codename
+    :param app_label: the permission app label
+    :return: a set of user ids
+    """
+    permission = Permission.objects.get(content_type__app_label=app_label, codename=codename)
+    return set(User.objects
+               .filter(Q(is_superuser=True) | Q(user_permissions=permission) | Q(groups__permissions=permission))
+               .values_list('id', flat=True))
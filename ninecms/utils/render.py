@@ -6,13 +6,23 @@ __email__ = 'gkarak@9-dev.com'
 
 from django.conf import settings
 from django.views.generic import View
-from django.db.models import Q
-from django.http import HttpResponse
+from django.core.paginator import Paginator, Page
+from django.http import HttpResponse, Http404
 from django.template import loader
 from django.utils.text import slugify
+from django.utils.http import urlencode
+from django.core.cache import caches
+from django.contrib import messages
 from ninecms.models import Node
 from ninecms.signals import block_signal
+from ninecms.utils.aliases import alias_table, Route
+from ninecms.utils.cache import get_version
+from ninecms.utils.layouts import get_layout_references
+from ninecms.utils.menus import get_menu_tree
+from ninecms.utils.search import get_search_backend, get_cursor, parse_cursor
 from ninecms.forms import ContactForm, LoginForm, SearchForm
+from hashlib import md5
+from pickle import PicklingError
 
 
 # noinspection PyMethodMayBeStatic
@@ -28,10 +38,16 @@ class NodeView(View):
         But if terms are populated in template then this reduces the number of queries to 1 from 2
         Also .prefetch_related('terms__nodes')\ can be added if necessary
         Requires url alias in db without slashes
+        If ALIAS_CACHE is enabled then the alias is resolved from the routing table and the node is fetched by id
         :param alias: a url path alias
         :param request: the request object
         :return: a Node object
         """
+        if settings.ALIAS_CACHE:
+            try:
+                return self.get_node_by_route(self.get_route_by_alias(alias, request))
+            except Http404:  # pragma: nocover
+                pass
         # .prefetch_related('image_set')\
         # .prefetch_related('terms')\
         return Node.objects\
@@ -40,6 +56,42 @@ class NodeView(View):
             .select_related('page_type')\
             .order_by('-language', 'id')[0]
 
+    def get_route_by_alias(self, alias, request):
+        """ Get a node route given a path alias from the alias routing table
+        The route provides the node fields required for access checks and redirects without loading the node
+        :param alias: a url path alias
+        :param request: the request object
+        :return: a Route object
+        """
+        route = alias_table.get(alias, request.LANGUAGE_CODE)
+        if route is None:
+            raise IndexError
+        return route
+
+    def get_node_by_route(self, route):
+        """ Load the node of a route
+        If the node no longer exists then the route is discarded
+        :param route: a Route object
+        :return: a Node object
+        """
+        try:
+            return Node.objects.select_related('page_type').get(id=route.id)
+        except Node.DoesNotExist:  # pragma: nocover
+            alias_table.discard(route.id)
+            raise Http404
+
+    def construct_auth_classes(self, request):
+        """ Construct the body classes that depend on the user authentication state
+        :param request: the request object
+        :return: a classes string
+        """
+        classes = ''
+        if request.user.is_authenticated():
+            classes += ' logged-in'
+        if request.user.is_superuser:
+            classes += ' superuser'
+        return classes
+
     def construct_classes(self, type_classes, request):
         """ Construct default body classes for a page
         :param type_classes: an individual page type name
@@ -48,12 +100,30 @@ class NodeView(View):
         """
         classes = ' '.join(list('page-' + slugify(c) for c in type_classes))
         classes += ' i18n-' + request.LANGUAGE_CODE
-        if request.user.is_authenticated():
-            classes += ' logged-in'
-        if request.user.is_superuser:
-            classes += ' superuser'
+        classes += self.construct_auth_classes(request)
         return classes
 
+    def get_page_cache_key(self, node, request):
+        """ Get the page cache key for a node and a request
+        The page is cached only for anonymous users, as pages of authenticated users may render user specific data
+        The page is not cached if the request has a query string, a form in session or pending messages
+        The key depends on the content version, the node, the language and the path
+        Node changes are covered by the content version, so that a route suffices to find a cached page
+        :param node: the node requested, or its route
+        :param request: the request object
+        :return: a cache key string or None if the page should not be cached
+        """
+        if not settings.PAGE_CACHE_SECONDS or request.method != 'GET' or request.GET:
+            return None
+        if request.user.is_authenticated():
+            return None
+        if 'contact_form_post' in request.session or 'login_form_post' in request.session:
+            return None
+        if len(messages.get_messages(request)):
+            return None
+        key = ':'.join((str(get_version('content')), str(node.id), request.LANGUAGE_CODE, request.path))
+        return 'ninecms_page_%s' % md5(key.encode()).hexdigest()
+
     def session_pop(self, request, key, default):
         """ Return the value of a session key if exists and pop it; otherwise return default
         :param request: request object
@@ -63,9 +133,30 @@ class NodeView(View):
         """
         return request.session.pop(key) if key in request.session else default
 
+    def get_layout(self, page_type):
+        """ Get the layout plan of a page type: its blocks along with their region keys
+        Static block nodes and menu block root items are fetched in the same query
+        The plan is cached until any block or page type changes, or any node or menu item referenced by blocks
+        The references are cached first, so that saving other nodes or menu items keeps the plan, see `layouts`
+        :param page_type: the page type object
+        :return: a list of (region key, block) tuples
+        """
+        cache = caches['default']
+        version = get_version('layout')
+        key = 'ninecms_layout_%s_%d' % (version, page_type.id)
+        layout = cache.get(key)
+        if layout is None:
+            if version is not None:
+                get_layout_references(version)
+            blocks = page_type.blocks.select_related('node', 'menu_item').order_by('id')
+            layout = list((slugify(block.name).replace('-', '_'), block) for block in blocks)
+            cache.set(key, layout)
+        return layout
+
     def construct_context(self, node, request):
         """ Construct the page context
         Render all blocks in a node page
+        Block values are cached according to each block cache settings
         :param node: the node requested
         :param request: the request object
         :return: context dictionary
@@ -83,62 +174,156 @@ class NodeView(View):
 
         # get all elements (block instances) for this page type and append to page context
         # conveniently structure blocks to be able to access by name instead of looping in template
-        for block in node.page_type.blocks.all():
-            reg = slugify(block.name).replace('-', '_')
-            # static node render
-            if block.type == 'static':
-                if block.node.language in (request.LANGUAGE_CODE, '') and block.node.status == 1:
-                    page[reg] = block.node
-            # menu render
-            elif block.type == 'menu':
-                if block.menu_item.language in (request.LANGUAGE_CODE, '') and block.menu_item.disabled == 0:
-                    page[reg] = block.menu_item.get_descendants()
-            # signal (view) render
-            elif block.type == 'signal':
-                responses = block_signal.send(sender=self.__class__, view=block.signal, node=node, request=request)
-                responses = list(filter(lambda response: response[1] is not None, responses))
-                if responses:
-                    page[reg] = responses[-1][1]
-            # contact form render
-            elif block.type == 'contact':
-                page[reg] = ContactForm(self.session_pop(request, 'contact_form_post', None), initial=request.GET)
-            # language menu render
-            elif block.type == 'language':
-                page[reg] = settings.LANGUAGE_MENU_LABELS
-            # login
-            elif block.type == 'login':
-                page[reg] = LoginForm(self.session_pop(request, 'login_form_post', None))
-            # user menu
-            elif block.type == 'user-menu':
-                page[reg] = True
-            # search form
-            elif block.type == 'search':
-                page[reg] = SearchForm(request.GET)
-            # search results
-            elif block.type == 'search-results':
-                form = SearchForm(request.GET)
-                form.is_valid()
-                results = None
-                if 'q' in form.cleaned_data:
-                    q = form.cleaned_data['q']
-                    results = Node.objects.filter(Q(title__icontains=q) | Q(body__icontains=q) |
-                                                  Q(summary__icontains=q) | Q(highlight__icontains=q))
-                    results = {'q': q, 'nodes': results}
-                page[reg] = results
+        cache = caches['default']
+        for reg, block in self.get_layout(node.page_type):
+            key = self.get_block_cache_key(block, request)
+            cached = cache.get(key) if key else None
+            if cached is not None:
+                value = cached[0]
+            else:
+                value = self.construct_block(block, node, request)
+                if key:
+                    try:
+                        # querysets, such as menus, are stored evaluated
+                        cache.set(key, (value,), block.cache_seconds)
+                    except (PicklingError, TypeError, AttributeError):  # pragma: nocover
+                        # eg a signal response that cannot be pickled
+                        pass
+            if value is not None:
+                page[reg] = value
         return page
 
+    def get_block_cache_key(self, block, request):
+        """ Get the cache key for the value of a block, according to the block cache settings
+        Blocks that provide forms are never cached
+        :param block: the block object
+        :param request: the request object
+        :return: a cache key string or None if the block should not be cached
+        """
+        if not block.cache_seconds or block.type in ('contact', 'login', 'search', 'search-results'):
+            return None
+        key = [str(get_version('content')), str(block.id)]
+        if block.cache_vary in ('language', 'auth', 'path'):
+            key.append(request.LANGUAGE_CODE)
+        if block.cache_vary in ('auth', 'path'):
+            key.append(self.construct_auth_classes(request))
+        if block.cache_vary == 'path':
+            key.append(request.path)
+        return 'ninecms_block_%s' % md5(':'.join(key).encode()).hexdigest()
+
+    def construct_block(self, block, node, request):
+        """ Construct the context value of a block
+        :param block: the block object
+        :param node: the node requested
+        :param request: the request object
+        :return: the block value or None if the block is not to be rendered
+        """
+        # static node render
+        if block.type == 'static':
+            if block.node.language in (request.LANGUAGE_CODE, '') and block.node.status == 1:
+                return block.node
+        # menu render
+        elif block.type == 'menu':
+            if block.menu_item.language in (request.LANGUAGE_CODE, '') and block.menu_item.disabled == 0:
+                if settings.MENU_TREES:
+                    return get_menu_tree(block.menu_item, request.LANGUAGE_CODE)
+                return block.menu_item.get_descendants()
+        # signal (view) render
+        elif block.type == 'signal':
+            responses = block_signal.send(sender=self.__class__, view=block.signal, node=node, request=request)
+            responses = list(filter(lambda response: response[1] is not None, responses))
+            if responses:
+                return responses[-1][1]
+        # contact form render
+        elif block.type == 'contact':
+            return ContactForm(self.session_pop(request, 'contact_form_post', None), initial=request.GET)
+        # language menu render
+        elif block.type == 'language':
+            return settings.LANGUAGE_MENU_LABELS
+        # login
+        elif block.type == 'login':
+            return LoginForm(self.session_pop(request, 'login_form_post', None))
+        # user menu
+        elif block.type == 'user-menu':
+            return True
+        # search form
+        elif block.type == 'search':
+            return SearchForm(request.GET)
+        # search results
+        elif block.type == 'search-results':
+            form = SearchForm(request.GET)
+            form.is_valid()
+            if 'q' in form.cleaned_data:
+                return self.construct_search_results(form.cleaned_data['q'], request)
+        return None
+
+    def construct_search_results(self, q, request):
+        """ Construct a page of search results
+        The page size is requested with the `size` parameter, up to SEARCH_RESULTS_MAX_PER_PAGE
+        The page number is requested with the `page` parameter, up to the page of the SEARCH_RESULTS_MAX result
+        If the `after` parameter provides the cursor of the previous page, the page is found by keyset instead of offset
+        :param q: the search query
+        :param request: the request object
+        :return: a dict of the query, the result nodes and the pagination context
+        """
+        results = get_search_backend().search(q, request.LANGUAGE_CODE)
+        size = self.get_int_parameter(request, 'size', settings.SEARCH_RESULTS_PER_PAGE)
+        size = min(size, settings.SEARCH_RESULTS_MAX_PER_PAGE)
+        paginator = Paginator(results.limited(settings.SEARCH_RESULTS_MAX), size)
+        number = min(self.get_int_parameter(request, 'page', 1), paginator.num_pages)
+        cursor = parse_cursor(request.GET.get('after'))
+        if cursor and number > 1:
+            page = Page(results.after(cursor)[:min(size, paginator.count - (number - 1) * size)], number, paginator)
+        else:
+            page = paginator.page(number)
+        query = {'q': q}
+        if 'size' in request.GET:
+            query['size'] = size
+        return {
+            'q': q,
+            'nodes': page.object_list,
+            'page_obj': page,
+            'is_paginated': page.has_other_pages(),
+            'query': urlencode(query) + '&',
+            'cursor': get_cursor(page.object_list[-1]) if page.object_list else '',
+        }
+
+    def get_int_parameter(self, request, name, default):
+        """ Get a positive integer query parameter
+        :param request: the request object
+        :param name: the parameter name
+        :param default: the value if the parameter is missing or invalid
+        :return: integer
+        """
+        try:
+            value = int(request.GET.get(name, default))
+        except ValueError:
+            return default
+        return value if value > 0 else default
+
     def render(self, node, request):
         """
         Render shortcut function
         Select the proper template based on page type and construct context
-        :param node: the node requested
+        If PAGE_CACHE_SECONDS is set then the rendered page is cached, unless the CSRF token has been used
+        :param node: the node requested, or its route
         :param request: the request object
         :return: rendered http response
         """
+        key = self.get_page_cache_key(node, request)
+        if key:
+            content = caches['default'].get(key)
+            if content is not None:
+                return HttpResponse(content)
+        if isinstance(node, Route):
+            node = self.get_node_by_route(node)
         page_type_name = slugify(node.page_type.name).replace('-', '_')
         t = loader.select_template((
             'ninecms/page_%s.html' % page_type_name,
             'ninecms/%s.html' % page_type_name,
             'ninecms/index.html',
         ))
-        return HttpResponse(t.render(self.construct_context(node, request), request))
+        content = t.render(self.construct_context(node, request), request)
+        if key and not request.META.get('CSRF_COOKIE_USED'):
+            caches['default'].set(key, content, settings.PAGE_CACHE_SECONDS)
+        return HttpResponse(content)
@@ -6,40 +6,146 @@ __email__ = 'gkarak@9-dev.com'
 
 from django.utils.html import strip_tags
 from django import forms
+from hashlib import md5
 import bleach
+import re
+import threading
+
+# The tags, attributes and styles allowed in html
+HTML_TAGS = list(bleach.ALLOWED_TAGS) + ['cite', 'dl', 'dt', 'dd', 'p', 'u', 's', 'sub', 'sup', 'img',
+                                         'table', 'thead', 'tbody', 'tr', 'td', 'th', 'hr', 'iframe',
+                                         'h2', 'h3', 'h4', 'h5', 'h6', 'span', 'br']
+HTML_ATTRIBUTES = {
+    'a': ['href', 'title', 'name', 'target', 'class'],
+    'abbr': ['title'],
+    'acronym': ['title'],
+    'p': ['style', 'class'],
+    'img': ['src', 'alt', 'title', 'class'],
+    'iframe': ['src', 'height', 'width', 'class'],
+    'table': ['border', 'cellpadding', 'cellspacing'],
+    'th': ['scope', 'rowspan', 'colspan', 'class'],
+    'td': ['scope', 'rowspan', 'colspan', 'class'],
+    'span': ['style', 'class'],
+    'div': ['style', 'class'],
+}
+HTML_STYLES = ['margin-left', 'text-align', 'width', 'page-break-after', 'display', 'float']
+
+# Characters that bleach escapes, removes or normalizes; text without any of them is returned as is
+MARKUP_RE = re.compile('[<>&\r\x00]')
+
+
+class Cleaner(object):
+    """ A reusable sanitizer for a profile of allowed tags, attributes and styles
+    The bleach cleaner (or with bleach 1.x the html parser) is built once per thread, as it is not thread safe
+    Text without markup is returned without parsing
+    The `version` is a hash of the rules, that changes if the allowed markup or bleach changes
+    """
+    def __init__(self, tags=None, attributes=None, styles=None):
+        """ Initialize the cleaner
+        :param tags: a list of allowed tags, None to strip all tags (plain text)
+        :param attributes: a dict of tag to a list of allowed attributes
+        :param styles: a list of allowed styles
+        :return: None
+        """
+        self.tags = tags
+        self.attributes = attributes
+        self.styles = styles
+        self.local = threading.local()
+        rules = (sorted(tags or ()), sorted((tag, sorted(names)) for tag, names in (attributes or {}).items()),
+                 sorted(styles or ()), getattr(bleach, '__version__', ''))
+        self.version = md5(repr(rules).encode()).hexdigest()[:8]
+
+    def get_clean(self):
+        """ Get the clean function of the current thread, build if necessary
+        :return: a function of text to cleaned text
+        """
+        clean = getattr(self.local, 'clean', None)
+        if clean is None:
+            if hasattr(bleach, 'Cleaner'):
+                clean = bleach.Cleaner(tags=self.tags, attributes=self.attributes, styles=self.styles).clean
+            else:
+                clean = self.get_parser_clean()
+            self.local.clean = clean
+        return clean
+
+    def get_parser_clean(self):
+        """ Build a clean function for bleach 1.x, same as `bleach.clean` with a parser that is built once
+        :return: a function of text to cleaned text
+        """
+        import html5lib
+
+        class Sanitizer(bleach.BleachSanitizer):
+            """ The sanitizing tokenizer of the profile """
+            allowed_elements = self.tags
+            allowed_attributes = self.attributes
+            allowed_css_properties = self.styles
+            strip_disallowed_elements = False
+            strip_html_comments = True
+
+        parser = html5lib.HTMLParser(tokenizer=Sanitizer)
+        # noinspection PyProtectedMember
+        return lambda text: bleach._render(parser.parseFragment(text))
+
+    def clean(self, text):
+        """ Sanitize a text
+        :param text: input text
+        :return: output text
+        """
+        if not text:
+            return text
+        if self.tags is None:
+            return strip_tags(text) if '<' in text else text
+        if not MARKUP_RE.search(text):
+            return text
+        return self.get_clean()(text)
+
+# The cleaner of each sanitize profile
+cleaners = {
+    'plain': Cleaner(),
+    'html': Cleaner(HTML_TAGS, HTML_ATTRIBUTES, HTML_STYLES),
+    'full_html': Cleaner(HTML_TAGS + ['div'], HTML_ATTRIBUTES, HTML_STYLES),
+}
+
+
+def get_profile(allow_html=True, full_html=False):
+    """ Get the name of the sanitize profile for the sanitize options
+    :param allow_html: if false, plain text
+    :param full_html: if true, allow all html tags
+    :return: the profile name
+    """
+    if not allow_html:
+        return 'plain'
+    return 'full_html' if full_html else 'html'
+
+
+def get_signature(profile):
+    """ Get the signature of a sanitize profile, to record along with sanitized text
+    :param profile: the profile name
+    :return: a string of the profile name and version
+    """
+    return '%s:%s' % (profile, cleaners[profile].version)
+
+
+def parse_signature(signature):
+    """ Get the profile name of a recorded signature
+    :param signature: a signature string, may be of an earlier version of the profile
+    :return: the profile name or None if empty or unknown
+    """
+    profile = (signature or '').split(':')[0]
+    return profile if profile in cleaners else None
 
 
 def sanitize(t, allow_html=True, full_html=False):
     """ Bleach clean shortcut function based on pre-defined tags, attributes, styles
     NOTE: the allow_html option makes a strip_tag, not bleach, NEVER expose these values with |safe
     This is because bleach and escape turn all <>& to html entities
+    The cleaner of each profile is prebuilt, see `Cleaner`
     :param t: input text
+    :param allow_html: if false, strip all tags
+    :param full_html: if true, allow all html tags
     :return: output text
     """
-    if not t:
-        return t
-    if not allow_html:
-        return strip_tags(t)
-    allowed_tags = bleach.ALLOWED_TAGS + ['cite', 'dl', 'dt', 'dd', 'p', 'u', 's', 'sub', 'sup', 'img',
-                                          'table', 'thead', 'tbody', 'tr', 'td', 'th', 'hr', 'iframe',
-                                          'h2', 'h3', 'h4', 'h5', 'h6', 'span', 'br']
-    if full_html:
-        allowed_tags += ['div']
-    allowed_attributes = {
-        'a': ['href', 'title', 'name', 'target', 'class'],
-        'abbr': ['title'],
-        'acronym': ['title'],
-        'p': ['style', 'class'],
-        'img': ['src', 'alt', 'title', 'class'],
-        'iframe': ['src', 'height', 'width', 'class'],
-        'table': ['border', 'cellpadding', 'cellspacing'],
-        'th': ['scope', 'rowspan', 'colspan', 'class'],
-        'td': ['scope', 'rowspan', 'colspan', 'class'],
-        'span': ['style', 'class'],
-        'div': ['style', 'class'],
-    }
-    allowed_styles = ['margin-left', 'text-align', 'width', 'page-break-after', 'display', 'float']
-    return bleach.clean(t, tags=allowed_tags, attributes=allowed_attributes, styles=allowed_styles)
+    return cleaners[get_profile(allow_html, full_html)].clean(t)
 
 
 class ModelSanitizeForm(forms.ModelForm):
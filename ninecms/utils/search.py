@@ -0,0 +1,293 @@
+""" Search backends """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, F, Sum, Count
+from django.db.models.functions import Substr
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+from django.utils.module_loading import import_string
+from collections import Counter
+from html import unescape
+import re
+import unicodedata
+from ninecms.models import Node, SearchIndex
+from ninecms.utils.sanitize import sanitize
+from ninecms.utils.transliterate import transliterate
+
+# The relative weight of a term occurrence in each node field
+FIELD_WEIGHTS = (
+    ('title', 5),
+    ('highlight', 3),
+    ('summary', 2),
+    ('body', 1),
+)
+
+# The node fields loaded for listing search results
+RESULT_FIELDS = ('id', 'title', 'alias', 'language')
+
+TERM_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """ Split a text to normalized search terms
+    Html is stripped, entities are unescaped, the text is transliterated to lowercase latin characters and
+    any remaining accents are removed, so that searching for 'καφές', 'kafés' or 'Καφες' gives the same results
+    :param text: the input text, may contain html
+    :return: a list of terms
+    """
+    if not text:
+        return []
+    text = transliterate(unescape(sanitize(text, allow_html=False)), to_lower=True)
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    max_length = SearchIndex._meta.get_field('term').max_length
+    return [term[:max_length] for term in TERM_RE.findall(text) if len(term) > 1]
+
+
+def get_node_terms(node):
+    """ Get the weighted terms of a node
+    :param node: the node object
+    :return: a Counter of term to weight
+    """
+    terms = Counter()
+    for field, weight in FIELD_WEIGHTS:
+        for term in tokenize(getattr(node, field)):
+            terms[term] += weight
+    return terms
+
+
+class SearchResults(object):
+    """ Lazy ranked search results
+    Only the requested slice of nodes is loaded, with only the fields required to list them
+    and an excerpt of their summary, so that memory is bounded by the page size
+    Results can be sliced by offset, eg by a Paginator, or continued after a cursor (keyset pagination)
+    """
+    def __init__(self, ranking, key, limit=None):
+        """ Initialize the results
+        :param ranking: a values queryset of node ids and integer `rank`, ordered by descending rank and ascending id
+        :param key: the name of the node id field in the ranking
+        :param limit: the maximum number of matching nodes to count, None for no limit
+        :return: None
+        """
+        self.ranking = ranking
+        self.key = key
+        self.limit = limit
+
+    def count(self):
+        """ Get the number of matching nodes, up to the limit
+        :return: integer
+        """
+        if self.limit:
+            return self.ranking[:self.limit].count()
+        return self.ranking.count()
+
+    def __len__(self):
+        """ Get the number of matching nodes
+        :return: integer
+        """
+        return self.count()
+
+    def __getitem__(self, k):
+        """ Get a node or a list of nodes by rank
+        Each node has a `rank` and a plain text `excerpt` attribute
+        :param k: an index or a slice
+        :return: a node or a list of nodes
+        """
+        if not isinstance(k, slice):
+            return self[k:k + 1][0]
+        ranks = [(row[self.key], row['rank']) for row in self.ranking[k]]
+        nodes = Node.objects\
+            .only(*RESULT_FIELDS)\
+            .annotate(excerpt_html=Substr('summary', 1, settings.SEARCH_EXCERPT_LENGTH))\
+            .in_bulk([node_id for node_id, rank in ranks])
+        results = []
+        for node_id, rank in ranks:
+            if node_id in nodes:
+                node = nodes[node_id]
+                node.rank = rank
+                node.excerpt = get_excerpt(node.excerpt_html)
+                results.append(node)
+        return results
+
+    def after(self, cursor):
+        """ Get the results that follow a cursor
+        :param cursor: a tuple of the rank and id of the last node of the previous page
+        :return: a SearchResults
+        """
+        rank, node_id = cursor
+        return SearchResults(self.ranking.filter(Q(rank__lt=rank) | Q(rank=rank, **{self.key + '__gt': node_id})),
+                             self.key, self.limit)
+
+    def limited(self, limit):
+        """ Get the same results with a limit on the number of matching nodes to count
+        :param limit: the maximum number of matching nodes
+        :return: a SearchResults
+        """
+        return SearchResults(self.ranking, self.key, limit)
+
+
+def get_excerpt(html):
+    """ Get a plain text excerpt from the beginning of an html text
+    A tag cut at the end of the text is dropped
+    :param html: the html text
+    :return: the excerpt string
+    """
+    if not html:
+        return ''
+    if html.rfind('<') > html.rfind('>'):
+        html = html[:html.rfind('<')]
+    return Truncator(unescape(strip_tags(html))).words(settings.SEARCH_EXCERPT_WORDS)
+
+
+def get_cursor(node):
+    """ Get the keyset pagination cursor of a search result
+    :param node: a node from SearchResults
+    :return: a cursor string
+    """
+    return '%d_%d' % (node.rank, node.id)
+
+
+def parse_cursor(cursor):
+    """ Parse a keyset pagination cursor
+    :param cursor: a cursor string
+    :return: a tuple of rank and node id or None if invalid
+    """
+    try:
+        rank, node_id = cursor.split('_')
+        return int(rank), int(node_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+class SearchBackend(object):
+    """ Base search backend
+    A backend is selected with the SEARCH_BACKEND setting as a dotted path to its class
+    """
+    def search(self, q, language):
+        """ Search published nodes of a language or of no language
+        :param q: the search query
+        :param language: the request language code
+        :return: a SearchResults
+        """
+        raise NotImplementedError
+
+    def update(self, node):
+        """ Update the index of a node when it is saved
+        :param node: the node object
+        :return: None
+        """
+        pass
+
+    def reindex(self, batch_size=500, nodes=None):
+        """ Rebuild the index of all nodes, or of some nodes only
+        :param batch_size: the number of nodes to read or index rows to create in each query
+        :param nodes: a queryset of the nodes to index, None for all nodes
+        :return: the number of nodes indexed
+        """
+        return 0
+
+
+class SimpleSearchBackend(SearchBackend):
+    """ Search backend that matches the query in node fields, with no index
+    Every search scans all nodes and results are ordered by id, newest first
+    """
+    def search(self, q, language):
+        """ Search published nodes that contain the query in any of their text fields
+        :param q: the search query
+        :param language: the request language code
+        :return: a SearchResults
+        """
+        match = Q()
+        for field, weight in FIELD_WEIGHTS:
+            match |= Q(**{field + '__icontains': q})
+        ranking = Node.objects\
+            .filter(match)\
+            .filter(status=True, language__in=(language, ''))\
+            .annotate(rank=F('id'))\
+            .values('id', 'rank')\
+            .order_by('-rank', 'id')
+        return SearchResults(ranking, 'id')
+
+
+class IndexSearchBackend(SearchBackend):
+    """ Search backend that uses an inverted index of terms to nodes, stored in the database
+    Nodes are indexed when saved; the index of existing content is built with the `search_reindex` command
+    Results contain all query terms and are ranked by the sum of the term weights
+    """
+    def search(self, q, language):
+        """ Search published nodes that contain all terms of the query
+        :param q: the search query
+        :param language: the request language code
+        :return: a SearchResults
+        """
+        terms = set(tokenize(q))
+        ranking = SearchIndex.objects\
+            .filter(term__in=terms)\
+            .filter(node__status=True, node__language__in=(language, ''))\
+            .values('node')\
+            .annotate(rank=Sum('weight'), matches=Count('term'))\
+            .filter(matches=len(terms))\
+            .order_by('-rank', 'node')
+        if not terms:
+            ranking = ranking.none()
+        return SearchResults(ranking, 'node')
+
+    def get_entries(self, node):
+        """ Get the index entries of a node
+        :param node: the node object
+        :return: a list of unsaved SearchIndex objects
+        """
+        return [SearchIndex(term=term, node_id=node.id, weight=weight)
+                for term, weight in get_node_terms(node).items()]
+
+    def update(self, node):
+        """ Replace the index entries of a node
+        The entries are deleted in a single query, as no delete signals are bound to the index model
+        :param node: the node object
+        :return: None
+        """
+        with transaction.atomic():
+            SearchIndex.objects.filter(node_id=node.id).delete()
+            SearchIndex.objects.bulk_create(self.get_entries(node))
+
+    def reindex(self, batch_size=500, nodes=None):
+        """ Rebuild the index of all nodes, or of some nodes only, eg after a bulk import
+        Nodes are streamed in batches and only the indexed fields are loaded
+        :param batch_size: the number of nodes to read or index rows to create in each query
+        :param nodes: a queryset of the nodes to index, None for all nodes
+        :return: the number of nodes indexed
+        """
+        fields = ['id'] + [field for field, weight in FIELD_WEIGHTS]
+        count = 0
+        entries = []
+        with transaction.atomic():
+            if nodes is None:
+                nodes = Node.objects.all()
+                SearchIndex.objects.all().delete()
+            else:
+                SearchIndex.objects.filter(node__in=nodes).delete()
+            for node in nodes.only(*fields).order_by('id').iterator():
+                entries.extend(self.get_entries(node))
+                if len(entries) >= batch_size:
+                    SearchIndex.objects.bulk_create(entries, batch_size)
+                    entries = []
+                count += 1
+            SearchIndex.objects.bulk_create(entries, batch_size)
+        return count
+
+
+_backends = {}
+
+
+def get_search_backend():
+    """ Get the search backend instance as defined in settings
+    :return: a SearchBackend
+    """
+    path = settings.SEARCH_BACKEND
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
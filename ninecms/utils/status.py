@@ -9,6 +9,7 @@ from django.core.cache import caches, cache
 from django.contrib.auth.models import User
 from django.core.management import call_command
 from ninecms.models import Node, PageType, Image
+from ninecms.utils.aliases import alias_table
 from subprocess import call, CalledProcessError
 from io import StringIO
 import sys
@@ -186,6 +187,8 @@ def user_stat(user):
 def cache_clear():
     """ Clear cache
     If not working try: (memcached only) cache._cache.flush_all()
+    Also clear the per-process url alias routing table
     :return: None
     """
     cache.clear()
+    alias_table.clear()
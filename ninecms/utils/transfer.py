@@ -0,0 +1,572 @@
+""" Bulk content import and export """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction, DatabaseError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Case, When, Value, IntegerField, CharField, Q
+from django.utils import timezone
+from collections import Counter
+from datetime import datetime
+from functools import reduce
+from operator import or_
+from uuid import uuid4
+import csv
+import json
+from ninecms.models import Node, NodeRevision, PageType, TaxonomyTerm, MenuItem, ContentBlock, Image, File, Video
+from ninecms.signals import clear_content_caches
+from ninecms.utils.aliases import prepare_aliases, complete_aliases, UPDATE_BATCH_SIZE
+from ninecms.utils.perms import get_users_with_perm
+from ninecms.utils.sanitize import cleaners
+from ninecms.utils.search import get_search_backend
+
+# The node fields that can be imported, besides `page_type` and `user`, which are given by name
+NODE_FIELDS = ('language', 'title', 'status', 'promote', 'sticky', 'created', 'summary', 'body', 'highlight', 'link',
+               'weight', 'alias', 'redirect')
+
+# The revision fields that can be imported, besides `user`; missing fields are copied from the node
+REVISION_FIELDS = ('log_entry', 'title', 'status', 'promote', 'sticky', 'summary', 'body', 'highlight', 'link')
+
+# The record key, model and fields of each media type; the first field is the file name in the media storage
+MEDIA_TYPES = (
+    ('images', Image, ('image', 'title', 'group')),
+    ('files', File, ('file', 'title', 'group')),
+    ('videos', Video, ('video', 'title', 'group', 'type', 'media')),
+)
+
+# The fields of the other exported models; references to nodes, terms and menu items are by exported id
+PAGE_TYPE_FIELDS = ('name', 'description', 'guidelines', 'url_pattern')
+TERM_FIELDS = ('name', 'weight')
+MENU_ITEM_FIELDS = ('weight', 'language', 'path', 'title', 'disabled')
+BLOCK_FIELDS = ('name', 'type', 'classes', 'signal', 'cache_seconds', 'cache_vary')
+
+# The separator of list values (terms and media) in csv columns
+LIST_SEPARATOR = '|'
+
+
+def read_jsonl(lines):
+    """ Read records from JSON Lines, one json object per line
+    Empty lines are skipped; a malformed line raises ValueError
+    :param lines: an iterable of lines, eg a text file
+    :return: a generator of record dicts
+    """
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(lines):
+    """ Read records from csv with a header row of field names
+    Empty values are skipped, so that the field defaults apply
+    Terms and media are lists of names separated by LIST_SEPARATOR
+    :param lines: an iterable of lines, eg a text file opened with `newline=''`
+    :return: a generator of record dicts
+    """
+    list_keys = ('terms',) + tuple(key for key, model, fields in MEDIA_TYPES)
+    for row in csv.DictReader(lines):
+        record = {key: value for key, value in row.items() if key and value}
+        for key in list_keys:
+            if key in record:
+                record[key] = [value.strip() for value in record[key].split(LIST_SEPARATOR) if value.strip()]
+        yield record
+
+
+def get_field_values(model, fields, record):
+    """ Convert the values of a record for model fields
+    Strings are converted with the field `to_python`, eg from csv; naive datetimes get the current timezone
+    :param model: the model class
+    :param fields: the field names to read from the record
+    :param record: the record dict
+    :return: a dict of field values
+    """
+    values = {}
+    for name in fields:
+        if name in record:
+            value = model._meta.get_field(name).to_python(record[name])
+            if settings.USE_TZ and isinstance(value, datetime) and timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            values[name] = value
+    return values
+
+
+class NodeImporter(object):
+    """ Bulk import of nodes with their revisions, terms and media references
+    Records are imported in batches, each in a transaction: nodes are inserted with `bulk_create`,
+    their aliases are rendered as in `Node.save` with a fixed number of queries per batch
+    and revisions, term links and media rows are inserted with `bulk_create` as well
+    No model signals are sent; the content caches are cleared and the imported nodes are indexed once at the end
+    Records of page types, taxonomy terms, menu items and blocks, as written by `export_records`, are imported too
+    Records that cannot be imported are skipped and listed in `errors`
+    """
+    def __init__(self, user=None, batch_size=500, revisions=True, reindex=True):
+        """ Initialize the importer
+        :param user: the default user of records that have no user
+        :param batch_size: the number of records per batch
+        :param revisions: create revisions, a single one for records that have no revisions
+        :param reindex: update the search index of the imported nodes at the end
+        :return: None
+        """
+        self.user = user
+        self.batch_size = batch_size
+        self.revisions = revisions
+        self.reindex = reindex
+        self.count = 0
+        self.errors = []
+        self.imported_ids = []
+        self.page_types = {}
+        self.users = {}
+        self.terms = None
+        self.full_html_users = None
+        self.node_ids = {}
+        self.translations = []
+        self.deferred = []
+
+    def run(self, records):
+        """ Import records
+        Each record is a dict of node fields, `page_type` name, `user` name, `terms` as a list of term names,
+        `images`, `files` and `videos` as lists of file names in the media storage or dicts of media fields,
+        and `revisions` as a list of dicts of revision fields
+        Terms are found by name, and created as root terms if missing
+        Records with a `model` other than 'node' are imported after all nodes, so that they can refer to them
+        If reading the records fails, the batches already imported are kept and the side effects still run
+        :param records: an iterable of record dicts, eg from `read_jsonl` or `read_csv`
+        :return: the number of nodes imported
+        """
+        self.full_html_users = get_users_with_perm('use_full_html')
+        batch = []
+        try:
+            for number, record in enumerate(records, 1):
+                model = record.get('model', 'node')
+                if model == 'node':
+                    batch.append((number, record))
+                elif model == 'page_type':
+                    self.import_page_type(record)
+                elif model in ('term', 'menu_item', 'block'):
+                    self.deferred.append((number, record))
+                else:
+                    self.errors.append((number, "Unknown model '%s'." % model))
+                if len(batch) >= self.batch_size:
+                    self.import_batch(batch)
+                    batch = []
+            self.import_batch(batch)
+            if self.deferred or self.translations:
+                self.import_deferred()
+        finally:
+            if self.count or self.deferred:
+                self.finish()
+        return self.count
+
+    def import_batch(self, batch):
+        """ Import a batch of records in a transaction
+        :param batch: a list of tuples of record number and record
+        :return: None
+        """
+        items = []
+        for number, record in batch:
+            try:
+                items.append(self.build(record) + (record,))
+            except (KeyError, TypeError, ValueError, ValidationError) as e:
+                self.add_error(number, e)
+        if not items:
+            return
+        nodes = [node for node, related, record in items]
+        with transaction.atomic():
+            pending = prepare_aliases(nodes)
+            self.create_nodes(nodes)
+            complete_aliases(pending)
+            related = {}
+            for node, objects, record in items:
+                for obj in objects:
+                    obj.node_id = node.id
+                    related.setdefault(type(obj), []).append(obj)
+                if 'id' in record:
+                    self.node_ids[record['id']] = node.id
+                if record.get('original_translation'):
+                    self.translations.append((node.id, record['original_translation']))
+            for model, objects in related.items():
+                model.objects.bulk_create(objects)
+        self.count += len(nodes)
+        self.imported_ids.extend(node.id for node in nodes)
+
+    def create_nodes(self, nodes):
+        """ Insert nodes and set their ids
+        If the database does not return the ids of inserted rows (all databases before Django 1.10),
+        the nodes are inserted with aliases that are unique to the batch and their ids are read back by alias
+        in a single query, so that rows inserted concurrently are never matched
+        The aliases are then restored in batches of UPDATE_BATCH_SIZE in a single query each
+        :param nodes: a list of unsaved nodes
+        :return: None
+        """
+        if getattr(connection.features, 'can_return_ids_from_bulk_insert', False):
+            Node.objects.bulk_create(nodes)
+            return
+        aliases = [node.alias for node in nodes]
+        marker = 'import:%s:' % uuid4().hex
+        for i, node in enumerate(nodes):
+            node.alias = '%s%d' % (marker, i)
+        try:
+            Node.objects.bulk_create(nodes)
+            ids = dict(Node.objects.filter(alias__startswith=marker).values_list('alias', 'id'))
+        finally:
+            for node, alias in zip(nodes, aliases):
+                node.alias = alias
+        if len(ids) != len(nodes):
+            raise DatabaseError("Inserted %d nodes, found %d." % (len(nodes), len(ids)))
+        for i, node in enumerate(nodes):
+            node.id = ids['%s%d' % (marker, i)]
+        for i in range(0, len(nodes), UPDATE_BATCH_SIZE):
+            batch = nodes[i:i + UPDATE_BATCH_SIZE]
+            Node.objects\
+                .filter(id__in=[node.id for node in batch])\
+                .update(alias=Case(*[When(id=node.id, then=Value(node.alias)) for node in batch],
+                                   output_field=CharField()))
+
+    def build(self, record):
+        """ Build the unsaved node of a record and its related objects
+        The html fields are sanitized with the full html profile if the user has permission to use it
+        :param record: the record dict
+        :return: a tuple of the node and a list of related objects with no node id
+        """
+        values = get_field_values(Node, NODE_FIELDS, record)
+        if not values.get('title'):
+            raise ValueError("Record has no title.")
+        node = Node(page_type=self.get_page_type(record.get('page_type')), user_id=self.get_user_id(record.get('user')),
+                    **values)
+        profile = 'full_html' if node.user_id in self.full_html_users else 'html'
+        node.sanitize_html(profile)
+        related = []
+        if self.revisions:
+            related.extend(self.build_revision(node, profile, revision) for revision in record.get('revisions') or [{}])
+        for key, model, fields in MEDIA_TYPES:
+            for item in record.get(key, []):
+                media = get_field_values(model, fields, item if isinstance(item, dict) else {fields[0]: item})
+                if not media.get(fields[0]):
+                    raise ValueError("Media in '%s' has no %s." % (key, fields[0]))
+                related.append(model(**media))
+        related.extend(TaxonomyTerm.nodes.through(taxonomyterm_id=term_id)
+                       for term_id in set(self.get_term_id(name) for name in record.get('terms', [])))
+        return node, related
+
+    def build_revision(self, node, profile, record):
+        """ Build an unsaved revision of a node
+        :param node: the node
+        :param profile: the sanitize profile of the node
+        :param record: the revision dict; missing fields are copied from the node
+        :return: a NodeRevision with no node id
+        """
+        values = get_field_values(NodeRevision, REVISION_FIELDS, record)
+        for field in ('summary', 'body'):
+            if field in values:
+                values[field] = cleaners[profile].clean(values[field])
+        for field in REVISION_FIELDS[1:]:
+            values.setdefault(field, getattr(node, field))
+        values.setdefault('log_entry', "Imported")
+        user_id = self.get_user_id(record['user']) if record.get('user') else node.user_id
+        return NodeRevision(user_id=user_id, **values)
+
+    def add_error(self, number, e):
+        """ Record the error of a record that has been skipped
+        :param number: the record number
+        :param e: the exception
+        :return: None
+        """
+        self.errors.append((number, '; '.join(e.messages) if isinstance(e, ValidationError) else str(e)))
+
+    def import_page_type(self, record):
+        """ Create a page type, unless one with the same name exists
+        :param record: the record dict
+        :return: None
+        """
+        values = get_field_values(PageType, PAGE_TYPE_FIELDS, record)
+        name = values.pop('name')
+        self.page_types[name] = PageType.objects.get_or_create(name=name, defaults=values)[0]
+
+    def import_deferred(self):
+        """ Import the records of taxonomy terms, menu items and blocks, in a transaction, after all nodes
+        Trees are updated once for all terms and menu items that are created
+        Nodes are linked to the terms in a single query and the node translations are set in batches
+        of UPDATE_BATCH_SIZE in a single query each
+        :return: None
+        """
+        term_ids = {}
+        menu_item_ids = {}
+        links = []
+        with transaction.atomic():
+            with TaxonomyTerm.objects.delay_mptt_updates(), MenuItem.objects.delay_mptt_updates():
+                for number, record in self.deferred:
+                    try:
+                        if record['model'] == 'term':
+                            term_id = self.import_term(record, term_ids)
+                            links.extend(TaxonomyTerm.nodes.through(taxonomyterm_id=term_id, node_id=self.node_ids[i])
+                                         for i in set(record.get('nodes', [])) if i in self.node_ids)
+                        elif record['model'] == 'menu_item':
+                            values = get_field_values(MenuItem, MENU_ITEM_FIELDS, record)
+                            menu_item_ids[record['id']] = MenuItem.objects.create(
+                                parent_id=menu_item_ids.get(record.get('parent')), **values).id
+                        else:
+                            self.import_block(record, menu_item_ids)
+                    except (KeyError, TypeError, ValueError, ValidationError) as e:
+                        self.add_error(number, e)
+            TaxonomyTerm.nodes.through.objects.bulk_create(links)
+            translations = [(node_id, self.node_ids[original]) for node_id, original in self.translations
+                            if original in self.node_ids]
+            for i in range(0, len(translations), UPDATE_BATCH_SIZE):
+                batch = translations[i:i + UPDATE_BATCH_SIZE]
+                Node.objects\
+                    .filter(id__in=[node_id for node_id, original in batch])\
+                    .update(original_translation=Case(*[When(id=node_id, then=Value(original))
+                                                        for node_id, original in batch],
+                                                      output_field=IntegerField()))
+
+    def import_term(self, record, term_ids):
+        """ Import a taxonomy term, unless a term with the same name and parent exists
+        :param record: the record dict
+        :param term_ids: the dict of exported to imported term ids, updated
+        :return: the term id
+        """
+        values = get_field_values(TaxonomyTerm, TERM_FIELDS, record)
+        parent_id = term_ids.get(record.get('parent'))
+        term = TaxonomyTerm.objects.filter(parent_id=parent_id, name=values['name']).first()
+        if term is None:
+            term = TaxonomyTerm.objects.create(parent_id=parent_id,
+                                               description_node_id=self.node_ids.get(record.get('description_node')),
+                                               **values)
+        term_ids[record['id']] = term.id
+        return term.id
+
+    def import_block(self, record, menu_item_ids):
+        """ Import a content block with its page types, unless a block with the same name exists
+        :param record: the record dict
+        :param menu_item_ids: the dict of exported to imported menu item ids
+        :return: None
+        """
+        values = get_field_values(ContentBlock, BLOCK_FIELDS, record)
+        if values.get('name') and ContentBlock.objects.filter(name=values['name']).exists():
+            raise ValueError("Block '%s' exists." % values['name'])
+        page_types = [self.get_page_type(name) for name in record.get('page_types', [])]
+        block = ContentBlock.objects.create(node_id=self.node_ids.get(record.get('node')),
+                                            menu_item_id=menu_item_ids.get(record.get('menu_item')), **values)
+        block.page_types.add(*page_types)
+
+    def get_page_type(self, name):
+        """ Get a page type by name
+        :param name: the page type name
+        :return: a PageType
+        """
+        if name not in self.page_types:
+            page_type = PageType.objects.filter(name=name).first()
+            if page_type is None:
+                raise ValueError("Page type '%s' does not exist." % name)
+            self.page_types[name] = page_type
+        return self.page_types[name]
+
+    def get_user_id(self, username):
+        """ Get the id of a user by username, or of the default user
+        :param username: the username or None
+        :return: the user id
+        """
+        if not username:
+            if self.user is None:
+                raise ValueError("Record has no user and no default user is set.")
+            return self.user.id
+        if username not in self.users:
+            user_id = User.objects.filter(username=username).values_list('id', flat=True).first()
+            if user_id is None:
+                raise ValueError("User '%s' does not exist." % username)
+            self.users[username] = user_id
+        return self.users[username]
+
+    def get_term_id(self, name):
+        """ Get the id of a term by name, the first in tree order; create a root term if missing
+        All terms are loaded in a single query on first use
+        :param name: the term name
+        :return: the term id
+        """
+        if self.terms is None:
+            self.terms = {}
+            for term_name, term_id in TaxonomyTerm.objects.order_by('tree_id', 'lft').values_list('name', 'id'):
+                self.terms.setdefault(term_name, term_id)
+        if name not in self.terms:
+            self.terms[name] = TaxonomyTerm.objects.create(name=name).id
+        return self.terms[name]
+
+    def finish(self):
+        """ Run the side effects deferred for the whole import
+        The url alias table, menu, layout and page caches are cleared and the imported nodes are indexed,
+        by id in batches of UPDATE_BATCH_SIZE nodes
+        Image metadata and styles are not recorded; use the `image_metadata` and `image_styles` commands
+        :return: None
+        """
+        clear_content_caches()
+        if self.reindex:
+            backend = get_search_backend()
+            for i in range(0, len(self.imported_ids), UPDATE_BATCH_SIZE):
+                backend.reindex(self.batch_size, Node.objects.filter(id__in=self.imported_ids[i:i + UPDATE_BATCH_SIZE]))
+
+
+class RecordEncoder(DjangoJSONEncoder):
+    """ Json encoder that keeps the microseconds of datetimes, which `DjangoJSONEncoder` truncates """
+    def default(self, o):
+        """ Encode datetimes in full iso format
+        :param o: the object to encode
+        :return: a json serializable value
+        """
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super(RecordEncoder, self).default(o)
+
+
+def keyset_chunks(queryset, fields, size):
+    """ Read a values queryset in chunks of ascending key, with a single query per chunk
+    Unlike `iterator()`, which most database drivers fetch whole, memory is bounded by the chunk size
+    :param queryset: a values queryset that includes the key fields; the chunks can be changed when consumed
+    :param fields: the key field names, unique together, eg ('id',) or ('tree_id', 'lft') for tree order
+    :param size: the maximum length of each chunk
+    :return: a generator of lists of value dicts
+    """
+    queryset = queryset.order_by(*fields)
+    chunk = list(queryset[:size])
+    while chunk:
+        last = dict((field, chunk[-1][field]) for field in fields)
+        yield chunk
+        after = reduce(or_, (Q(**dict([(field, last[field]) for field in fields[:i]] +
+                                      [(fields[i] + '__gt', last[fields[i]])]))
+                             for i in range(len(fields))))
+        chunk = list(queryset.filter(after)[:size])
+
+
+def get_record(values, model=None):
+    """ Get an export record from model values, without empty strings and nulls to keep it compact
+    :param values: the dict of values
+    :param model: the record model name, None for records nested in a node record
+    :return: the record dict
+    """
+    record = {'model': model} if model else {}
+    record.update((key, value) for key, value in values.items() if value not in ('', None))
+    return record
+
+
+def export_page_types():
+    """ Export all page types
+    :return: a generator of records
+    """
+    for values in PageType.objects.order_by('id').values(*PAGE_TYPE_FIELDS).iterator():
+        yield get_record(values, 'page_type')
+
+
+def export_nodes(chunk_size=500):
+    """ Export all nodes with their revisions and media references
+    Nodes are read in chunks of ascending id, with a single query per chunk for each related model,
+    so that memory is bounded by the chunk size
+    :param chunk_size: the number of nodes per query
+    :return: a generator of records
+    """
+    nodes = Node.objects.values('id', 'page_type__name', 'user__username', 'original_translation', *NODE_FIELDS)
+    for chunk in keyset_chunks(nodes, ('id',), chunk_size):
+        ids = [values['id'] for values in chunk]
+        related = {node_id: {} for node_id in ids}
+        revisions = NodeRevision.objects\
+            .filter(node_id__in=ids)\
+            .order_by('id')\
+            .values('node_id', 'user__username', 'created', *REVISION_FIELDS)
+        for values in revisions.iterator():
+            values['user'] = values.pop('user__username')
+            related[values.pop('node_id')].setdefault('revisions', []).append(get_record(values))
+        for key, model, fields in MEDIA_TYPES:
+            for values in model.objects.filter(node_id__in=ids).order_by('id').values('node_id', *fields).iterator():
+                item = get_record(values)
+                node_id = item.pop('node_id')
+                related[node_id].setdefault(key, []).append(item if len(item) > 1 else item[fields[0]])
+        for values in chunk:
+            values['page_type'] = values.pop('page_type__name')
+            values['user'] = values.pop('user__username')
+            record = get_record(values, 'node')
+            record.update(related[values['id']])
+            yield record
+
+
+def export_terms(chunk_size=500):
+    """ Export all taxonomy terms in tree order, so that parents precede their children, with their node ids
+    Terms are read in chunks of tree order, with a single query per chunk for their nodes
+    :param chunk_size: the number of terms per query
+    :return: a generator of records
+    """
+    terms = TaxonomyTerm.objects.values('id', 'parent', 'description_node', 'tree_id', 'lft', *TERM_FIELDS)
+    for chunk in keyset_chunks(terms, ('tree_id', 'lft'), chunk_size):
+        nodes = {}
+        links = TaxonomyTerm.nodes.through.objects\
+            .filter(taxonomyterm_id__in=[values['id'] for values in chunk])\
+            .order_by('node_id')\
+            .values_list('taxonomyterm_id', 'node_id')
+        for term_id, node_id in links.iterator():
+            nodes.setdefault(term_id, []).append(node_id)
+        for values in chunk:
+            del values['tree_id'], values['lft']
+            values['nodes'] = nodes.get(values['id'], [])
+            yield get_record(values, 'term')
+
+
+def export_menu_items(chunk_size=500):
+    """ Export all menu items in tree order, so that parents precede their children
+    Menu items are read in chunks of tree order
+    :param chunk_size: the number of menu items per query
+    :return: a generator of records
+    """
+    menu_items = MenuItem.objects.values('id', 'parent', 'tree_id', 'lft', *MENU_ITEM_FIELDS)
+    for chunk in keyset_chunks(menu_items, ('tree_id', 'lft'), chunk_size):
+        for values in chunk:
+            del values['tree_id'], values['lft']
+            yield get_record(values, 'menu_item')
+
+
+def export_blocks(chunk_size=500):
+    """ Export all content blocks with the names of the page types they are placed in
+    Blocks are read in chunks of ascending id, with a single query per chunk for their page types
+    :param chunk_size: the number of blocks per query
+    :return: a generator of records
+    """
+    blocks = ContentBlock.objects.values('id', 'node', 'menu_item', *BLOCK_FIELDS)
+    for chunk in keyset_chunks(blocks, ('id',), chunk_size):
+        page_types = {}
+        layouts = ContentBlock.page_types.through.objects\
+            .filter(contentblock_id__in=[values['id'] for values in chunk])\
+            .order_by('pagetype_id')\
+            .values_list('contentblock_id', 'pagetype__name')
+        for block_id, name in layouts.iterator():
+            page_types.setdefault(block_id, []).append(name)
+        for values in chunk:
+            values['page_types'] = page_types.get(values['id'], [])
+            yield get_record(values, 'block')
+
+
+def export_records(chunk_size=500):
+    """ Export all content: page types, nodes, taxonomy terms, menu items and blocks, in this order,
+    as the records that `NodeImporter` imports
+    Media files are referred to by name; copy the media storage along
+    :param chunk_size: the number of records per query
+    :return: a generator of records
+    """
+    yield from export_page_types()
+    yield from export_nodes(chunk_size)
+    yield from export_terms(chunk_size)
+    yield from export_menu_items(chunk_size)
+    yield from export_blocks(chunk_size)
+
+
+def write_jsonl(records, f):
+    """ Write records as JSON Lines, one compact json object per line
+    :param records: an iterable of record dicts
+    :param f: a text file
+    :return: a Counter of the records written per model
+    """
+    count = Counter()
+    for record in records:
+        f.write(json.dumps(record, cls=RecordEncoder, ensure_ascii=False, separators=(',', ':')) + '\n')
+        count[record.get('model', 'node')] += 1
+    return count
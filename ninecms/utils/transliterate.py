@@ -5,70 +5,127 @@ __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
 from django.conf import settings
+from collections import OrderedDict
+
+
+_languages = OrderedDict()
+_tables = {}
+
+
+def register_language(code, chars=('', ''), multiple=((), ())):
+    """ Register the transliteration rules of a language
+    Languages registered first take precedence for characters that more languages transliterate
+    Registering a code again replaces its rules, keeping its precedence
+    :param code: the language code, eg el
+    :param chars: a tuple of a string of characters and a string of their single character transliterations
+    :param multiple: a tuple of a sequence of characters and a sequence of their multiple character transliterations
+    :return: None
+    """
+    _languages[code] = (chars, multiple)
+    _tables.clear()
+
+
+def unregister_language(code):
+    """ Remove the transliteration rules of a language
+    :param code: the language code
+    :return: None
+    """
+    _languages.pop(code, None)
+    _tables.clear()
+
+
+def get_languages():
+    """ Get the codes of the active transliteration languages, in order of precedence
+    All registered languages are active, unless restricted by the TRANSLITERATE_LANGUAGES setting
+    :return: a tuple of language codes
+    """
+    active = settings.TRANSLITERATE_LANGUAGES
+    if active is None:
+        return tuple(_languages)
+    return tuple(code for code in _languages if code in active)
+
+
+register_language(
+    'el',
+    ('αβγδεζηικλμνξοπρστυφωΑΒΓΔΕΖΗΙΚΛΜΝΞΟΠΡΣΤΥΦΩάέίήύόώϊϋΐΰςΆΈΊΉΎΌΏ',
+     'abgdeziiklmnxoprstyfoABGDEZIIKLMNXOPRSTYFOaeiiyooiyiysAEIIYOO'),
+    (('θ',  'χ',  'ψ',  'Θ',  'Χ',  'Ψ'),
+     ('th', 'ch', 'ps', 'Th', 'Ch', 'Ps')),
+)
+register_language(
+    'rs',
+    ('абвгдезијклмнопрстуфхцАБВГДЕЗИЈКЛМНОПРСТУФХЦ',
+     'abvgdezijklmnoprstufhcABVGDEZIJKLMNOPRSTUFHC'),
+    (('ђ',  'ж',  'љ',  'њ',  'ћ', 'ч',  'џ',  'ш',  'Ђ',  'Ж',  'Љ',  'Њ',  'Ћ', 'Ч',  'Џ',  'Ш'),
+     ('dj', 'zh', 'lj', 'nj', 'c', 'ch', 'dz', 'sh', 'Dj', 'Zh', 'Lj', 'Nj', 'C', 'Ch', 'Dz', 'Sh')),
+)
+register_language(
+    'rs_latin',
+    multiple=(('đ',  'ž',  'ć', 'č',  'š',  'Đ',  'Ž',  'Ć', 'Č',  'Š'),
+              ('dj', 'zh', 'c', 'ch', 'sh', 'Dj', 'Zh', 'C', 'Ch', 'Sh')),
+)
+register_language(
+    'ru',
+    ('абвгдезийклмнопрстуфхъыьАБВГДЕЗИЙКЛМНОПРСТУФХЪЫЬ',
+     'abvgdezijklmnoprstufh_y_ABVGDEZIJKLMNOPRSTUFH_Y_'),
+    (('ж',  'ц',  'ч',  'ш',  'щ',   'ю',  'я',  'Ж',  'Ц',  'Ч',  'Ш',  'Щ',   'Ю',  'Я'),
+     ('zh', 'ts', 'ch', 'sh', 'sch', 'ju', 'ja', 'Zh', 'Ts', 'Ch', 'Sh', 'Sch', 'Ju', 'Ja')),
+)
+register_language(
+    'bg',
+    ('абвгдезийклмнопрстуфхАБВГДЕЗИЙКЛМНОПРСТУФХ',
+     'abvgdeziyklmnoprstufhABVGDEZIYKLMNOPRSTUFH'),
+    (('ж',  'ц',  'ч',  'ш',  'щ',   'ю',  'я',  'Ж',  'Ц',  'Ч',  'Ш',  'Щ',   'Ю',  'Я'),
+     ('zh', 'ts', 'ch', 'sh', 'sht', 'yu', 'ya', 'Zh', 'Ts', 'Ch', 'Sh', 'Sht', 'Yu', 'Ya')),
+)
+
+
+def compile_table(languages, filename, remove, replace):
+    """ Compile the transliterations of languages and the punctuation rules in a single translate table
+    All rules replace single characters, so their sequence is composed per character:
+    the first single character mapping of a character applies, otherwise the first multiple character mapping,
+    and then the punctuation rules apply to the result
+    :param languages: the codes of the languages to transliterate, in order of precedence
+    :param filename: if true, the punctuation rule for file names
+    :param remove: the characters to remove
+    :param replace: a tuple of the characters to replace and their replacements, if not filename
+    :return: a dict for str.translate
+    """
+    table = {}
+    for code in languages:
+        source, target = _languages[code][0]
+        for char, value in zip(source, target):
+            table.setdefault(char, value)
+    for code in languages:
+        sources, targets = _languages[code][1]
+        for char, value in zip(sources, targets):
+            table.setdefault(char, value)
+    if filename:
+        remove += '/\\?%*:|"<>'
+        punctuation = str.maketrans({' ': '_'})
+    else:
+        punctuation = str.maketrans(replace[0], replace[1])
+    punctuation.update({ord(char): None for char in remove})
+    chars = set(table) | set(chr(code) for code in punctuation)
+    return {ord(char): table.get(char, char).translate(punctuation) for char in chars}
 
 
 def transliterate(s, filename=False, to_lower=False):
     """ Transliterate unicode characters
-    Currently supporting Greek, Serbian, Russian, Bulgarian
+    Built-in languages are Greek, Serbian, Russian and Bulgarian, see `register_language`
     Priority by order
+    The rules are compiled once per active languages and punctuation settings, see `compile_table`
     :param s: the string to transliterate
     :param filename: if true, different rule for punctuation is followed
     :param to_lower: convert to lowercase
     :return: the transliterated string
     """
-    mapping = {
-        'el': (
-            'αβγδεζηικλμνξοπρστυφωΑΒΓΔΕΖΗΙΚΛΜΝΞΟΠΡΣΤΥΦΩάέίήύόώϊϋΐΰςΆΈΊΉΎΌΏ',
-            'abgdeziiklmnxoprstyfoABGDEZIIKLMNXOPRSTYFOaeiiyooiyiysAEIIYOO',
-        ),
-        'rs': (
-            'абвгдезијклмнопрстуфхцАБВГДЕЗИЈКЛМНОПРСТУФХЦ',
-            'abvgdezijklmnoprstufhcABVGDEZIJKLMNOPRSTUFHC',
-        ),
-        'ru': (
-            'абвгдезийклмнопрстуфхъыьАБВГДЕЗИЙКЛМНОПРСТУФХЪЫЬ',
-            'abvgdezijklmnoprstufh_y_ABVGDEZIJKLMNOPRSTUFH_Y_',
-        ),
-        'bg': (
-            'абвгдезийклмнопрстуфхАБВГДЕЗИЙКЛМНОПРСТУФХ',
-            'abvgdeziyklmnoprstufhABVGDEZIYKLMNOPRSTUFH',
-        ),
-    }
-    ext_mapping = {
-        'el': (
-            ('θ',  'χ',  'ψ',  'Θ',  'Χ',  'Ψ'),
-            ('th', 'ch', 'ps', 'Th', 'Ch', 'Ps')
-        ),
-        'rs': (
-            ('ђ',  'ж',  'љ',  'њ',  'ћ', 'ч',  'џ',  'ш',  'Ђ',  'Ж',  'Љ',  'Њ',  'Ћ', 'Ч',  'Џ',  'Ш'),
-            ('dj', 'zh', 'lj', 'nj', 'c', 'ch', 'dz', 'sh', 'Dj', 'Zh', 'Lj', 'Nj', 'C', 'Ch', 'Dz', 'Sh'),
-        ),
-        'rs_latin': (
-            ('đ',  'ž',  'ć', 'č',  'š',  'Đ',  'Ž',  'Ć', 'Č',  'Š'),
-            ('dj', 'zh', 'c', 'ch', 'sh', 'Dj', 'Zh', 'C', 'Ch', 'Sh'),
-        ),
-        'ru': (
-            ('ж',  'ц',  'ч',  'ш',  'щ',   'ю',  'я',  'Ж',  'Ц',  'Ч',  'Ш',  'Щ',   'Ю',  'Я'),
-            ('zh', 'ts', 'ch', 'sh', 'sch', 'ju', 'ja', 'Zh', 'Ts', 'Ch', 'Sh', 'Sch', 'Ju', 'Ja'),
-        ),
-        'bg': (
-            ('ж',  'ц',  'ч',  'ш',  'щ',   'ю',  'я',  'Ж',  'Ц',  'Ч',  'Ш',  'Щ',   'Ю',  'Я'),
-            ('zh', 'ts', 'ch', 'sh', 'sht', 'yu', 'ya', 'Zh', 'Ts', 'Ch', 'Sh', 'Sht', 'Yu', 'Ya'),
-        ),
-    }
-    for lang in mapping:
-        s = s.translate(str.maketrans(mapping[lang][0], mapping[lang][1]))
-    for lang in ext_mapping:
-        for i, val in enumerate(ext_mapping[lang][0]):
-            s = s.replace(ext_mapping[lang][0][i], ext_mapping[lang][1][i])
     # "'`,.-_:;|{[}]+=*&%^$#@!~()?<>/\
-    remove = settings.TRANSLITERATE_REMOVE
-    if filename:
-        remove += '/\?%*:|"<>'
-        s = s.replace(' ', '_')
-    else:
-        s = s.translate(str.maketrans(settings.TRANSLITERATE_REPLACE[0], settings.TRANSLITERATE_REPLACE[1]))
-    s = s.translate({ord(i): None for i in remove})
+    key = (get_languages(), filename, settings.TRANSLITERATE_REMOVE, tuple(settings.TRANSLITERATE_REPLACE))
+    table = _tables.get(key)
+    if table is None:
+        table = _tables[key] = compile_table(*key)
+    s = s.translate(table)
     if to_lower:
         s = s.lower()
     return s
@@ -4,10 +4,11 @@ __copyright__ = 'Copyright 2015, George Karakostas'
 __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.generic import View
 from django.template import loader
-from django.http import Http404
+from django.http import Http404, JsonResponse
 from django.core.mail import mail_managers, BadHeaderError
 from django.core.exceptions import PermissionDenied
 from django.contrib import messages
@@ -16,7 +17,9 @@ from django.contrib.auth.models import Group
 from django.utils.translation import ugettext as _
 from ninecms.utils.render import NodeView
 from ninecms.utils.perms import get_perms, set_perms
+from ninecms.utils.manytomany import autocomplete_sources
 from ninecms.utils import status
+from ninecms.signals import clear_content_caches
 from ninecms.models import Node, PageType, MenuItem
 from ninecms.forms import ContactForm, LoginForm, RedirectForm, ContentTypePermissionsForm
 
@@ -40,7 +43,9 @@ class ContentNodeView(NodeView):
 
 
 class AliasView(NodeView):
-    """ Render content based on Url Alias """
+    """ Render content based on Url Alias
+    If ALIAS_CACHE is enabled then the checks use the node route and the node is loaded only if the page is rendered
+    """
     def get(self, request, **kwargs):
         """ HTML get for /<url_alias>
         :param request: the request object
@@ -52,7 +57,10 @@ class AliasView(NodeView):
             if alias == '/':
                 return redirect('ninecms:index', permanent=True)  # pragma: no cover
             try:
-                node = self.get_node_by_alias(alias, request)
+                if settings.ALIAS_CACHE:
+                    node = self.get_route_by_alias(alias, request)
+                else:
+                    node = self.get_node_by_alias(alias, request)
             except IndexError:
                 raise Http404
             if not node.status and not request.user.has_perm('ninecms.view_unpublished'):
@@ -72,7 +80,10 @@ class IndexView(NodeView):
         :return: response object
         """
         try:
-            node = self.get_node_by_alias('/', request)
+            if settings.ALIAS_CACHE:
+                node = self.get_route_by_alias('/', request)
+            else:
+                node = self.get_node_by_alias('/', request)
         except IndexError:
             messages.warning(request, "No front page has been created yet.")
             return redirect('admin:index')
@@ -219,8 +230,41 @@ class StatusView(View):
         if 'menu-rebuild' in request.POST:
             # noinspection PyUnresolvedReferences
             MenuItem.objects.rebuild()
+            clear_content_caches()
             messages.success(request, _("Menu has been rebuilt."))
         if 'clear-cache' in request.POST:
             status.cache_clear()
             messages.success(request, _("Cache has been cleared."))
         return redirect('admin:index')
+
+
+class AutocompleteView(View):
+    """ Search the records of an autocomplete widget by prefix at /cms/autocomplete/<source>/ """
+    def get(self, request, **kwargs):
+        """ Json get for /cms/autocomplete/<source>/?term=<prefix>&page=<page>
+        Only the pk and label of a page of records are loaded
+        :param request: the request object
+        :param kwargs: contains source
+        :return: json response with the `results` as id and text and whether there are `more`
+        """
+        source = autocomplete_sources.get(kwargs['source'])
+        if source is None:
+            raise Http404
+        if source.permission and not request.user.has_perm(source.permission):
+            raise PermissionDenied
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        size = settings.AUTOCOMPLETE_RESULTS_PER_PAGE
+        records = source.queryset
+        term = request.GET.get('term', '').strip()
+        if term:
+            records = records.filter(**{source.search_field + '__istartswith': term})
+        records = list(records
+                       .order_by(source.search_field, 'pk')
+                       .values_list('pk', source.search_field)[(page - 1) * size:page * size + 1])
+        return JsonResponse({
+            'results': [{'id': pk, 'text': label} for pk, label in records[:size]],
+            'more': len(records) > size,
+        })